@@ -9,6 +9,12 @@ from pathlib import Path
 import matplotlib
 from IPython.display import HTML
 import requests
+import sys
+sys.path.append('../..')
+from gsod import archive, inventory, koppen, registry, spatial, stats, trace
+
+# record the time, rows and memory of every stage (summary at the end)
+tracer = trace.enable()
 
 # plotting options
 get_ipython().magic('matplotlib inline')
@@ -19,33 +25,12 @@ get_ipython().magic('matplotlib inline')
 
 # My first step is to find interesting stations and one of the requirements is to find some that have a good time range coverage so I will evaluate the files downloaded.
 
-# Reading the stations coordinates CSV
+# Reading the stations coordinates CSV. The station registry parses it once into a typed table and caches it in binary format next to the CSV. The coordinates are already corrected dividing the lat/lon by 1000 and the elevation by 10, the table is indexed by a unique `usaf-wban` id and any station that doesn't have a location to use is dropped.
 
 # In[2]:
 
-stations = pd.read_csv(
-    '../../data/ncdc/ish-history.csv',
-    skiprows=1, 
-    names=['usaf','wban','stname','ctry','fips','state','call','lat' ,'lon' ,'elev'],
-    dtype=object)
+stations = registry.load('../../data/ncdc/ish-history.csv')
 print (len(stations))
-stations[:3]
-
-
-# Get correct coordinates dividing the lat/lon by 1000 and the elevation by 10. Then generate a unique index and a column that specficies if the id is from a USAF station or from WBAN. Finally drop any station that doesn't have a location to use.
-
-# In[3]:
-
-stations['lat'] = stations.lat.apply(lambda lat: float(lat)/1000)
-stations['lon'] = stations.lon.apply(lambda lon: float(lon)/1000)
-stations['elev'] = stations.elev.apply(lambda e: float(e)/10.0)
-
-
-# In[4]:
-
-stations['id']     = stations.apply(lambda row : "{}-{}".format(row.usaf,row.wban),axis=1)
-stations.set_index(['id'],inplace=True)
-stations.dropna(how='any',subset=['lat','lon'],inplace=True)
 stations.head()
 
 
@@ -63,75 +48,48 @@ stations.tail()
 p = Path('../../data/ncdc')
 
 
-# Check if we have already the stations CSV or generate it from the files. To generate the CSV the name file will be inspected but also a full read of the file will be performed in order to count the number of observations on every station.
+# Check if we have already the stations CSV or generate it from the files. When the raw files are available the CSV is refreshed, counting again only the files that are new or changed since the last run (tracked on `gsod.manifest.csv`). To generate the CSV the name file will be inspected but also the lines of every file are counted (on raw bytes, in parallel) in order to get the number of observations on every station.
 
 # In[7]:
 
 gsodCSV = p.joinpath('gsod.csv')
-if not gsodCSV.exists():
-    ops = p.joinpath('raw').joinpath('gsod').glob('**/*.op')
-    agsod = []
-
-    for op in ops:
-        try:
-            data = op.name.replace('.op','').split('-')
-            data.append(sum(1 for line in op.open( encoding='utf8' ))-1)
-            agsod.append(data)
-        except UnicodeDecodeError:
-          print (op.absolute())
-    dfGsod = pd.DataFrame(data = agsod, columns=['usaf','wban','year','obs'])
-    dfGsod['id'] = dfGsod.apply(lambda row: "{}-{}".format(row.usaf,row.wban) ,axis=1)
-    dfGsod = dfGsod.set_index(['id'])
-    dfGsod[['year','obs']].to_csv(str(gsodCSV))
+rawGsod = p.joinpath('raw').joinpath('gsod')
+if rawGsod.exists():
+    inventory.refresh_inventory(rawGsod, gsodCSV)
 
 
 
 # In[8]:
 
-print ('Reading existing stations per year CSV')
-dfGsod = pd.read_csv(str(gsodCSV),index_col=['id'])
+print ('Reading existing stations per year CSV (or its 7z archive)')
+dfGsod = archive.read_csv(gsodCSV,index_col=['id'])
 print ("{:,} station files".format(len(dfGsod)))
 print ("{:,} observations".format(dfGsod.obs.sum()))
 dfGsod.head()
 
 
-#### Year statistics per station
+#### Year and observation statistics per station
 
-# Now study this dataframe, grouping by id and see the total years recorded, max and min
+# Now study this dataframe, grouping by id and see the total years recorded, max and min, the total of observations and the coverage (share of the years between the first and the last one with data). All of them come out of a single grouping pass.
 
 # In[9]:
 
-year_groups = dfGsod[['year']].groupby(level=0)
-year_count  = year_groups.count()
-year_max    = year_groups.max()
-year_min    = year_groups.min()
-
-years = pd.concat([year_count,year_max,year_min],axis=1)
-years.columns = ['count','max','min']
+years = stats.station_stats(dfGsod)
 years.head()
 
 
-#### Count observations per station
-
-# In[10]:
-
-obs_groups = dfGsod[['obs']].groupby(level=0)
-obs_count = obs_groups.sum()
-obs_count.head()
-
-
 #### Join stations and observations statistics
 
 # Now we can check if the indexes of both data frames are unique and then join them to retreive only the stations with observations
 
 # In[11]:
 
-stations.index.is_unique and years.index.is_unique and obs_count.index.is_unique
+stations.index.is_unique and years.index.is_unique
 
 
 # In[12]:
 
-scdf = pd.concat([stations,years,obs_count],axis=1,join='inner')
+scdf = stats.join_stations(stations, years)
 scdf.head()
 
 
@@ -151,7 +109,7 @@ scdf.to_csv('stations.csv')
 HTML('<iframe width="100%" height="520" frameborder="0" src="https://team.cartodb.com/u/jsanz/viz/bd9456f8-6530-11e5-b18a-0e0c41326911/embed_map" allowfullscreen webkitallowfullscreen mozallowfullscreen oallowfullscreen msallowfullscreen></iframe>')
 
 
-# To get those stations back to this notebook I will use CartoDB SQL API so I will execute this SQL using the CSV format so it can be read directly into a Pandas DataFrame.
+# To get those stations back to this notebook the same selection is run locally when the Köppen-Geiger regions are available on disk (`data/climate_regions.geojson`, the `climate_regions` table exported as GeoJSON): the stations are tagged with the regions that contain them using a spatial index and the same filters are applied. Otherwise I will use CartoDB SQL API so I will execute this SQL using the CSV format so it can be read directly into a Pandas DataFrame.
 # 
 # ```
 # WITH regions AS (
@@ -178,8 +136,15 @@ HTML('<iframe width="100%" height="520" frameborder="0" src="https://team.cartod
 
 # In[15]:
 
-query = 'https://jsanz.cartodb.com/api/v1/sql?format=csv&q=WITH+regions+AS+(%0A++SELECT+*,%0A++CASE+GRIDCODE+%0A++++WHEN+31+THEN+%27Cfa%27%0A++++WHEN+32+THEN+%27Cfb%27%0A++++WHEN+33+THEN+%27Cfc%27%0A++++WHEN+34+THEN+%27Csa%27%0A++++WHEN+35+THEN+%27Csb%27%0A++++WHEN+36+THEN+%27Csc%27%0A++++ELSE+%27NA%27+%0A++END+cat%0A++FROM+climate_regions+%0A++WHERE+gridcode+>%3D+31+and+gridcode+<%3D+36%0A),+wstations+AS+(+%0A++SELECT+s.id,+r.cat%0A++FROM+jsanz.stations+s+%0A++JOIN+regions+r+ON+ST_Intersects(s.the_geom,r.the_geom)%0A++WHERE+count+>%3D+40+AND+elev+<+500%0A)%0A++select+id,+string_agg(cat,%27,+%27)+cat+from+wstations+group+by+id'
-selections = pd.read_csv(query,index_col=['id'])
+regionsPath = Path('../../data/climate_regions.geojson')
+if regionsPath.exists():
+    regions = spatial.load_regions(regionsPath)
+    candidates = koppen.filter_stations(scdf, min_count=40, max_elev=500)
+    pairs = koppen.filter_stations(koppen.intersect(candidates, regions), gridcodes=range(31,37))
+    selections = pairs.groupby(level=0).koppen.agg(', '.join).to_frame('cat')
+else:
+    query = 'https://jsanz.cartodb.com/api/v1/sql?format=csv&q=WITH+regions+AS+(%0A++SELECT+*,%0A++CASE+GRIDCODE+%0A++++WHEN+31+THEN+%27Cfa%27%0A++++WHEN+32+THEN+%27Cfb%27%0A++++WHEN+33+THEN+%27Cfc%27%0A++++WHEN+34+THEN+%27Csa%27%0A++++WHEN+35+THEN+%27Csb%27%0A++++WHEN+36+THEN+%27Csc%27%0A++++ELSE+%27NA%27+%0A++END+cat%0A++FROM+climate_regions+%0A++WHERE+gridcode+>%3D+31+and+gridcode+<%3D+36%0A),+wstations+AS+(+%0A++SELECT+s.id,+r.cat%0A++FROM+jsanz.stations+s+%0A++JOIN+regions+r+ON+ST_Intersects(s.the_geom,r.the_geom)%0A++WHERE+count+>%3D+40+AND+elev+<+500%0A)%0A++select+id,+string_agg(cat,%27,+%27)+cat+from+wstations+group+by+id'
+    selections = pd.read_csv(query,index_col=['id'])
 selections.head()
 
 
@@ -223,3 +188,12 @@ scdfc_group_cat
 scdfc_group_count = scdfc.groupby(['count']).size()
 scdfc_group_count
 
+
+# ### Stage timings
+
+# Wall and CPU time, rows and memory of the stages run above, also saved as a Chrome trace that can be opened in `chrome://tracing`
+
+# In[ ]:
+
+tracer.write('../../data/ncdc/trace-eda.json')
+tracer.to_frame().reindex(columns=['stage','seconds','cpu_seconds','rows','bytes','peak_rss'])
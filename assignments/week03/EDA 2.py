@@ -9,6 +9,14 @@ from pathlib import Path
 import matplotlib
 from IPython.display import HTML
 import requests
+import sys
+sys.path.append('../..')
+from gsod import archive, cache, cube, features, inventory, koppen, neighbours, pipeline, quantiles, registry, selection, spatial, stats, store, trace
+
+# record the time, rows and memory of every stage (summary at the end)
+tracer = trace.enable()
+# derived dataframes are cached by the hash of their inputs, parameters and code
+stageCache = cache.Cache('../../data/ncdc/cache')
 from datetime import datetime
 
 
@@ -16,33 +24,12 @@ from datetime import datetime
 
 # My first step is to find interesting stations and one of the requirements is to find some that have a good time range coverage so I will evaluate the files downloaded.
 
-# Reading the stations coordinates CSV
+# Reading the stations coordinates CSV. The station registry parses it into a typed table, and like every dataframe derived below it is kept in the stage cache (`gsod.cache`, Parquet files under `data/ncdc/cache`) keyed by the contents of its inputs, so running the notebook again only parses it when `ish-history.csv` changed, and then the stages that depend on it run again too. The coordinates are already corrected dividing the lat/lon by 1000 and the elevation by 10, the table is indexed by a unique `usaf-wban` id and any station that doesn't have a location to use is dropped.
 
 # In[2]:
 
-stations = pd.read_csv(
-    '../../data/ncdc/ish-history.csv',
-    skiprows=1, 
-    names=['usaf','wban','stname','ctry','fips','state','call','lat' ,'lon' ,'elev'],
-    dtype=object)
+stations = stageCache.stage('stations', registry.parse, Path('../../data/ncdc/ish-history.csv'))
 print (len(stations))
-stations[:3]
-
-
-# Get correct coordinates dividing the lat/lon by 1000 and the elevation by 10. Then generate a unique index and a column that specficies if the id is from a USAF station or from WBAN. Finally drop any station that doesn't have a location to use.
-
-# In[3]:
-
-stations['lat'] = stations.lat.apply(lambda lat: float(lat)/1000)
-stations['lon'] = stations.lon.apply(lambda lon: float(lon)/1000)
-stations['elev'] = stations.elev.apply(lambda e: float(e)/10.0)
-
-
-# In[4]:
-
-stations['id']     = stations.apply(lambda row : "{}-{}".format(row.usaf,row.wban),axis=1)
-stations.set_index(['id'],inplace=True)
-stations.dropna(how='any',subset=['lat','lon'],inplace=True)
 stations.head()
 
 
@@ -60,75 +47,48 @@ stations.tail()
 p = Path('../../data/ncdc')
 
 
-# Check if we have already the stations CSV or generate it from the files. To generate the CSV the name file will be inspected but also a full read of the file will be performed in order to count the number of observations on every station.
+# Check if we have already the stations CSV or generate it from the files. When the raw files are available the CSV is refreshed, counting again only the files that are new or changed since the last run (tracked on `gsod.manifest.csv`). To generate the CSV the name file will be inspected but also the lines of every file are counted (on raw bytes, in parallel) in order to get the number of observations on every station.
 
 # In[7]:
 
 gsodCSV = p.joinpath('gsod.csv')
-if not gsodCSV.exists():
-    ops = p.joinpath('raw').joinpath('gsod').glob('**/*.op')
-    agsod = []
-
-    for op in ops:
-        try:
-            data = op.name.replace('.op','').split('-')
-            data.append(sum(1 for line in op.open( encoding='utf8' ))-1)
-            agsod.append(data)
-        except UnicodeDecodeError:
-          print (op.absolute())
-    dfGsod = pd.DataFrame(data = agsod, columns=['usaf','wban','year','obs'])
-    dfGsod['id'] = dfGsod.apply(lambda row: "{}-{}".format(row.usaf,row.wban) ,axis=1)
-    dfGsod = dfGsod.set_index(['id'])
-    dfGsod[['year','obs']].to_csv(str(gsodCSV))
+rawGsod = p.joinpath('raw').joinpath('gsod')
+if rawGsod.exists():
+    inventory.refresh_inventory(rawGsod, gsodCSV)
 
 
 
 # In[8]:
 
-print ('Reading existing stations per year CSV')
-dfGsod = pd.read_csv(str(gsodCSV),index_col=['id'])
+print ('Reading existing stations per year CSV (or its 7z archive)')
+dfGsod = stageCache.stage('dfGsod', archive.read_csv, gsodCSV, index_col=['id'])
 print ("{:,} station files".format(len(dfGsod)))
 print ("{:,} observations".format(dfGsod.obs.sum()))
 dfGsod.head()
 
 
-#### Year statistics per station
+#### Year and observation statistics per station
 
-# Now study this dataframe, grouping by id and see the total years recorded, max and min
+# Now study this dataframe, grouping by id and see the total years recorded, max and min, the total of observations and the coverage (share of the years between the first and the last one with data). All of them come out of a single grouping pass.
 
 # In[9]:
 
-year_groups = dfGsod[['year']].groupby(level=0)
-year_count  = year_groups.count()
-year_max    = year_groups.max()
-year_min    = year_groups.min()
-
-years = pd.concat([year_count,year_max,year_min],axis=1)
-years.columns = ['count','max','min']
+years = stageCache.stage('years', stats.station_stats, dfGsod)
 years.head()
 
 
-#### Count observations per station
-
-# In[10]:
-
-obs_groups = dfGsod[['obs']].groupby(level=0)
-obs_count = obs_groups.sum()
-obs_count.head()
-
-
 #### Join stations and observations statistics
 
 # Now we can check if the indexes of both data frames are unique and then join them to retreive only the stations with observations
 
 # In[11]:
 
-stations.index.is_unique and years.index.is_unique and obs_count.index.is_unique
+stations.index.is_unique and years.index.is_unique
 
 
 # In[12]:
 
-scdf = pd.concat([stations,years,obs_count],axis=1,join='inner')
+scdf = stageCache.stage('scdf', stats.join_stations, stations, years)
 scdf.head()
 
 
@@ -136,7 +96,16 @@ scdf.head()
 
 # In[13]:
 
-scdf.to_csv('stations.csv')
+stats.write_stations(scdf, 'stations.csv')
+
+
+# The stations around any place can also be looked up here: `gsod.neighbours` indexes their positions on a k-d tree and answers the nearest stations or those within a radius (in km) of many points at once, with the same `count`/`elev` filters used to pick them. For example the 5 stations with at least 20 years of observations closest to Valencia.
+
+# In[ ]:
+
+stationSearch = neighbours.StationSearch(scdf)
+stationSearch.nearest(39.49, -0.47, k=5, min_count=20).merge(
+    scdf[['stname','count','elev']], left_on='id', right_index=True)
 
 
 #### Get preferred stations
@@ -148,7 +117,7 @@ scdf.to_csv('stations.csv')
 HTML('<iframe width="100%" height="520" frameborder="0" src="https://team.cartodb.com/u/jsanz/viz/c9d103fe-6ab1-11e5-b45b-0e674067d321/embed_map" allowfullscreen webkitallowfullscreen mozallowfullscreen oallowfullscreen msallowfullscreen></iframe>')
 
 
-# To get those stations back to this notebook I will use CartoDB SQL API so I will execute this SQL using the CSV format so it can be read directly into a Pandas DataFrame.
+# To get those stations back to this notebook the same ranking is run locally when the Köppen-Geiger regions are available on disk (`data/climate_regions.geojson`, the `climate_regions` table exported as GeoJSON): the stations are tagged with the regions that contain them and the top 2 per region are picked with `gsod.selection`. Otherwise I will use CartoDB SQL API so I will execute this SQL using the CSV format so it can be read directly into a Pandas DataFrame.
 # 
 # ```
 # WITH ranked AS (
@@ -170,8 +139,16 @@ HTML('<iframe width="100%" height="520" frameborder="0" src="https://team.cartod
 
 # In[15]:
 
-query = 'https://jsanz.cartodb.com/api/v1/sql?format=csv&q=WITH+ranked+AS+(%0A++SELECT+%0A++s.id,+r.gridcode,%0A++rank()+over+(partition+by+r.gridcode+order+by+s.count+desc,+s.elev+asc)+pos%0A++FROM+stations+s+%0A++JOIN+climate_regions+r+ON+ST_Intersects(s.the_geom,r.the_geom)%0A),+filtered+as+(%0A++SELECT+%0A++r.id,k.koppen%0A++,rank()+over+(partition+by+r.id+order+by+k.koppen)+pos%0A++FROM+ranked+r%0A++JOIN+koppen+k+ON+r.gridcode+%3D+k.gridcode%0A++WHERE+pos+%3C+3+%0A)+%0ASELECT+id,koppen%0AFROM+filtered+WHERE+POS+%3D+1'
-selections = pd.read_csv(query,index_col=['id'])
+regionsPath = Path('../../data/climate_regions.geojson')
+def top_stations(scdf, regionsPath):
+    pairs = koppen.intersect(scdf, spatial.load_regions(regionsPath))
+    return selection.top_stations(scdf, pairs, k=2, by=['count','elev'], ascending=[False,True])
+
+if regionsPath.exists():
+    selections = stageCache.stage('selections', top_stations, scdf, regionsPath)
+else:
+    query = 'https://jsanz.cartodb.com/api/v1/sql?format=csv&q=WITH+ranked+AS+(%0A++SELECT+%0A++s.id,+r.gridcode,%0A++rank()+over+(partition+by+r.gridcode+order+by+s.count+desc,+s.elev+asc)+pos%0A++FROM+stations+s+%0A++JOIN+climate_regions+r+ON+ST_Intersects(s.the_geom,r.the_geom)%0A),+filtered+as+(%0A++SELECT+%0A++r.id,k.koppen%0A++,rank()+over+(partition+by+r.id+order+by+k.koppen)+pos%0A++FROM+ranked+r%0A++JOIN+koppen+k+ON+r.gridcode+%3D+k.gridcode%0A++WHERE+pos+%3C+3+%0A)+%0ASELECT+id,koppen%0AFROM+filtered+WHERE+POS+%3D+1'
+    selections = stageCache.stage('selections', pd.read_csv, query, index_col=['id'])
 
 
 # Check if the index of the imported dataframe is unique and then join it with our stations dataset. This join will keep only data on both data frames using the parameter `join='inner'`.
@@ -183,7 +160,7 @@ selections.index.is_unique
 
 # In[17]:
 
-scdfc = pd.concat([scdf,selections],axis=1,join='inner')
+scdfc = stageCache.stage('scdfc', stats.join_stations, scdf, selections)
 
 
 #### Getting the observations for the selected stations
@@ -194,149 +171,95 @@ scdfc = pd.concat([scdf,selections],axis=1,join='inner')
 
 files_to_read = pd.merge(left=dfGsod,right=scdfc,left_index=True,right_index=True,)[['year']]
 files_to_read['id'] = files_to_read.index
-files_to_read['path'] = files_to_read.apply(lambda row: Path('../../data/ncdc/raw/gsod').joinpath("{0}/{1}-{0}.op".format(row.year,row.id)),axis=1)
+files_to_read['path'] = files_to_read.apply(lambda row: rawGsod.joinpath("{0}/{1}-{0}.op".format(row.year,row.id)),axis=1)
 print ("{} files to read".format(len(files_to_read)))
 
 
-# Read the files defined previously and store the results on a new big data frame and CSV adding the *Köppen* classification
+# Read the files defined previously and store the results on a partitioned Parquet dataset (by year and Köppen class) adding the *Köppen* classification. Files are parsed in batches of 500 with the vectorized fixed-width reader from `gsod.reader`, streaming them from NOAA's yearly `gsod_YYYY.tar` archives when they have not been extracted, and the class of every batch is looked up at once on an index of the selected stations keyed by their packed USAF/WBAN numbers. Batches run on a pool of workers with a bounded number of them in flight so memory stays under the given ceiling (6 GB) and the peak memory used is reported at the end. Meanwhile the temperatures of every station, year and class are summarised in mergeable quantile sketches (t-digests) saved next to the store, and a cube of monthly aggregates (count, sum, sum of squares, min and max of the temperatures and days with every weather flag, per station) is built to answer the grouped statistics below without scanning the observations; new files are merged into it with `cube.update`.
 
 # In[19]:
 
-def getId(stn,wban):
-    try:
-        istn = int(stn)
-        iwban = int(wban)
-        return "{:0>6}-{:0>5}".format(istn,iwban)
-    except ValueError:
-        print("{}/{}".format(stn,wban))
-        
-def getStationByStnWban(stn,wban):
-    try:
-        koppen = scdfc.loc[getId(stn,wban)].koppen
-    except KeyError:
-        koppen = None
-    return koppen        
+koppenIndex = koppen.KoppenIndex.from_frame(scdfc)
 
 
 # In[ ]:
 
-observationsCSV = p.joinpath('observations.csv')
-if not observationsCSV.exists():
-    i = 0
-    acc = 0
-    for index,row in files_to_read.iterrows():
-        path = row['path']
-        if path.exists():
-            dfObsTemp = pd.read_fwf(
-                    str(path),
-                    colspecs=[(0,7),(7,13),(14,18),(18,22),(25,30),(31,33),(35,41),
-                              (42,44),(46,52),(53,55),(57,63),(64,66),(68,73),(74,76),
-                              (78,84),(84,86),(88,93),(95,100),(102,108),(108,109),
-                              (110,116),(116,117),(118,123),(123,124),(125,130),(132,138)],
-                    skiprows=1,
-                    names=['stn','wban','year','monthday','temp','temp_count',
-                           'dewp','dewp_count','slp','slp_count','stp','stp_count',
-                           'visib','visib_count','wsdp','wsdp_count','mxspd',
-                           'gust','max','max_flag','min','min_flag','prcp','prc_flag','sndp','frshtt']
-                    )
-            dfObsTemp['koppen'] = dfObsTemp.apply(lambda row: getStationByStnWban(row.stn,row.wban),axis=1)
-            dfObsTemp.to_csv(str(observationsCSV),mode='a')
-
-            i += 1
-            acc += len (dfObsTemp)
-
-            if i % 1000 == 0:
-                print("{:>8} obs".format(acc))
+observationsStore = p.joinpath('observations')
+tempSketchesPath = p.joinpath('observations.tdigest.pkl')
+cubePath = p.joinpath('observations.cube.parquet')
+tempSketches = obsCube = None
+if not store.exists(observationsStore):
+    tempSketches = quantiles.SketchSet()
+    report, obsCube = pipeline.ingest(files_to_read['path'], koppenIndex, observationsStore,
+                                      batch_size=500, memory_limit=6 * 2**30, raw=rawGsod,
+                                      sketches=tempSketches, aggregate=cube.build, combine=cube.combine)
+    tempSketches.save(tempSketchesPath)
+    cube.save(obsCube, cubePath)
+elif tempSketchesPath.exists():
+    tempSketches = quantiles.SketchSet.load(tempSketchesPath)
 
 
 # In[ ]:
 
-print ('Reading observations CSV')
-dfObs = pd.read_csv(str(observationsCSV),index_col=0)
-dfObs = dfObs[(dfObs.stn != 'stn')]
-print ("{:,} observations".format(len(dfObs)))
-dfObs.head()
+def compact_observations(observationsStore):
+    print ('Reading observations store')
+    dfObs = store.read(observationsStore,
+                       columns=['stn','wban','year','monthday','temp','max','min','frshtt','koppen'])
+    print ("{:,} observations".format(len(dfObs)))
+    return features.compact(dfObs).set_index(['key','date'])
 
 
 #### Performing data management operations on the dataset
 
-# Now that we have the raw dataset, we can start doing management operations. First generate a copy dataframe with only the columns we are interested in.
-
-# In[ ]:
-
-dfObs2 = dfObs.copy()[['stn','wban','year','monthday','temp','max','min','frshtt','koppen']]
+# Now that we have the raw dataset, we can start doing management operations. Only the columns we are interested in were read from the store, and the result is kept in a compact layout so the whole dataset fits in memory several times over.
 
 
 ##### Management
 
-# Generate an index using the id station and the date
+# Generate an index using the station and the date: the station is its packed USAF/WBAN number (`features.station_id` turns it back into the `usaf-wban` id) and the date is stored as days since 1970 (`features.from_days`). The occurrence of the different weather conditions of the `frshtt` column is packed in one byte per day, read with `features.flag` and counted with `features.flag_counts`. The Köppen class is categorical and the temperatures are recoded to Celsius as float32, replacing the missing values with NaN. All of it is computed column-wise by `gsod.features`, and the result is kept in the stage cache keyed by the files of the store, so the store is only read again after a new ingest.
 
 # In[ ]:
 
-def getDateTimeFromRow(row):
-    try:
-        iyear = int(row.year)
-        imonth = int("{:0>4}".format(row.monthday)[0:2])
-        iday = int("{:0>4}".format(row.monthday)[2:4])
-        return  datetime(iyear,imonth,iday)
-    except ValueError:
-        return np.nan
+dfObs2 = stageCache.stage('dfObs2', compact_observations, observationsStore)
+print ("{:.1f} MiB".format(dfObs2.memory_usage(deep=True).sum() / 2**20))
+dfObs2.head()
 
-dfObs2['id']   = dfObs2.apply(lambda row: getId(row.stn,row.wban) ,axis=1)
-dfObs2['date'] = dfObs2.apply(lambda row : getDateTimeFromRow(row),axis=1)
-dfObs2.set_index(['id','date'],inplace=True)
 
+##### Frequency tables
 
-# The `frshtt` column needs to be padded with zeros to get all the flags in the correct place. Then is possible to get the occurrence of different weather conditions
+# Frequency tables for koppen, thunders, tornados that are categorized
 
 # In[ ]:
 
-dfObs2['frshtt']  = dfObs2.apply(lambda row: "{:0>6}".format(row.frshtt),axis=1)
-dfObs2['fog']     = dfObs2['frshtt'].apply(lambda row: row[0:1]=='1')
-dfObs2['rain']    = dfObs2['frshtt'].apply(lambda row: row[1:2]=='1')
-dfObs2['snow']    = dfObs2['frshtt'].apply(lambda row: row[2:3]=='1')
-dfObs2['hail']    = dfObs2['frshtt'].apply(lambda row: row[3:4]=='1')
-dfObs2['thunder'] = dfObs2['frshtt'].apply(lambda row: row[4:5]=='1')
-dfObs2['tornado'] = dfObs2['frshtt'].apply(lambda row: row[5:6]=='1')
-
+dfObs2.koppen.value_counts(normalize=True)*100
 
-# Recode the temperatures columns, replacing the NaN values and afterwards as numerics
 
 # In[ ]:
 
-dfObs2['tempC'] = dfObs2['temp'].replace('99.9', np.nan)
-dfObs2['maxC']  = dfObs2['max'].replace('99.9', np.nan)
-dfObs2['minC']  = dfObs2['min'].replace('99.9', np.nan)
+features.flag_counts(dfObs2.frshtt, 'tornado', normalize=True)*100
 
-dfObs2['tempC'] = dfObs2['tempC'].convert_objects(convert_numeric=True) / 10
-dfObs2['maxC']  = dfObs2['maxC'].convert_objects(convert_numeric=True) / 10
-dfObs2['minC']  = dfObs2['minC'].convert_objects(convert_numeric=True) / 10
-
-
-##### Frequency tables
-
-# Frequency tables for koppen, thunders, tornados that are categorized
 
 # In[ ]:
 
-dfObs.koppen.value_counts(normalize=True)*100
+features.flag_counts(dfObs2.frshtt, 'thunder', normalize=True)*100
 
 
-# In[ ]:
-
-dfObs2.tornado.value_counts(normalize=True)*100
-
+# Categorize the temperatures by quantiles and then make the frequency table to confirm the categorization. The quartiles come from merging the sketches filled during the ingest (built here when the store predates them) instead of sorting the whole column; the sketch of any slice, e.g. one Köppen class, is `tempSketches.merged(koppen='Cfb')`, merged once per class and kept.
 
 # In[ ]:
 
-dfObs2.thunder.value_counts(normalize=True)*100
+if tempSketches is None:
+    sketchKeys = pd.DataFrame({'key': dfObs2.index.get_level_values('key'),
+                               'year': dfObs2.year.values, 'koppen': dfObs2.koppen.values})
+    tempSketches = quantiles.SketchSet().update(sketchKeys, dfObs2.tempC.values)
+    tempSketches.save(tempSketchesPath)
+tempDigest = tempSketches.merged()
+quantiles.cut_points(tempDigest)
 
 
-# Categorize the temperatures by quantiles and then make the frequency table to confirm the categorization
-
 # In[ ]:
 
-dfObs2['temp4']=pd.qcut(dfObs2.tempC, 4, labels=["1=0%tile","2=25%tile","3=50%tile","4=75%tile"])
+dfObs2['temp4']=quantiles.qcut(dfObs2.tempC, tempDigest, 4, labels=["1=0%tile","2=25%tile","3=50%tile","4=75%tile"])
 dfObs2['temp4'].value_counts(normalize=True)*100
 
 
@@ -349,10 +272,20 @@ dfObs2[['tempC']].max()
 
 # In[ ]:
 
-group_by_year= dfObs2[['year','tempC','koppen']].groupby(['year','koppen'])
+if obsCube is None:
+    obsCube = cube.load(cubePath) if cubePath.exists() else cube.update(cubePath, cube.build(dfObs2))
 
 
 # In[ ]:
 
-group_by_year.agg([np.max,np.std])
+cube.rollup(obsCube, ['year','koppen'], ['tempC'], stats=['max','std'])
+
+
+# ### Stage timings
+
+# Wall and CPU time, rows and memory of the stages run above, also saved as a Chrome trace that can be opened in `chrome://tracing`
+
+# In[ ]:
 
+tracer.write('../../data/ncdc/trace-eda2.json')
+tracer.to_frame().reindex(columns=['stage','seconds','cpu_seconds','rows','bytes','peak_rss'])
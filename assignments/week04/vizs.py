@@ -11,16 +11,30 @@ import seaborn as sns
 import matplotlib.pyplot as plt
 import warnings
 warnings.filterwarnings('ignore')
+import sys
+sys.path.append('../..')
+from gsod import climatology, features, plots, timeseries, trace
+
+# record the time, rows and memory of every stage (summary at the end)
+tracer = trace.enable()
 
 
 # ### Getting the observations for the selected stations
 
+# The observations are read through a station index of the store (`gsod.timeseries`): the compact observations sorted by station and date, saved next to the store as memory-mapped arrays and built again only when the store changes. Getting the Valencia airport station (`082840-99999`), or any date range of it, is a binary search that returns views of those arrays, whatever the size of the store.
+
 # In[2]:
 
 p = Path('../../data/ncdc')
-observationsCSV = p.joinpath('observations_vlc.csv')
-print ('Reading observations CSV')
-dfObs = pd.read_csv(str(observationsCSV),index_col=0)
+observationsStore = p.joinpath('observations')
+stationIndex = timeseries.load(observationsStore, measures=['slp','visib','prcp'])
+station = '082840-99999'
+try:
+    dfObs = stationIndex.get(station)
+except KeyError:
+    # only the stations selected in week03 are ingested
+    raise SystemExit("{} is not in {}: add it to the week03 selection and ingest again".format(
+        station, observationsStore))
 print ("{:,} observations".format(len(dfObs)))
 
 
@@ -31,73 +45,35 @@ dfObs.head()
 
 # ### Data management operations
 
-# Generate an index using the id station and the date
+# The index already holds the temperatures in Celsius (missing values as NaN) and the date as the index of every station. The occurrence of the different weather conditions is packed in the `frshtt` byte, so one boolean column is added for every flag with `gsod.features`.
 
 # In[4]:
 
-def getId(stn,wban):
-    try:
-        istn = int(stn)
-        iwban = int(wban)
-        return "{:0>6}-{:0>5}".format(istn,iwban)
-    except ValueError:
-        print("{}/{}".format(stn,wban))
-        
-def getStationByStnWban(stn,wban):
-    try:
-        koppen = scdfc.loc[getId(stn,wban)].koppen
-    except KeyError:
-        koppen = None
-    return koppen   
-def getDateTimeFromRow(row):
-    try:
-        iyear = int(row.year)
-        imonth = int("{:0>4}".format(row.monthday)[0:2])
-        iday = int("{:0>4}".format(row.monthday)[2:4])
-        return  datetime(iyear,imonth,iday)
-    except ValueError:
-        return np.nan
-
-dfObs['date'] = dfObs.apply(lambda row : getDateTimeFromRow(row),axis=1)
-dfObs.set_index(['date'],inplace=True)
-
-
-# The `frshtt` column needs to be padded with zeros to get all the flags in the correct place. Then is possible to get the occurrence of different weather conditions
+for flag in features.FLAGS:
+    dfObs[flag] = features.flag(dfObs.frshtt, flag)
 
-# In[5]:
 
-dfObs['frshtt']  = dfObs.apply(lambda row: "{:0>6}".format(row.frshtt),axis=1)
-dfObs['fog']     = dfObs['frshtt'].apply(lambda row: row[0:1]=='1')
-dfObs['rain']    = dfObs['frshtt'].apply(lambda row: row[1:2]=='1')
-dfObs['snow']    = dfObs['frshtt'].apply(lambda row: row[2:3]=='1')
-dfObs['hail']    = dfObs['frshtt'].apply(lambda row: row[3:4]=='1')
-dfObs['thunder'] = dfObs['frshtt'].apply(lambda row: row[4:5]=='1')
-dfObs['tornado'] = dfObs['frshtt'].apply(lambda row: row[5:6]=='1')
+# In[7]:
 
+dfObs.head()
 
-# Recode the temperatures columns, replacing the NaN values and afterwards as numerics
 
-# In[6]:
+# Any date range is just as fast, like the summer of 1990
 
-dfObs['tempC'] = dfObs['temp'].replace('99.9', np.nan)
-dfObs['maxC']  = dfObs['max'].replace('99.9', np.nan)
-dfObs['minC']  = dfObs['min'].replace('99.9', np.nan)
+# In[ ]:
 
-dfObs['tempC'] = pd.to_numeric(dfObs['tempC'])
-dfObs['maxC']  = pd.to_numeric(dfObs['maxC'])
-dfObs['minC']  = pd.to_numeric( dfObs['minC']) 
+stationIndex.get(station, '1990-06-01', '1990-08-31', columns=['tempC','maxC','minC']).describe()
 
-def FtoC(f):
-    return (f-32)*5/9
 
-dfObs['tempC']= dfObs['tempC'].apply(lambda temp: FtoC(temp))
-dfObs['maxC'] = dfObs['maxC'].apply(lambda temp: FtoC(temp))
-dfObs['minC'] = dfObs['minC'].apply(lambda temp: FtoC(temp))
+# ### Daily normals and anomalies
 
+# The normal of every station and day of the year is the mean of the observations within a 31 days window centred on that day, computed for all the stations of the index at once with `gsod.climatology` and saved next to the store, again only when the store changes. The anomalies of the Valencia station are then a lookup of those normals.
 
-# In[7]:
+# In[ ]:
 
-dfObs.head()
+normals = climatology.load(observationsStore, stationIndex, window=31)
+dfAnom = normals.anomalies(dfObs, station=station)
+dfAnom.groupby(dfAnom.index.year).mean()
 
 
 # ## Univariate visualization
@@ -117,37 +93,41 @@ df[['tempC','maxC','minC']].describe()
 
 # In[10]:
 
-sns.distplot(df["tempC"].dropna(), kde=False);
+plots.distplot(df["tempC"]);
 plt.xlabel('Temperature (ºC)')
 plt.title('Mean temperature')
 
 
 # In[11]:
 
-sns.distplot(df["maxC"].dropna(), kde=False);
+plots.distplot(df["maxC"]);
 plt.xlabel('Temperature (ºC)')
 plt.title('Max temperature')
 
 
 # In[12]:
 
-sns.distplot(df["minC"].dropna(), kde=False);
+plots.distplot(df["minC"]);
 plt.xlabel('Temperature (ºC)')
 plt.title('Min temperature')
 
 
-# Plotting the three variables together
+# Plotting the three variables together. The histograms and densities come from `gsod.plots`, which counts the values once on a fine grid and computes the KDE by FFT convolution of that grid, so the cost does not grow with the number of observations.
 
 # In[13]:
 
-sns.kdeplot(df.tempC, label="Mean")
-sns.kdeplot(df.maxC, label="Max")
-sns.kdeplot(df.minC, label="Min")
-plt.legend();
-plt.xlabel('Temperature (ºC)')
+plots.temperatures(df)
 plt.title('Valencia station temperatures')
 
 
+# The same figure for every station in the store, binned batch by batch as it is read so the observations never have to fit in memory
+
+# In[14]:
+
+plots.temperatures(plots.store_temperatures(observationsStore))
+plt.title('All stations temperatures')
+
+
 # ### Cualitative variables
 
 # Our quantitative variables are all `True/False` so they are categorical by definition
@@ -196,11 +176,11 @@ plt.ylabel('Visibility (miles)')
 plt.title('Rainy days against visibility (in miles)')
 
 
-# Let's compare sea level presure and temperatures using a scatter plot
+# Let's compare sea level presure and temperatures using a scatter plot. `plots.regplot` shades a grid with the number of observations in every cell instead of drawing one marker per point, and fits the regression line and its 95% confidence band from running sums, so it takes the same time for one station or the whole store (see `plots.bin_pairs`).
 
 # In[20]:
 
-sns.regplot(x="tempC", y="slp", data=df)
+plots.regplot(df.tempC, df.slp)
 plt.xlabel('Mean temperature')
 plt.ylabel('Sea Level Pressure')
 plt.title('Scatterplot for temperatures aganist sea level pressure')
@@ -210,7 +190,7 @@ plt.title('Scatterplot for temperatures aganist sea level pressure')
 
 # In[21]:
 
-sns.regplot(x="prcp", y="slp", data=df[(df.prcp>0.1)])
+plots.regplot(df.prcp[df.prcp>0.1], df.slp[df.prcp>0.1])
 plt.xlabel('Precipitation')
 plt.ylabel('Sea Level Pressure')
 plt.title('Scatterplot for precipitation aganist sea level pressure')
@@ -218,8 +198,17 @@ plt.title('Scatterplot for precipitation aganist sea level pressure')
 
 # In[22]:
 
-sns.regplot(x="prcp", y="visib", data=df[(df.prcp>0.1)])
+plots.regplot(df.prcp[df.prcp>0.1], df.visib[df.prcp>0.1])
 plt.xlabel('Precipitation')
 plt.ylabel('Sea Level Pressure')
 plt.title('Scatterplot for precipitation aganist sea level pressure')
 
+
+# ### Stage timings
+
+# Wall and CPU time, rows and memory of the stages run above, also saved as a Chrome trace that can be opened in `chrome://tracing`
+
+# In[ ]:
+
+tracer.write('../../data/ncdc/trace-vizs.json')
+tracer.to_frame().reindex(columns=['stage','seconds','cpu_seconds','rows','bytes','peak_rss'])
@@ -0,0 +1,6 @@
+"""Helpers for the NCDC Global Surface Summary of Day (GSOD) dataset.
+
+The assignment scripts under ``assignments/`` import these modules to
+build the station inventory and load observations without the per-file,
+per-row loops of the original notebooks.
+"""
@@ -0,0 +1,204 @@
+"""Read the GSOD data straight out of its compressed archives.
+
+* ``.7z`` files (``gsod.csv.7z``, ``stations.csv.7z``) are decompressed by
+  the ``7z`` command line tool and piped into the parser, so nothing is
+  extracted to disk.
+* NOAA's yearly ``gsod_YYYY.tar`` files, holding one gzipped ``.op`` per
+  station, are walked as a stream and their members parsed in batches;
+  or walked once for the offsets of their members
+  (:func:`locate_station_years`), which are then read in any batches.
+
+Memory stays bounded by the batch size whatever the archive size.
+"""
+import gzip
+import itertools
+import shutil
+import subprocess
+import tarfile
+from collections import namedtuple
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+from . import reader
+from .inventory import parse_name
+
+# a station file inside an uncompressed tar: its ``.op`` name and where its
+# (possibly gzipped) bytes are
+TarMember = namedtuple('TarMember', ['tar', 'name', 'offset', 'size', 'gz'])
+
+SEVEN_ZIP = ('7z', '7za', '7zr')
+
+
+def _seven_zip():
+    for name in SEVEN_ZIP:
+        path = shutil.which(name)
+        if path:
+            return path
+    raise RuntimeError("7-Zip is needed to read .7z archives (install p7zip)")
+
+
+@contextmanager
+def open_7z(path, member=None):
+    """Binary stream with the decompressed contents of a member of a 7z archive.
+
+    Without ``member`` the archive must hold a single file.
+    """
+    cmd = [_seven_zip(), 'e', '-so', '-bd', str(path)]
+    if member is not None:
+        cmd.append(member)
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        yield proc.stdout
+    finally:
+        proc.stdout.close()
+        stderr = proc.stderr.read()
+        proc.stderr.close()
+        if proc.wait() not in (0, -13):  # -13: closed before the end (SIGPIPE)
+            raise IOError("7z failed on {}: {}".format(path, stderr.decode(errors='replace')))
+
+
+def source_path(path):
+    """The file read for ``path``: itself, or ``path.7z`` when only the archive exists."""
+    path = Path(path)
+    packed = Path(str(path) + '.7z')
+    return packed if not path.exists() and packed.exists() else path
+
+
+def read_csv(path, **kwargs):
+    """``pd.read_csv`` of ``path``, or of ``path.7z`` when only the archive exists."""
+    path = Path(path)
+    if source_path(path) == path:
+        return pd.read_csv(str(path), **kwargs)
+    with open_7z(str(path) + '.7z', member=path.name) as stream:
+        return pd.read_csv(stream, **kwargs)
+
+
+def year_tar(root, year):
+    """NOAA's archive of a year under ``root``: ``gsod_YYYY.tar``."""
+    return Path(root).joinpath('gsod_{}.tar'.format(year))
+
+
+def iter_tar_ops(tar_path, names=None):
+    """``(name, data)`` for every ``.op``/``.op.gz`` member of a tar, streamed.
+
+    ``data`` is the decompressed file without its header line. ``names``
+    limits the members read to those ``.op`` file names.
+    """
+    with tarfile.open(str(tar_path), mode='r|*') as tar:
+        for member in tar:
+            op_name = _op_name(member)
+            if op_name is None or (names is not None and op_name not in names):
+                continue
+            yield op_name, _body(tar.extractfile(member).read(), member.name.endswith('.gz'))
+
+
+def _op_name(member):
+    # the ``.op`` file name of a tar member, None for anything else
+    if not member.isfile():
+        return None
+    name = Path(member.name).name
+    name = name[:-3] if name.endswith('.gz') else name
+    return name if name.endswith('.op') else None
+
+
+def _body(data, gz):
+    # the data lines of a station file
+    if gz:
+        data = gzip.decompress(data)
+    header_end = data.find(b'\n') + 1
+    return data[header_end:] if header_end else b''
+
+
+def tar_members(tar_path, names=None):
+    """:class:`TarMember` of the ``.op``/``.op.gz`` files of a tar, by ``.op`` name.
+
+    Only the member headers are read (the data is seeked over), so the tar
+    must not be compressed as a whole, like NOAA's are not.
+    """
+    members = {}
+    with tarfile.open(str(tar_path), mode='r:') as tar:
+        for member in tar:
+            op_name = _op_name(member)
+            if op_name is None or (names is not None and op_name not in names):
+                continue
+            members[op_name] = TarMember(str(tar_path), op_name, member.offset_data,
+                                         member.size, member.name.endswith('.gz'))
+    return members
+
+
+def read_members(members, columns=None):
+    """DataFrame of some :class:`TarMember` station files, each read at its offset."""
+    chunks = []
+    members = sorted(members, key=lambda m: (m.tar, m.offset))
+    for tar, group in itertools.groupby(members, key=lambda m: m.tar):
+        with open(tar, 'rb') as f:
+            for member in group:
+                f.seek(member.offset)
+                data = _body(f.read(member.size), member.gz)
+                if data and not data.endswith(b'\n'):
+                    data += b'\n'
+                chunks.append(data)
+    return reader.parse_buffer(b''.join(chunks), columns=columns)
+
+
+def read_tar_ops(tar_path, names=None, batch_files=500, columns=None):
+    """DataFrames of ``batch_files`` station files at a time from a year tar."""
+    chunks = []
+    for _, data in iter_tar_ops(tar_path, names):
+        if data and not data.endswith(b'\n'):
+            data += b'\n'
+        chunks.append(data)
+        if len(chunks) == batch_files:
+            yield reader.parse_buffer(b''.join(chunks), columns=columns)
+            chunks = []
+    if chunks:
+        yield reader.parse_buffer(b''.join(chunks), columns=columns)
+
+
+def count_tar_ops(tar_path):
+    """Inventory rows ``(id, year, obs)`` of the station files in a year tar."""
+    rows = []
+    for name, data in iter_tar_ops(tar_path):
+        stid, year = parse_name(name)
+        obs = data.count(b'\n') + (1 if data and not data.endswith(b'\n') else 0)
+        rows.append((stid, year, obs))
+    return rows
+
+
+def locate_station_years(root, paths):
+    """Where to read the ``root/YEAR/*.op`` ``paths`` from.
+
+    Returns the paths extracted on disk and the :class:`TarMember` of the
+    others found in the ``gsod_YYYY.tar`` of their year, in tar order.
+    Every tar is walked once whatever the number of files wanted from it;
+    files in neither place are left out.
+    """
+    paths = [Path(p) for p in paths]
+    extracted = [p for p in paths if p.exists()]
+    by_year = {}
+    for p in paths:
+        if not p.exists():
+            by_year.setdefault(parse_name(p)[1], set()).add(p.name)
+    members = []
+    for year in sorted(by_year):
+        tar = year_tar(root, year)
+        if tar.exists():
+            found = tar_members(tar, by_year[year])
+            members.extend(sorted(found.values(), key=lambda m: m.offset))
+    return extracted, members
+
+
+def read_station_years(root, paths, batch_files=500, columns=None):
+    """Observations of the ``root/YEAR/*.op`` ``paths``, ``batch_files`` at a time.
+
+    Files already extracted are read from disk, the rest out of the
+    ``gsod_YYYY.tar`` archive of their year when it is there, see
+    :func:`locate_station_years`.
+    """
+    extracted, members = locate_station_years(root, paths)
+    for i in range(0, len(extracted), batch_files):
+        yield reader.read_op_files(extracted[i:i + batch_files], columns=columns)
+    for i in range(0, len(members), batch_files):
+        yield read_members(members[i:i + batch_files], columns=columns)
@@ -0,0 +1,206 @@
+"""Benchmarks of the pipeline stages on synthetic archives.
+
+Every scale is a :func:`gsod.synthetic.generate` archive of some number of
+stations; the stages run on it in pipeline order, each one timed (best of
+``repeat`` runs) and profiled once more under ``tracemalloc`` for its peak
+allocated memory. Results go to a JSON file with the versions they were
+measured with, and two of those files can be compared::
+
+    python -m gsod.bench --stations 10 100 1000 --years 2 --output after.json
+    python -m gsod.bench --compare before.json after.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from . import cube, features, inventory, koppen, plots, reader, registry, stats, synthetic
+
+STAGES = ['inventory', 'stations', 'parse', 'koppen', 'features', 'compact', 'groupby', 'plots']
+
+CLASSES = ['Af', 'Am', 'Aw', 'BSh', 'BSk', 'BWh', 'BWk', 'Cfa', 'Cfb', 'Csa',
+           'Csb', 'Cwa', 'Dfb', 'Dfc', 'ET']
+
+
+def stage_inventory(ctx):
+    df, _ = inventory.build_inventory(ctx['raw'], ctx['root'].joinpath('gsod.csv'),
+                                      workers=1, every=0)
+    ctx['inventory'] = df
+    return len(df)
+
+
+def stage_stations(ctx):
+    stations = registry.parse(ctx['root'].joinpath('ish-history.csv'))
+    inv = ctx['inventory']
+    if inv.index.name != 'id':
+        inv = inv.set_index('id')
+    ctx['stations'] = stats.join_stations(stations, stats.station_stats(inv))
+    return len(ctx['stations'])
+
+
+def stage_parse(ctx):
+    ctx['obs'] = reader.read_op_files(ctx['paths'])
+    return len(ctx['obs'])
+
+
+def stage_koppen(ctx):
+    stations = ctx['stations']
+    rng = np.random.default_rng(0)
+    index = koppen.KoppenIndex(stations['key'].values, rng.choice(CLASSES, len(stations)))
+    obs = ctx['obs']
+    obs['koppen'] = index.lookup(obs['stn'], obs['wban'])
+    return len(obs)
+
+
+def stage_features(ctx):
+    ctx['managed'] = features.manage(ctx['obs'])
+    return len(ctx['managed'])
+
+
+def stage_compact(ctx):
+    df = features.compact(ctx['obs'], measures=('slp',))
+    return len(df)
+
+
+def stage_groupby(ctx):
+    c = cube.build(ctx['managed'])
+    return len(cube.rollup(c, ['year', 'koppen'], ['tempC'], stats=['max', 'std']))
+
+
+def stage_plots(ctx):
+    df = ctx['managed']
+    grids = {c: plots.Binned(*plots.TEMPERATURE_RANGE).add(df[c].values)
+             for c in plots.TEMPERATURE_LABELS}
+    curves = [grid.kde() for grid in grids.values()]
+    pairs = plots.Binned2D.from_values(df['tempC'].values, df['slp'].values)
+    pairs.fit()
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+    except ImportError:
+        return sum(len(x) for x, _ in curves)
+    fig, axes = plt.subplots(1, 2)
+    plots.temperatures(grids, ax=axes[0])
+    plots.regplot(pairs, ax=axes[1])
+    fig.canvas.draw()
+    plt.close(fig)
+    return sum(len(x) for x, _ in curves)
+
+
+def measure(stage, ctx, repeat=3, memory=True):
+    """``(rows, seconds, cpu_seconds, peak_bytes)`` of a stage: best times, traced peak."""
+    seconds, cpu = [], []
+    for _ in range(repeat):
+        start, start_cpu = time.perf_counter(), time.process_time()
+        with contextlib.redirect_stdout(io.StringIO()):
+            rows = stage(ctx)
+        seconds.append(time.perf_counter() - start)
+        cpu.append(time.process_time() - start_cpu)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                stage(ctx)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return rows, min(seconds), min(cpu), peak
+
+
+def run_scale(n_stations, years, workdir, repeat=3, memory=True, seed=0, out=sys.stdout):
+    """Results of every stage on an archive of ``n_stations``."""
+    root = Path(workdir).joinpath('stations-{}'.format(n_stations))
+    start = time.perf_counter()
+    synthetic.generate(root, n_stations, years, seed=seed)
+    print("{:,} stations generated in {:.1f}s".format(n_stations, time.perf_counter() - start),
+          file=out)
+    ctx = {'root': root, 'raw': root.joinpath('gsod')}
+    ctx['paths'] = inventory.find_op_files(ctx['raw'])
+    ctx['bytes'] = sum(os.path.getsize(str(p)) for p in ctx['paths'])
+    results = []
+    for name in STAGES:
+        rows, seconds, cpu, peak = measure(globals()['stage_' + name], ctx, repeat, memory)
+        results.append({'stations': n_stations, 'files': len(ctx['paths']),
+                        'bytes': ctx['bytes'], 'stage': name, 'rows': rows,
+                        'seconds': seconds, 'cpu_seconds': cpu, 'peak_bytes': peak})
+        print("{:>8} stations {:>10} {:>10,} rows {:>9.3f}s {:>9} MiB".format(
+            n_stations, name, rows, seconds,
+            '-' if peak is None else '{:.1f}'.format(peak / 2**20)), file=out)
+    return results
+
+
+def _git_version():
+    try:
+        return subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'], stderr=subprocess.DEVNULL,
+            cwd=str(Path(__file__).resolve().parent)).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    return {'version': _git_version(), 'python': platform.python_version(),
+            'numpy': np.__version__, 'pandas': pd.__version__,
+            'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+def run(scales=(10, 100), years=(1990, 1991), repeat=3, memory=True, workdir=None,
+        output=None, out=sys.stdout):
+    """Benchmark every scale and write the JSON results to ``output``."""
+    with tempfile.TemporaryDirectory() if workdir is None else contextlib.nullcontext(workdir) as wd:
+        results = []
+        for n in scales:
+            results.extend(run_scale(n, years, wd, repeat, memory, out=out))
+    report = dict(environment(), years=list(years), repeat=repeat, results=results)
+    if output is not None:
+        with open(str(output), 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def compare(before, after, out=sys.stdout):
+    """Time ratio (after / before) of every stage and scale in two result files."""
+    frames = []
+    for path in (before, after):
+        with open(str(path)) as f:
+            frames.append(pd.DataFrame(json.load(f)['results']).set_index(['stations', 'stage']))
+    df = frames[0][['seconds', 'peak_bytes']].join(
+        frames[1][['seconds', 'peak_bytes']], lsuffix='_before', rsuffix='_after', how='inner')
+    df['ratio'] = df['seconds_after'] / df['seconds_before']
+    print(df.to_string(), file=out)
+    return df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--stations', type=int, nargs='+', default=[10, 100])
+    parser.add_argument('--years', type=int, default=2, help="years per station")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true', help="skip the tracemalloc run")
+    parser.add_argument('--workdir', help="keep the synthetic archives there")
+    parser.add_argument('--output', default='bench.json')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'))
+    args = parser.parse_args(argv)
+    if args.compare:
+        compare(*args.compare)
+        return
+    run(args.stations, (1990, 1990 + args.years - 1), args.repeat, not args.no_memory,
+        args.workdir, args.output)
+
+
+if __name__ == '__main__':
+    main()
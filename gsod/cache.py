@@ -0,0 +1,218 @@
+"""Content-addressed cache of the DataFrames derived by the pipeline stages.
+
+A stage is a function and its arguments; its result is stored as Parquet
+under a key hashed from:
+
+* the stage name and function,
+* the code version: the sources of the :mod:`gsod` package (and of the
+  function itself when it is defined elsewhere, e.g. in a script),
+* the contents of the input files (``Path`` arguments; a folder counts by
+  the names, sizes and mtimes of its files, like the inventory manifest),
+* the keys of the stages whose results are passed in (or a hash of the
+  contents of any other DataFrame),
+* every other argument.
+
+So the stages run again only when something they depend on changed, and
+the change ripples to the stages downstream::
+
+    stageCache = cache.Cache('data/ncdc/cache')
+    stations = stageCache.stage('stations', registry.parse, Path('ish-history.csv'))
+    years = stageCache.stage('years', stats.station_stats, dfGsod)
+    scdf = stageCache.stage('scdf', stats.join_stations, stations, years)
+
+The cache folder is bounded to ``max_bytes``: every hit refreshes the mtime
+of its file and the least recently used ones are removed first.
+"""
+import hashlib
+import inspect
+import json
+import os
+import uuid
+import weakref
+from pathlib import Path
+
+import pandas as pd
+
+from . import trace
+from .archive import source_path
+
+PACKAGE = Path(__file__).resolve().parent
+CACHE_DIR = PACKAGE.parent.joinpath('data', 'ncdc', 'cache')
+MAX_BYTES = 4 * 2**30
+SUFFIX = '.parquet'
+
+_code_version = None
+
+
+def _hasher():
+    return hashlib.blake2b(digest_size=16)
+
+
+def code_version():
+    """Digest of the sources of the :mod:`gsod` package."""
+    global _code_version
+    if _code_version is None:
+        h = _hasher()
+        for path in sorted(PACKAGE.glob('*.py')):
+            h.update(path.name.encode())
+            h.update(path.read_bytes())
+        _code_version = h.hexdigest()
+    return _code_version
+
+
+def _function_id(func):
+    name = '{}.{}'.format(getattr(func, '__module__', None), getattr(func, '__qualname__', func))
+    if getattr(func, '__module__', '').startswith(__package__ + '.'):
+        return name
+    try:
+        # functions of the scripts change with their own source only
+        return name + inspect.getsource(func)
+    except (OSError, TypeError):
+        return name
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """Digest of the contents of a file."""
+    h = _hasher()
+    with open(str(path), 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def folder_digest(path):
+    """Digest of the names, sizes and mtimes of the files under a folder."""
+    h = _hasher()
+    root = Path(path)
+    for p in sorted(root.rglob('*')):
+        if p.is_file():
+            st = p.stat()
+            h.update('{}:{}:{}\n'.format(p.relative_to(root).as_posix(), st.st_size,
+                                         st.st_mtime_ns).encode())
+    return h.hexdigest()
+
+
+def frame_digest(df):
+    """Digest of the contents of a DataFrame or Series, index included."""
+    h = _hasher()
+    h.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    h.update(repr(list(getattr(df, 'columns', [df.name]))).encode())
+    return h.hexdigest()
+
+
+class Cache(object):
+    """Stage results stored in ``root``, at most ``max_bytes`` of them."""
+
+    def __init__(self, root=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._keys = {}
+        # file digests already computed, by path, size and mtime
+        self._digests = {}
+
+    def path(self, key):
+        return self.root.joinpath(key + SUFFIX)
+
+    def _file_digest(self, path):
+        # a file shipped as ``.7z`` only counts by the archive, see archive.read_csv
+        path = source_path(path).resolve()
+        if path.is_dir():
+            return folder_digest(path)
+        st = path.stat()
+        known = self._digests.get(str(path))
+        if known is None or known[:2] != (st.st_size, st.st_mtime_ns):
+            known = (st.st_size, st.st_mtime_ns, file_digest(path))
+            self._digests[str(path)] = known
+        return known[2]
+
+    def _argument(self, value):
+        if isinstance(value, Path):
+            return ['file', self._file_digest(value)]
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            known = self._keys.get(id(value))
+            if known is not None and known[0]() is value:
+                return ['stage', known[1]]
+            return ['frame', frame_digest(value)]
+        return repr(value)
+
+    def key(self, name, func, args=(), kwargs=None):
+        """Key of the result of ``func(*args, **kwargs)`` as the stage ``name``."""
+        parts = {
+            'stage': name, 'function': _function_id(func), 'code': code_version(),
+            'args': [self._argument(a) for a in args],
+            'kwargs': {k: self._argument(v) for k, v in sorted((kwargs or {}).items())},
+        }
+        h = _hasher()
+        h.update(json.dumps(parts, sort_keys=True).encode())
+        return h.hexdigest()
+
+    def _register(self, key, df):
+        self._keys[id(df)] = (weakref.ref(df), key)
+        return df
+
+    def get(self, key):
+        """The stored result of ``key``, or ``None``."""
+        path = self.path(key)
+        try:
+            df = pd.read_parquet(str(path))
+        except (OSError, ValueError):
+            return None
+        os.utime(str(path))  # most recently used
+        return df
+
+    def put(self, key, df):
+        """Store ``df`` as the result of ``key`` and evict down to the size cap."""
+        if not isinstance(df, pd.DataFrame):
+            raise TypeError("only DataFrames are cached, not {}".format(type(df).__name__))
+        path = self.path(key)
+        tmp = path.with_name('.{}-{}'.format(uuid.uuid4().hex, path.name))
+        try:
+            df.to_parquet(str(tmp))
+            os.replace(str(tmp), str(path))
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+        self.evict()
+
+    def stage(self, name, func, *args, **kwargs):
+        """``func(*args, **kwargs)``, from the cache when nothing it depends on changed."""
+        with trace.stage('cache.' + name) as span:
+            key = self.key(name, func, args, kwargs)
+            df = self.get(key)
+            span.set(hit=df is not None)
+            if df is None:
+                df = func(*args, **kwargs)
+                self.put(key, df)
+                # read back so a run gets the same dtypes from a miss as from a hit
+                stored = self.get(key)
+                df = df if stored is None else stored
+            span.set(rows=len(df))
+        return self._register(key, df)
+
+    def entries(self):
+        """``key, bytes, used`` of the stored results, least recently used first."""
+        rows = []
+        for path in self.root.glob('*' + SUFFIX):
+            st = path.stat()
+            rows.append((path.name[:-len(SUFFIX)], st.st_size, st.st_mtime))
+        df = pd.DataFrame(rows, columns=['key', 'bytes', 'used'])
+        df['used'] = pd.to_datetime(df['used'], unit='s')
+        return df.sort_values('used', ignore_index=True)
+
+    def evict(self, max_bytes=None):
+        """Remove the least recently used results until they fit in ``max_bytes``."""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        df = self.entries()
+        excess = df['bytes'].sum() - max_bytes
+        removed = 0
+        for key, size in zip(df['key'], df['bytes']):
+            if excess <= 0:
+                break
+            self.path(key).unlink()
+            excess -= size
+            removed += 1
+        return removed
+
+    def clear(self):
+        return self.evict(0)
@@ -0,0 +1,226 @@
+"""Command line interface to the pipeline, ``python -m gsod <command>``.
+
+Every command works on a data folder laid out like ``data/ncdc``::
+
+    ish-history.csv        station registry
+    raw/gsod/              YEAR/*.op files or gsod_YYYY.tar archives
+    gsod.csv               inventory (``inventory``)
+    selected.csv           selected stations and their class (``select``)
+    observations/          observation store (``ingest``), with its
+    observations.*         quantile sketches and aggregate cube
+
+For example::
+
+    python -m gsod download data/ncdc --years 1990 2013
+    python -m gsod inventory data/ncdc
+    python -m gsod select data/ncdc --regions data/climate_regions.geojson
+    python -m gsod ingest data/ncdc --memory-limit 6
+    python -m gsod plot data/ncdc --station 082840-99999 --output vlc.png
+
+Only :mod:`argparse` is loaded up front: every command imports the modules
+it needs when it runs, and only ``plot`` loads matplotlib.
+"""
+import argparse
+import sys
+from pathlib import Path
+
+
+def _paths(data):
+    data = Path(data)
+    return {
+        'stations': data.joinpath('ish-history.csv'),
+        'raw': data.joinpath('raw', 'gsod'),
+        'inventory': data.joinpath('gsod.csv'),
+        'selected': data.joinpath('selected.csv'),
+        'store': data.joinpath('observations'),
+        'sketches': data.joinpath('observations.tdigest.pkl'),
+        'cube': data.joinpath('observations.cube.parquet'),
+    }
+
+
+def cmd_download(args):
+    from . import download
+
+    paths = _paths(args.data)
+    years = range(args.years[0], args.years[-1] + 1)
+    df = download.download_years(years, paths['raw'], base_url=args.base_url or download.BASE_URL,
+                                 workers=args.workers, retries=args.retries)
+    print(df.groupby('status')['bytes'].agg(['size', 'sum']).to_string())
+    return 1 if (df['status'] == 'failed').any() else 0
+
+
+def cmd_inventory(args):
+    from . import inventory
+
+    paths = _paths(args.data)
+    update = inventory.build_inventory if args.full else inventory.refresh_inventory
+    try:
+        df, failed = update(paths['raw'], paths['inventory'], workers=args.workers)
+    except FileNotFoundError as e:
+        sys.exit(str(e))
+    print("{:,} station files, {:,} observations -> {}".format(
+        len(df), int(df['obs'].sum()), paths['inventory']))
+    return 1 if failed else 0
+
+
+def cmd_select(args):
+    from . import archive, koppen, registry, selection, spatial, stats
+
+    paths = _paths(args.data)
+    stations = registry.load(paths['stations'])
+    dfGsod = archive.read_csv(paths['inventory'], index_col=['id'])
+    scdf = stats.join_stations(stations, stats.station_stats(dfGsod))
+    regions = spatial.load_regions(args.regions)
+    table = koppen.read_koppen(args.koppen_table) if args.koppen_table else None
+    pairs = koppen.intersect(scdf, regions, table)
+    selections = selection.top_stations(scdf, pairs, k=args.k, min_count=args.min_count,
+                                        max_elev=args.max_elev)
+    scdfc = scdf.join(selections, how='inner')
+    output = args.output or paths['selected']
+    scdfc.to_csv(str(output))
+    print("{:,} stations in {:,} classes -> {}".format(
+        len(scdfc), scdfc['koppen'].nunique(), output))
+    return 0
+
+
+def cmd_ingest(args):
+    import pandas as pd
+
+    from . import archive, cube, koppen, pipeline, quantiles, store
+
+    paths = _paths(args.data)
+    if store.exists(paths['store']):
+        sys.exit("{} already holds observations, remove it to ingest again".format(paths['store']))
+    selected = pd.read_csv(str(args.selection or paths['selected']), index_col=['id'])
+    dfGsod = archive.read_csv(paths['inventory'], index_col=['id'])
+    files = dfGsod[['year']].join(selected[['koppen']], how='inner')
+    files = [paths['raw'].joinpath(str(year), "{}-{}.op".format(stid, year))
+             for stid, year in zip(files.index, files['year'])]
+    print("{:,} files to read".format(len(files)))
+
+    sketches = quantiles.SketchSet()
+    memory_limit = int(args.memory_limit * 2**30) if args.memory_limit else None
+    _, obsCube = pipeline.ingest(files, koppen.KoppenIndex.from_frame(selected), paths['store'],
+                                 workers=args.workers, batch_size=args.batch_size,
+                                 memory_limit=memory_limit, raw=paths['raw'], sketches=sketches,
+                                 aggregate=cube.build, combine=cube.combine)
+    sketches.save(paths['sketches'])
+    # the store is new, so is the cube: never merged into one left by an earlier run
+    if obsCube is not None:
+        cube.save(obsCube, paths['cube'])
+    elif paths['cube'].exists():
+        paths['cube'].unlink()
+    return 0
+
+
+def _station_filters(station):
+    if station is None:
+        return None
+    usaf, wban = station.split('-')
+    return [('stn', '==', int(usaf)), ('wban', '==', int(wban))]
+
+
+def cmd_plot(args):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    import numpy as np
+    import pandas as pd
+
+    from . import features, plots, store
+
+    paths = _paths(args.data)
+    filters = _station_filters(args.station)
+    koppen = args.koppen.split(',') if args.koppen else None
+    fig, ax = plt.subplots(figsize=(8, 5))
+    if args.kind == 'temperatures':
+        grids = plots.store_temperatures(paths['store'], koppen=koppen, filters=filters)
+        plots.temperatures(grids, ax=ax)
+        ax.set_title(args.station or 'All stations')
+    else:
+        x, y = args.x, args.y
+
+        def measures():
+            # missing codes as NaN and temperatures in °C, or they set the ranges
+            for df in store.scan(paths['store'], columns=[x, y], koppen=koppen, filters=filters):
+                yield pd.DataFrame({c: features.to_measure(df[c], c) for c in (x, y)})
+
+        limits = {x: [np.inf, -np.inf], y: [np.inf, -np.inf]}
+        # a first pass over the two columns for the grid ranges
+        for df in measures():
+            for column in (x, y):
+                limits[column][0] = np.fmin(limits[column][0], df[column].min())
+                limits[column][1] = np.fmax(limits[column][1], df[column].max())
+        if not all(np.isfinite(limits[c]).all() for c in (x, y)):
+            sys.exit("no {} and {} observations to plot".format(x, y))
+        plots.regplot(plots.bin_pairs(measures(), x, y, limits[x], limits[y]), ax=ax)
+        ax.set_xlabel(x + (' (°C)' if x in features.FAHRENHEIT else ''))
+        ax.set_ylabel(y + (' (°C)' if y in features.FAHRENHEIT else ''))
+    fig.savefig(str(args.output), dpi=args.dpi, bbox_inches='tight')
+    print("-> {}".format(args.output))
+    return 0
+
+
+def parser():
+    parser = argparse.ArgumentParser(prog='python -m gsod', description=__doc__.split('\n')[0])
+    parser.add_argument('--trace', metavar='FILE',
+                        help="record the stages to FILE (.json for a Chrome trace)")
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    cmd = commands.add_parser('download', help="mirror NOAA's yearly archives into DATA/raw/gsod")
+    cmd.add_argument('data')
+    cmd.add_argument('--years', type=int, nargs='+', required=True, help="FIRST [LAST]")
+    cmd.add_argument('--base-url', help="mirror to read from, NOAA's by default")
+    cmd.add_argument('--workers', type=int, default=4, help="parallel downloads")
+    cmd.add_argument('--retries', type=int, default=3)
+    cmd.set_defaults(run=cmd_download)
+
+    cmd = commands.add_parser('inventory', help="count the observations of the raw files")
+    cmd.add_argument('data', help="data folder (data/ncdc)")
+    cmd.add_argument('--workers', type=int)
+    cmd.add_argument('--full', action='store_true', help="scan every file, not only changed ones")
+    cmd.set_defaults(run=cmd_inventory)
+
+    cmd = commands.add_parser('select', help="top stations per Köppen-Geiger region")
+    cmd.add_argument('data')
+    cmd.add_argument('--regions', required=True, help="regions GeoJSON or ASCII grid")
+    cmd.add_argument('--koppen-table', help="gridcode -> koppen CSV (data/koppen.csv)")
+    cmd.add_argument('-k', type=int, default=2, help="stations per region")
+    cmd.add_argument('--min-count', type=int, help="minimum years recorded")
+    cmd.add_argument('--max-elev', type=float, help="maximum elevation (m)")
+    cmd.add_argument('--output', help="defaults to DATA/selected.csv")
+    cmd.set_defaults(run=cmd_select)
+
+    cmd = commands.add_parser('ingest', help="load the selected stations into the store")
+    cmd.add_argument('data')
+    cmd.add_argument('--selection', help="defaults to DATA/selected.csv")
+    cmd.add_argument('--workers', type=int)
+    cmd.add_argument('--batch-size', type=int, default=500, help="files per batch")
+    cmd.add_argument('--memory-limit', type=float, help="GiB")
+    cmd.set_defaults(run=cmd_ingest)
+
+    cmd = commands.add_parser('plot', help="plot the stored observations to an image")
+    cmd.add_argument('data')
+    cmd.add_argument('--kind', choices=['temperatures', 'scatter'], default='temperatures')
+    cmd.add_argument('--station', help="usaf-wban id, all stations by default")
+    cmd.add_argument('--koppen', help="comma separated classes")
+    cmd.add_argument('-x', default='temp', help="scatter x column")
+    cmd.add_argument('-y', default='slp', help="scatter y column")
+    cmd.add_argument('--output', default='gsod.png')
+    cmd.add_argument('--dpi', type=int, default=100)
+    cmd.set_defaults(run=cmd_plot)
+    return parser
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    if args.trace:
+        from . import trace
+        recorder = trace.enable()
+    try:
+        return args.run(args)
+    finally:
+        if args.trace:
+            recorder.write(args.trace)
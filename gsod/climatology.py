@@ -0,0 +1,224 @@
+"""Daily climatology of every station: day-of-year normals and anomalies.
+
+The normal of a measure for a station and a day of the year is the mean of
+its observations in the baseline years within a window of days centred on
+that day (wrapping around the new year), which smooths the daily noise
+out. All stations are computed in one pass: the observations are counted
+and summed per station and day of the year with ``np.bincount`` and the
+window is a moving sum along the rows of the resulting arrays.
+
+Days are numbered on a 365 day calendar: 29 February counts as 28 February.
+Normals are saved to a ``.npz`` file next to the store
+(``observations.normals.npz``), tagged with the store files and options
+they come from so they are computed again when either changed, and
+anomalies of any later observations are a lookup into them::
+
+    normals = climatology.load('data/ncdc/observations', stationIndex, baseline=(1981, 2010))
+    anomalies = normals.anomalies(stationIndex.get_many(keys))
+"""
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from . import trace
+from .features import MISSING_DAY
+from .timeseries import to_key
+
+MEASURES = ['tempC', 'maxC', 'minC', 'prcp']
+DAYS = 365
+
+# missing value codes of the raw measures kept by the compact layout
+MISSING = {'prcp': 99.99}
+
+
+def day_of_year(days):
+    """0-364 day of the year of int32 days since 1970, -1 when unknown."""
+    days = np.asarray(days, dtype=np.int64)
+    dates = days.astype('datetime64[D]')
+    years = dates.astype('datetime64[Y]')
+    doy = (dates - years.astype('datetime64[D]')).astype(np.int64)
+    year = years.astype(np.int64) + 1970
+    leap = (year % 4 == 0) & ((year % 100 != 0) | (year % 400 == 0))
+    # 29 February joins 28 February, the rest of a leap year moves back a day
+    doy -= leap & (doy >= 59)
+    doy[days == MISSING_DAY] = -1
+    return doy
+
+
+def year_of(days):
+    return np.asarray(days, dtype=np.int64).astype('datetime64[D]').astype('datetime64[Y]') \
+        .astype(np.int64) + 1970
+
+
+def _values(values, measure):
+    v = np.asarray(values, dtype=np.float64)
+    if measure in MISSING:
+        # the code may come as float32 (99.99 -> 99.9899978...)
+        v = np.where(v >= MISSING[measure] - 1e-3, np.nan, v)
+    return v
+
+
+def _column(df, name):
+    return df[name].values if name in df.columns else df.index.get_level_values(name).values
+
+
+def _window_sum(a, window):
+    # circular moving sum along the days of every row
+    half = window // 2
+    padded = np.concatenate([a[:, DAYS - half:], a, a[:, :half]], axis=1)
+    c = np.cumsum(padded, axis=1)
+    c = np.concatenate([np.zeros((len(a), 1)), c], axis=1)
+    return c[:, window:] - c[:, :-window]
+
+
+class Climatology(object):
+    """Day-of-year normals of some measures for a set of stations.
+
+    ``normals[measure]`` is a ``(stations, 365)`` array whose rows follow
+    the sorted station ``keys``; days with less than ``min_count``
+    observations in their window are NaN.
+    """
+
+    def __init__(self, keys, normals, baseline=None, window=31, min_count=10):
+        self.keys = np.asarray(keys, dtype=np.int64)
+        self.normals = normals
+        self.baseline = baseline
+        self.window = window
+        self.min_count = min_count
+
+    @classmethod
+    def compute(cls, keys, stations, days, values, baseline=None, window=31, min_count=10):
+        """Normals from observation arrays.
+
+        ``stations`` is the position in the sorted ``keys`` of the station of
+        every observation, ``days`` its int32 day and ``values`` a dict of
+        measure arrays. ``baseline`` is a ``(first, last)`` year range, all
+        the years by default, and ``window`` an odd number of days.
+        """
+        if window % 2 != 1 or window > DAYS:
+            raise ValueError("window must be an odd number of days up to {}".format(DAYS))
+        with trace.stage('climatology.build', rows=len(days), stations=len(keys)):
+            doy = day_of_year(days)
+            keep = doy >= 0
+            if baseline is not None:
+                year = year_of(days)
+                keep &= (year >= baseline[0]) & (year <= baseline[-1])
+            cell = np.asarray(stations, dtype=np.int64)[keep] * DAYS + doy[keep]
+            size = len(keys) * DAYS
+            normals = {}
+            for measure, v in values.items():
+                v = _values(v, measure)[keep]
+                valid = ~np.isnan(v)
+                n = np.bincount(cell[valid], minlength=size).reshape(-1, DAYS)
+                s = np.bincount(cell[valid], weights=v[valid], minlength=size).reshape(-1, DAYS)
+                n, s = _window_sum(n.astype(np.float64), window), _window_sum(s, window)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    normals[measure] = np.where(n >= min_count, s / n, np.nan).astype(np.float32)
+        return cls(keys, normals, baseline, window, min_count)
+
+    @classmethod
+    def from_index(cls, index, measures=None, **kwargs):
+        """Normals of every station of a :class:`gsod.timeseries.StationIndex`."""
+        measures = [m for m in (measures or MEASURES) if m in index.columns]
+        stations = np.repeat(np.arange(len(index.keys)), np.diff(index.offsets))
+        values = {m: index.columns[m] for m in measures}
+        return cls.compute(index.keys, stations, index.columns['date'], values, **kwargs)
+
+    @classmethod
+    def from_frame(cls, df, measures=None, **kwargs):
+        """Normals of a compact frame (``key`` and ``date`` as columns or index levels)."""
+        measures = [m for m in (measures or MEASURES) if m in df.columns]
+        keys, stations = np.unique(np.asarray(_column(df, 'key'), dtype=np.int64),
+                                   return_inverse=True)
+        values = {m: df[m].values for m in measures}
+        return cls.compute(keys, stations, _column(df, 'date'), values, **kwargs)
+
+    @property
+    def measures(self):
+        return list(self.normals)
+
+    def lookup(self, keys, days, measure):
+        """Normal of ``measure`` for every station key and day, NaN when unknown."""
+        keys = np.asarray(keys, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.keys, keys), max(len(self.keys) - 1, 0))
+        doy = day_of_year(days)
+        known = (doy >= 0) & (self.keys[pos] == keys) if len(self.keys) else \
+            np.zeros(len(keys), dtype=bool)
+        out = np.full(len(keys), np.nan, dtype=np.float32)
+        out[known] = self.normals[measure][pos[known], doy[known]]
+        return out
+
+    def anomalies(self, df, measures=None, station=None):
+        """Observations minus their normals, same index as ``df``.
+
+        ``df`` is a compact frame with ``key`` and ``date`` (int32 days or
+        datetimes) as columns or index levels, or the frame of one
+        ``station`` (key or ``"usaf-wban"`` id) without ``key``, like the
+        ones of :meth:`gsod.timeseries.StationIndex.get`.
+        """
+        if station is not None:
+            keys = np.full(len(df), to_key(station), dtype=np.int64)
+        else:
+            keys = _column(df, 'key')
+        days = _column(df, 'date')
+        if np.issubdtype(np.asarray(days).dtype, np.datetime64):
+            days = np.asarray(days, dtype='datetime64[D]').astype(np.int64)
+            days = np.where(days == np.iinfo(np.int64).min, MISSING_DAY, days)
+        out = {}
+        for measure in (measures or [m for m in self.measures if m in df.columns]):
+            out[measure] = _values(df[measure].values, measure) - self.lookup(keys, days, measure)
+        return pd.DataFrame(out, index=df.index)
+
+    def to_frame(self):
+        """The normals as a frame indexed by ``(key, doy)``."""
+        index = pd.MultiIndex.from_product([self.keys, np.arange(DAYS)], names=['key', 'doy'])
+        return pd.DataFrame({m: a.ravel() for m, a in self.normals.items()}, index=index)
+
+    def save(self, path, source=None):
+        """Write the normals to ``path`` (``.npz``); ``source`` tags what they come from."""
+        baseline = np.array(self.baseline if self.baseline is not None else [], dtype=np.int64)
+        np.savez(str(path), keys=self.keys, baseline=baseline,
+                 window=self.window, min_count=self.min_count, source=json.dumps(source),
+                 **{'normal_' + m: a for m, a in self.normals.items()})
+
+    @classmethod
+    def load(cls, path):
+        with np.load(str(path)) as f:
+            normals = {name[len('normal_'):]: f[name] for name in f.files
+                       if name.startswith('normal_')}
+            baseline = tuple(f['baseline'].tolist()) or None
+            return cls(f['keys'], normals, baseline, int(f['window']), int(f['min_count']))
+
+
+def normals_path(root):
+    """The normals kept next to a store: ``observations`` -> ``observations.normals.npz``."""
+    root = Path(root)
+    return root.with_name(root.name + '.normals.npz')
+
+
+def source(path):
+    with np.load(str(path)) as f:
+        return json.loads(str(f['source'])) if 'source' in f.files else None
+
+
+def load(root, index, path=None, **kwargs):
+    """The normals of the store at ``root``, computed and saved when missing or stale.
+
+    ``index`` is the :class:`gsod.timeseries.StationIndex` of that store and
+    ``kwargs`` go to :meth:`Climatology.from_index` (``baseline``,
+    ``window``...); the normals are computed again when the store files or
+    the options differ from those they were saved with.
+    """
+    from .cache import folder_digest
+
+    path = normals_path(root) if path is None else Path(path)
+    # through JSON so that a tuple baseline compares to the saved list
+    digest = json.loads(json.dumps({'store': folder_digest(root), 'options': kwargs},
+                                   sort_keys=True))
+    if path.exists() and source(path) == digest:
+        return Climatology.load(path)
+    normals = Climatology.from_index(index, **kwargs)
+    normals.save(path, source=digest)
+    return normals
@@ -0,0 +1,144 @@
+"""Materialized aggregates of the observations.
+
+The cube holds, per station, Köppen class, year and month, the count,
+sum, sum of squares, min and max of the Celsius temperatures and the
+number of days with every weather flag. Coarser queries (year × class,
+class, station × month...) roll up from it with :func:`rollup` instead of
+scanning the observations; counts and sums add up, min and max keep
+their extremes, so cubes of new batches merge into the stored one with
+:func:`combine`.
+"""
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from . import trace
+from .features import (FLAGS, TEMPERATURES, flag_frame, from_days, frshtt_digits, station_key,
+                       to_celsius)
+from .store import MISSING_KOPPEN
+
+LEVELS = ['key', 'koppen', 'year', 'month']
+MEASURES = list(TEMPERATURES.values())
+STATS = ['count', 'sum', 'sumsq', 'min', 'max']
+
+# how every cube column merges
+AGG = {'days': 'sum'}
+for _measure in MEASURES:
+    AGG.update({'{}_{}'.format(_measure, s): ('sum' if s in ('count', 'sum', 'sumsq') else s)
+                for s in STATS})
+AGG.update({flag: 'sum' for flag in FLAGS})
+
+
+def build(df):
+    """Cube of a frame of observations (raw or managed).
+
+    ``df`` needs ``stn``, ``wban``, ``year``, ``monthday`` and ``koppen``;
+    temperatures and flags are taken from ``tempC``... and ``fog``... when
+    present, otherwise computed from ``temp``/``max``/``min`` and ``frshtt``.
+    Compact frames (:func:`gsod.features.compact`, ``key`` and ``date`` as
+    columns or index levels) work too.
+    """
+    with trace.stage('cube.build', rows=len(df)) as span:
+        cube = _build(df)
+        span.set(cells=len(cube))
+    return cube
+
+
+def _build(df):
+    if 'stn' in df:
+        key = station_key(df['stn'], df['wban'])
+        month = np.asarray(df['monthday'], dtype=np.int64) // 100
+    else:
+        key = _column(df, 'key')
+        month = from_days(_column(df, 'date')).astype('datetime64[M]').astype(np.int64) % 12 + 1
+    keys = pd.DataFrame({
+        'key': np.asarray(key, dtype=np.int64),
+        'koppen': df['koppen'].astype(object).fillna(MISSING_KOPPEN).values,
+        'year': np.asarray(df['year'], dtype=np.int16),
+        'month': month.astype(np.int8),
+    })
+    values = {'days': np.ones(len(df), dtype=np.int64)}
+    for src, dst in TEMPERATURES.items():
+        v = np.asarray(df[dst], dtype=np.float64) if dst in df else to_celsius(df[src])
+        values[dst] = v
+        values[dst + '_sq'] = v * v
+    if all(f in df for f in FLAGS):
+        flags = np.stack([df[f].values for f in FLAGS], axis=1)
+    elif df['frshtt'].dtype == np.uint8:
+        flags = flag_frame(df['frshtt']).values
+    else:
+        flags = frshtt_digits(df['frshtt'])
+    for i, flag in enumerate(FLAGS):
+        values[flag] = flags[:, i].astype(np.int64)
+    values = pd.DataFrame(values)
+    grouped = values.groupby([keys[level] for level in LEVELS], sort=True)
+
+    out = {'days': grouped['days'].sum()}
+    for measure in MEASURES:
+        out[measure + '_count'] = grouped[measure].count()
+        out[measure + '_sum'] = grouped[measure].sum()
+        out[measure + '_sumsq'] = grouped[measure + '_sq'].sum()
+        out[measure + '_min'] = grouped[measure].min()
+        out[measure + '_max'] = grouped[measure].max()
+    for flag in FLAGS:
+        out[flag] = grouped[flag].sum()
+    return pd.DataFrame(out)[list(AGG)]
+
+
+def _column(df, name):
+    return df[name].values if name in df.columns else df.index.get_level_values(name).values
+
+
+def combine(cube):
+    """Merge the rows of ``cube`` that share the same cell."""
+    return cube.groupby(level=LEVELS, sort=True).agg(AGG)
+
+
+def rollup(cube, by, columns=None, stats=('count', 'mean', 'std', 'min', 'max')):
+    """Statistics of ``columns`` grouped by some of the cube :data:`LEVELS`.
+
+    ``columns`` are temperature measures (``tempC``...) or flags (``fog``...,
+    whose ``sum`` is the days with the flag and ``mean`` their share).
+    Returns ``(column, stat)`` columns like ``groupby(by).agg(...)``; ``std``
+    is the sample standard deviation.
+    """
+    columns = columns or MEASURES
+    by = [by] if isinstance(by, str) else list(by)
+    sums = cube.groupby(level=by, sort=True).agg(AGG) if by else cube.agg(AGG).to_frame().T
+    out = {}
+    for column in columns:
+        if column in FLAGS:
+            n, s, sq = sums['days'], sums[column], sums[column]
+            lo = (s == n).astype(np.int64)
+            hi = (s > 0).astype(np.int64)
+        else:
+            n, s, sq = (sums['{}_{}'.format(column, x)] for x in ('count', 'sum', 'sumsq'))
+            lo, hi = sums[column + '_min'], sums[column + '_max']
+        n = n.astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = s / n
+            var = ((sq - s * mean) / (n - 1)).clip(lower=0)
+        derived = {'count': n, 'sum': s, 'sumsq': sq, 'mean': mean,
+                   'std': np.sqrt(var.where(n > 1)), 'var': var.where(n > 1),
+                   'min': lo, 'max': hi}
+        for stat in stats:
+            out[(column, stat)] = derived[stat]
+    return pd.DataFrame(out)
+
+
+def load(path):
+    cube = pd.read_parquet(str(path))
+    return cube.set_index(LEVELS) if 'key' in cube else cube
+
+
+def save(cube, path):
+    cube.reset_index().to_parquet(str(path), index=False)
+
+
+def update(path, cube):
+    """Merge ``cube`` (of observations not counted yet) into the one at ``path``."""
+    if Path(path).exists():
+        cube = combine(pd.concat([load(path), cube]))
+    save(cube, path)
+    return cube
@@ -0,0 +1,275 @@
+"""Mirror NOAA's yearly GSOD archives into ``data/ncdc/raw/gsod``.
+
+Every year is one ``gsod_YYYY.tar`` (:func:`gsod.archive.year_tar`), left
+packed: :func:`gsod.inventory.build_inventory` counts its members and
+:func:`gsod.pipeline.ingest` streams the station files it needs out of it
+(``download``, ``inventory``, ``select``, ``ingest`` in :mod:`gsod.cli`).
+
+The downloads run on a pool of ``workers`` asyncio tasks, each one keeping
+its own HTTP/1.1 connection open from one file to the next; the blocking
+reads run in threads, so only the standard library is needed.
+
+* A file is written to ``NAME.part`` and renamed when complete. An
+  interrupted or failed download is resumed from the bytes already on disk
+  with a ``Range`` request (``If-Range`` makes sure it is still the same
+  file), retrying up to ``retries`` times.
+* The size received is checked against the size announced by the server,
+  and the SHA-256 against ``checksums`` when given.
+* ``download.manifest.csv`` keeps the size, checksum, ``ETag`` and
+  ``Last-Modified`` of every file; files already mirrored are requested
+  conditionally and skipped when the server answers *304 Not Modified*.
+
+The base URL can point anywhere with the same layout, e.g. a local server::
+
+    python -m gsod download data/ncdc --years 1990 2013 --base-url http://localhost:8000
+"""
+import asyncio
+import concurrent.futures
+import hashlib
+import http.client
+import os
+import sys
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import pandas as pd
+
+from . import trace
+from .archive import year_tar
+
+BASE_URL = 'https://www1.ncdc.noaa.gov/pub/data/gsod'
+MANIFEST = 'download.manifest.csv'
+MANIFEST_COLUMNS = ['name', 'url', 'size', 'sha256', 'etag', 'last_modified']
+CHUNK_SIZE = 1 << 20
+
+
+class DownloadError(Exception):
+    """A failed download; ``retry`` is false when trying again cannot help."""
+
+    def __init__(self, message, retry=True):
+        super(DownloadError, self).__init__(message)
+        self.retry = retry
+
+
+def year_url(year, base_url=BASE_URL):
+    """URL of the archive of a year: ``BASE/YYYY/gsod_YYYY.tar``."""
+    return '{}/{}/gsod_{}.tar'.format(base_url.rstrip('/'), year, year)
+
+
+def read_manifest(root):
+    path = Path(root).joinpath(MANIFEST)
+    if not path.exists():
+        return {}
+    df = pd.read_csv(str(path), dtype=str, keep_default_na=False)
+    return {row['name']: row for row in df.to_dict('records')}
+
+
+def write_manifest(root, entries):
+    path = Path(root).joinpath(MANIFEST)
+    df = pd.DataFrame(list(entries.values()), columns=MANIFEST_COLUMNS).sort_values('name')
+    tmp = path.with_name(path.name + '.tmp')
+    df.to_csv(str(tmp), index=False)
+    os.replace(str(tmp), str(path))
+
+
+def file_sha256(path, chunk_size=CHUNK_SIZE):
+    h = hashlib.sha256()
+    with open(str(path), 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h
+
+
+class Connections(object):
+    """The keep-alive connections of a worker, one per host."""
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.open = {}
+
+    def get(self, scheme, netloc):
+        conn = self.open.get((scheme, netloc))
+        if conn is None:
+            cls = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+            conn = cls(netloc, timeout=self.timeout)
+            self.open[(scheme, netloc)] = conn
+        return conn
+
+    def drop(self, scheme, netloc):
+        conn = self.open.pop((scheme, netloc), None)
+        if conn is not None:
+            conn.close()
+
+    def close(self):
+        for conn in self.open.values():
+            conn.close()
+        self.open.clear()
+
+
+def _fetch(connections, url, path, known, expected_sha256=None):
+    """Download ``url`` to ``path`` (blocking); returns ``(status, entry, bytes)``.
+
+    ``known`` is the manifest entry of the file, if any. ``status`` is
+    ``unchanged``, ``downloaded`` or ``resumed``.
+    """
+    parts = urlsplit(url)
+    conn = connections.get(parts.scheme, parts.netloc)
+    target = parts.path + ('?' + parts.query if parts.query else '')
+    part = path.with_name(path.name + '.part')
+    offset = part.stat().st_size if part.exists() else 0
+    headers = {}
+    mirrored = (known and path.exists() and str(path.stat().st_size) == known['size']
+                and (not expected_sha256 or known['sha256'] == expected_sha256.lower()))
+    if mirrored and not offset:
+        if known.get('etag'):
+            headers['If-None-Match'] = known['etag']
+        if known.get('last_modified'):
+            headers['If-Modified-Since'] = known['last_modified']
+    # the ETag or Last-Modified of the file the partial download comes from
+    validator = part.with_name(part.name + '.validator')
+    if offset:
+        headers['Range'] = 'bytes={}-'.format(offset)
+        if validator.exists():
+            headers['If-Range'] = validator.read_text()
+    try:
+        conn.request('GET', target, headers=headers)
+        resp = conn.getresponse()
+    except (OSError, http.client.HTTPException):
+        connections.drop(parts.scheme, parts.netloc)
+        raise
+
+    try:
+        if resp.status == 304:
+            resp.read()
+            return 'unchanged', known, 0
+        if resp.status == 416:
+            # nothing left after the partial file: start again
+            resp.read()
+            part.unlink()
+            raise DownloadError("{}: range not satisfiable".format(url))
+        if resp.status == 206:
+            start = int(resp.getheader('Content-Range', '').split(' ')[-1].split('-')[0] or -1)
+            if start != offset:
+                raise DownloadError("{}: range starts at {}, not {}".format(url, start, offset))
+            total = resp.getheader('Content-Range').rsplit('/', 1)[-1]
+            total = int(total) if total.isdigit() else None
+            mode, status = 'ab', 'resumed'
+        elif resp.status == 200:
+            # a full answer: no resume, or the file changed since the partial one
+            offset, mode, status = 0, 'wb', 'downloaded'
+            length = resp.getheader('Content-Length')
+            total = int(length) if length and length.isdigit() else None
+            tag = resp.getheader('ETag') or resp.getheader('Last-Modified')
+            if tag:
+                validator.write_text(tag)
+            elif validator.exists():
+                validator.unlink()
+        else:
+            resp.read()
+            raise DownloadError("{}: HTTP {} {}".format(url, resp.status, resp.reason),
+                                retry=resp.status >= 500 or resp.status in (408, 429))
+
+        entry = {'name': path.name, 'url': url, 'size': '', 'sha256': '',
+                 'etag': resp.getheader('ETag') or '',
+                 'last_modified': resp.getheader('Last-Modified') or ''}
+        h = file_sha256(part) if offset else hashlib.sha256()
+        received = 0
+        with open(str(part), mode) as f:
+            while True:
+                chunk = resp.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+                h.update(chunk)
+                received += len(chunk)
+    except (OSError, http.client.HTTPException, DownloadError):
+        # the answer may be left half read
+        connections.drop(parts.scheme, parts.netloc)
+        raise
+    if resp.will_close:
+        connections.drop(parts.scheme, parts.netloc)
+
+    size = offset + received
+    if total is not None and size != total:
+        raise DownloadError("{}: {:,} bytes received of {:,}".format(url, size, total))
+    digest = h.hexdigest()
+    if expected_sha256 and digest != expected_sha256.lower():
+        part.unlink()
+        raise DownloadError("{}: checksum mismatch".format(url))
+    os.replace(str(part), str(path))
+    if validator.exists():
+        validator.unlink()
+    entry.update(size=str(size), sha256=digest)
+    return status, entry, received
+
+
+async def _worker(queue, results, manifest, root, timeout, retries, checksums, out, pool):
+    loop = asyncio.get_running_loop()
+    connections = Connections(timeout)
+    try:
+        while True:
+            try:
+                url, path = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            known = manifest.get(path.name)
+            status, error, received = 'failed', None, 0
+            for attempt in range(retries + 1):
+                try:
+                    status, entry, got = await loop.run_in_executor(
+                        pool, _fetch, connections, url, path, known,
+                        (checksums or {}).get(path.name))
+                    received += got
+                    error = None
+                    break
+                except (OSError, http.client.HTTPException, DownloadError) as e:
+                    error = str(e) or type(e).__name__
+                    if not getattr(e, 'retry', True):
+                        break
+                    if attempt < retries:
+                        await asyncio.sleep(min(2 ** attempt, 30))
+            if error is None and status != 'unchanged':
+                manifest[path.name] = entry
+                write_manifest(root, manifest)
+            seconds = time.perf_counter() - start
+            results.append({'name': path.name, 'status': status if error is None else 'failed',
+                            'bytes': received, 'seconds': seconds, 'error': error})
+            print("{:>20} {:>10} {:>12,} bytes {:>7.1f}s{}".format(
+                path.name, results[-1]['status'], received, seconds,
+                '' if error is None else ' ({})'.format(error)), file=out)
+    finally:
+        connections.close()
+
+
+async def mirror(files, root, workers=4, timeout=60, retries=3, checksums=None, out=sys.stdout):
+    """Download ``(url, name)`` pairs into ``root``; a frame with the outcome of each."""
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    manifest = read_manifest(root)
+    queue = asyncio.Queue()
+    for url, name in files:
+        queue.put_nowait((url, root.joinpath(name)))
+    results = []
+    workers = max(1, min(workers, queue.qsize()))
+    # one thread per worker for the blocking reads
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        await asyncio.gather(*[_worker(queue, results, manifest, root, timeout, retries,
+                                       checksums, out, pool) for _ in range(workers)])
+    return pd.DataFrame(results, columns=['name', 'status', 'bytes', 'seconds', 'error'])
+
+
+def download_years(years, root, base_url=BASE_URL, workers=4, timeout=60, retries=3,
+                   checksums=None, out=sys.stdout):
+    """Mirror the ``gsod_YYYY.tar`` of every year into ``root`` (``raw/gsod``).
+
+    ``checksums`` maps file names to their expected SHA-256. Returns the
+    status (``downloaded``, ``resumed``, ``unchanged`` or ``failed``),
+    bytes and seconds of every file.
+    """
+    files = [(year_url(year, base_url), year_tar(root, year).name) for year in years]
+    with trace.stage('download', files=len(files)) as span:
+        df = asyncio.run(mirror(files, root, workers, timeout, retries, checksums, out))
+        span.set(bytes=int(df['bytes'].sum()), failed=int((df['status'] == 'failed').sum()))
+    return df
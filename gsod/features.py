@@ -0,0 +1,203 @@
+"""Column-wise feature engineering for the observations.
+
+Replaces the row-wise ``apply`` lambdas of the management cells: station
+ids, dates, the ``frshtt`` weather flags and the Celsius temperatures are
+all computed with whole-column NumPy operations. :func:`compact` runs the
+same stage into a small layout (integer keys and days, float32, the flags
+packed in one byte) for the whole dataset.
+"""
+import numpy as np
+import pandas as pd
+
+from . import trace
+
+FLAGS = ['fog', 'rain', 'snow', 'hail', 'thunder', 'tornado']
+
+# GSOD missing temperatures are 9999.9; the ``temp`` colspec drops the first
+# character of the field so there it reads 999.9. No real reading gets close.
+MISSING_TEMP = 999.9
+
+TEMPERATURES = {'temp': 'tempC', 'max': 'maxC', 'min': 'minC'}
+
+# raw measures in °F, see to_measure
+FAHRENHEIT = ['temp', 'dewp', 'max', 'min']
+
+# missing value codes of the other raw measures, as read with the colspecs
+MISSING = {'dewp': 9999.9, 'slp': 9999.9, 'stp': 9999.9, 'visib': 999.9, 'wsdp': 999.9,
+           'mxspd': 999.9, 'gust': 999.9, 'prcp': 99.99, 'sndp': 999.9}
+
+# bit of every flag in the uint8 ``frshtt`` mask of the compact layout
+FLAG_BITS = {name: np.uint8(1 << i) for i, name in enumerate(FLAGS)}
+
+# ``date`` of the compact layout: int32 days since 1970-01-01, this when unknown
+MISSING_DAY = np.iinfo(np.int32).min
+
+
+def FtoC(f):
+    return (f - 32) * 5 / 9
+
+
+def station_key(stn, wban):
+    """Pack ``(usaf, wban)`` into a single int64 key."""
+    return np.asarray(stn, dtype=np.int64) * 100000 + np.asarray(wban, dtype=np.int64)
+
+
+def station_id(stn, wban):
+    """``"usaf-wban"`` ids (``"010010-99999"``), formatted once per station."""
+    codes, keys = pd.factorize(station_key(stn, wban))
+    ids = np.array(["{:0>6}-{:0>5}".format(k // 100000, k % 100000) for k in keys],
+                   dtype=object)
+    return ids[codes]
+
+
+def to_date(year, monthday):
+    """datetime64 dates from integer ``year`` and ``monthday`` (``MMDD``).
+
+    Impossible dates (``0231``, blanks...) become NaT.
+    """
+    year = np.asarray(year, dtype=np.float64)
+    monthday = np.asarray(monthday, dtype=np.float64)
+    valid = ~(np.isnan(year) | np.isnan(monthday))
+    year = np.where(valid, year, 1970).astype(np.int64)
+    monthday = np.where(valid, monthday, 101).astype(np.int64)
+    month = monthday // 100
+    day = monthday % 100
+    valid &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31)
+    months = (year - 1970) * 12 + np.clip(month, 1, 12) - 1
+    first = months.astype('datetime64[M]').astype('datetime64[D]')
+    dates = first + (np.clip(day, 1, 31) - 1)
+    # day 31 of a 30 day month rolls over into the next one
+    valid &= dates.astype('datetime64[M]') == first.astype('datetime64[M]')
+    dates[~valid] = np.datetime64('NaT')
+    return dates.astype('datetime64[ns]')
+
+
+def frshtt_digits(frshtt):
+    """``(rows, 6)`` bool array with the fog/rain/snow/hail/thunder/tornado flags."""
+    code = np.nan_to_num(np.asarray(frshtt, dtype=np.float64)).astype(np.int64)
+    powers = 10 ** np.arange(5, -1, -1)
+    return (code[:, None] // powers) % 10 == 1
+
+
+def frshtt_strings(frshtt):
+    """Zero padded six character ``frshtt`` strings."""
+    code = np.nan_to_num(np.asarray(frshtt, dtype=np.float64)).astype(np.int64)
+    codes, uniques = pd.factorize(code)
+    padded = np.array(["{:0>6}".format(u) for u in uniques], dtype=object)
+    return padded[codes]
+
+
+def frshtt_bits(frshtt):
+    """uint8 masks of the six ``frshtt`` flags, see :data:`FLAG_BITS`."""
+    weights = np.array([FLAG_BITS[name] for name in FLAGS], dtype=np.uint8)
+    return frshtt_digits(frshtt).astype(np.uint8).dot(weights)
+
+
+def flag(bits, name):
+    """bool array of the flag ``name`` in a ``frshtt`` mask column."""
+    return (np.asarray(bits, dtype=np.uint8) & FLAG_BITS[name]) != 0
+
+
+def flag_counts(bits, name=None, normalize=False):
+    """``value_counts`` of a flag, computed on the mask.
+
+    The masks are counted once (there are only 256 of them) and the flag
+    read from the counts. Without ``name``, the days with every flag.
+    """
+    per_mask = np.bincount(np.asarray(bits, dtype=np.uint8), minlength=256)
+    masks = np.arange(256, dtype=np.uint8)
+    total = per_mask.sum()
+    if name is None:
+        counts = pd.Series([per_mask[(masks & FLAG_BITS[f]) != 0].sum() for f in FLAGS], index=FLAGS)
+    else:
+        on = per_mask[(masks & FLAG_BITS[name]) != 0].sum()
+        counts = pd.Series([total - on, on], index=pd.Index([False, True], name=name), name='count')
+        counts = counts.sort_values(ascending=False, kind='mergesort')
+    return counts / total if normalize else counts
+
+
+def flag_frame(bits):
+    """The six bool flag columns of a mask column."""
+    bits = np.asarray(bits, dtype=np.uint8)
+    return pd.DataFrame({name: (bits & FLAG_BITS[name]) != 0 for name in FLAGS})
+
+
+def to_days(dates):
+    """int32 days since the epoch of datetime64 ``dates``, NaT as :data:`MISSING_DAY`."""
+    dates = np.asarray(dates, dtype='datetime64[D]')
+    days = dates.astype(np.int64)
+    days[np.isnat(dates)] = MISSING_DAY
+    return days.astype(np.int32)
+
+
+def from_days(days):
+    """datetime64 dates of int32 ``days``."""
+    days = np.asarray(days, dtype=np.int64)
+    dates = days.astype('datetime64[D]').astype('datetime64[ns]')
+    dates[days == MISSING_DAY] = np.datetime64('NaT')
+    return dates
+
+
+def to_celsius(fahrenheit):
+    """°F to °C with the missing values (9999.9) masked as NaN."""
+    f = pd.to_numeric(fahrenheit, errors='coerce')
+    f = np.asarray(f, dtype=np.float64)
+    return FtoC(np.where(f >= MISSING_TEMP, np.nan, f))
+
+
+def to_measure(values, column):
+    """A raw measure with its missing values as NaN; temperatures in °C."""
+    if column in FAHRENHEIT:
+        return to_celsius(values)
+    v = np.asarray(pd.to_numeric(values, errors='coerce'), dtype=np.float64)
+    if column in MISSING:
+        # float32 columns hold the codes a little off (99.99 -> 99.9899978...)
+        v = np.where(v >= MISSING[column] - 1e-3, np.nan, v)
+    return v
+
+
+def manage(df, ids=True, copy=True):
+    """Add the derived columns of the management stage to a copy of ``df``.
+
+    ``id`` (when ``ids``), ``date``, zero padded ``frshtt``, the six flag
+    columns and ``tempC``/``maxC``/``minC``. With ``copy=False`` the
+    columns are added to ``df`` itself.
+    """
+    with trace.stage('features', rows=len(df)):
+        out = df.copy() if copy else df
+        if ids:
+            out['id'] = station_id(df['stn'], df['wban'])
+        out['date'] = to_date(df['year'], df['monthday'])
+        flags = frshtt_digits(df['frshtt'])
+        out['frshtt'] = frshtt_strings(df['frshtt'])
+        for i, name in enumerate(FLAGS):
+            out[name] = flags[:, i]
+        for src, dst in TEMPERATURES.items():
+            out[dst] = to_celsius(df[src])
+    return out
+
+
+def compact(df, measures=()):
+    """The management stage in a compact layout.
+
+    One row per observation with the packed station ``key`` (int64), ``year``
+    (int16), ``date`` as int32 days (:func:`from_days`), ``koppen`` as a
+    category, ``tempC``/``maxC``/``minC`` as float32 and the six weather
+    flags in a uint8 ``frshtt`` mask (:func:`flag`, :func:`flag_counts`).
+    ``measures`` are other columns to keep, as float32 with their missing
+    codes as NaN (:func:`to_measure`, so ``dewp`` in °C too).
+    """
+    with trace.stage('features.compact', rows=len(df)):
+        out = pd.DataFrame({
+            'key': station_key(df['stn'], df['wban']),
+            'year': np.asarray(df['year'], dtype=np.int16),
+            'date': to_days(to_date(df['year'], df['monthday'])),
+        })
+        if 'koppen' in df:
+            out['koppen'] = pd.Categorical(df['koppen'])
+        for src, dst in TEMPERATURES.items():
+            out[dst] = to_celsius(df[src]).astype(np.float32)
+        for column in measures:
+            out[column] = to_measure(df[column], column).astype(np.float32)
+        out['frshtt'] = frshtt_bits(df['frshtt'])
+    return out
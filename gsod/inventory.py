@@ -0,0 +1,252 @@
+"""Inventory of the raw GSOD archive: observations per station and year.
+
+Every ``raw/gsod/YEAR/USAF-WBAN-YEAR.op`` file holds one header line and
+one line per observed day, so the inventory only needs a line count. The
+count is done on raw bytes in large chunks (no decoding) and files are
+spread over a process pool. Station files still packed in NOAA's yearly
+``raw/gsod/gsod_YYYY.tar`` archives are counted from the tar, one archive
+per task; a station-year found both extracted and packed counts once.
+"""
+import os
+import sys
+import tarfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from . import trace
+
+CHUNK_SIZE = 1 << 20
+BATCH_SIZE = 256
+COLUMNS = ['id', 'year', 'obs']
+MANIFEST_COLUMNS = ['path', 'size', 'mtime', 'id', 'year', 'obs']
+
+
+def parse_name(path):
+    """Return ``(id, year)`` from a ``USAF-WBAN-YEAR.op`` file name."""
+    usaf, wban, year = Path(path).name.split('.')[0].split('-')
+    return "{}-{}".format(usaf, wban), int(year)
+
+
+def count_obs(path, chunk_size=CHUNK_SIZE):
+    """Count the observations of an ``.op`` file (all lines but the header)."""
+    lines = 0
+    last = b'\n'
+    with open(str(path), 'rb', buffering=0) as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            lines += chunk.count(b'\n')
+            last = chunk[-1:]
+    # a final line without its newline is still a line
+    if last != b'\n':
+        lines += 1
+    return max(lines - 1, 0)
+
+
+def is_tar(path):
+    return str(path).endswith('.tar')
+
+
+def _count_batch(paths):
+    from .archive import count_tar_ops
+
+    rows, failed, nbytes = [], [], 0
+    for path in paths:
+        try:
+            # stat before reading: a file touched meanwhile is rescanned next time
+            st = os.stat(path)
+            if is_tar(path):
+                # one row per station file, all keyed on the archive
+                counts = count_tar_ops(path)
+            else:
+                counts = [parse_name(path) + (count_obs(path),)]
+            rows.extend((path, st.st_size, st.st_mtime_ns) + c for c in counts)
+            nbytes += st.st_size
+        except (OSError, ValueError, EOFError, tarfile.TarError, zlib.error) as e:
+            failed.append((path, repr(e)))
+    return rows, failed, nbytes
+
+
+def _batches(paths, size):
+    # every archive is a batch of its own
+    files = [p for p in paths if not is_tar(p)]
+    for i in range(0, len(files), size):
+        yield files[i:i + size]
+    for path in paths:
+        if is_tar(path):
+            yield [path]
+
+
+class Progress(object):
+    """Throughput report printed every ``every`` station files.
+
+    ``total`` is unknown (``None``) until the archives are read.
+    """
+
+    def __init__(self, total, every=1000, out=sys.stdout):
+        self.total = total
+        self.every = every
+        self.out = out
+        self.files = 0
+        self.obs = 0
+        self.nbytes = 0
+        self.reported = 0
+        self.start = time.time()
+
+    def update(self, rows, nbytes):
+        self.files += len(rows)
+        self.obs += sum(r[-1] for r in rows)
+        self.nbytes += nbytes
+        if self.every and self.files - self.reported >= self.every:
+            self.report()
+
+    def report(self):
+        self.reported = self.files
+        elapsed = max(time.time() - self.start, 1e-9)
+        print("{:>8}/{} files {:>14,} obs {:>8.0f} files/s {:>7.1f} MB/s".format(
+            self.files, '?' if self.total is None else self.total, self.obs,
+            self.files / elapsed, self.nbytes / elapsed / 2**20), file=self.out)
+
+
+def scan(paths, workers=None, batch_size=BATCH_SIZE, every=1000):
+    """Count observations for every path.
+
+    Returns a manifest DataFrame (``path, size, mtime, id, year, obs``, one
+    row per station file, those of an archive under its path) plus a list
+    of ``(path, error)`` for the files that could not be read. Nothing is
+    dropped without being listed there.
+    """
+    paths = [str(p) for p in paths]
+    progress = Progress(None if any(map(is_tar, paths)) else len(paths), every=every)
+    rows, failed = [], []
+    with trace.stage('inventory.scan', files=len(paths)) as span:
+        if workers == 1:
+            results = map(_count_batch, _batches(paths, batch_size))
+            executor = None
+        else:
+            executor = ProcessPoolExecutor(max_workers=workers)
+            results = executor.map(_count_batch, _batches(paths, batch_size))
+        try:
+            for brows, bfailed, nbytes in results:
+                rows.extend(brows)
+                failed.extend(bfailed)
+                progress.update(brows, nbytes)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        span.set(rows=progress.obs, bytes=progress.nbytes, failed=len(failed))
+    if every and progress.reported != progress.files:
+        progress.report()
+    return pd.DataFrame(data=rows, columns=MANIFEST_COLUMNS), failed
+
+
+def to_inventory(manifest):
+    """The ``id``-indexed ``year, obs`` inventory of a manifest.
+
+    A station-year both extracted and in its archive counts once, from the
+    extracted file (the one the ingest reads).
+    """
+    df = manifest.assign(packed=[is_tar(p) for p in manifest['path']])
+    df = df.sort_values(['id', 'year', 'packed']).drop_duplicates(['id', 'year'])
+    return df[COLUMNS].set_index(['id'])
+
+
+def manifest_path(csv_path):
+    """The manifest kept next to an inventory CSV: ``gsod.csv`` -> ``gsod.manifest.csv``."""
+    csv_path = Path(csv_path)
+    return csv_path.with_name(csv_path.stem + '.manifest.csv')
+
+
+def read_manifest(path):
+    return pd.read_csv(str(path), dtype={'path': str, 'id': str})
+
+
+def _report_failed(failed):
+    for path, error in failed:
+        print("failed: {} ({})".format(path, error), file=sys.stderr)
+    if failed:
+        print("{:,} files could not be read".format(len(failed)), file=sys.stderr)
+
+
+def _relative(manifest, root):
+    # paths are kept relative to ``root`` so the manifest survives a move
+    manifest['path'] = [Path(p).relative_to(root).as_posix() for p in manifest['path']]
+    return manifest
+
+
+def _write(manifest, csv_path):
+    df = to_inventory(manifest)
+    df.to_csv(str(csv_path))
+    manifest.to_csv(str(manifest_path(csv_path)), index=False)
+    return df
+
+
+def find_op_files(root):
+    """All ``.op`` files under ``root`` (the ``raw/gsod`` folder)."""
+    return sorted(Path(root).glob('**/*.op'))
+
+
+def find_inputs(root):
+    """The ``.op`` files and ``gsod_YYYY.tar`` archives under ``root``.
+
+    Raises ``FileNotFoundError`` when there are none: an empty inventory
+    is always a mistake.
+    """
+    paths = find_op_files(root) + sorted(Path(root).glob('gsod_*.tar'))
+    if not paths:
+        raise FileNotFoundError("no .op files or gsod_YYYY.tar archives under {}".format(root))
+    return paths
+
+
+def build_inventory(root, csv_path, workers=None, every=1000):
+    """Scan ``root`` and write the ``id,year,obs`` inventory to ``csv_path``.
+
+    The manifest used by :func:`refresh_inventory` is written alongside.
+    """
+    manifest, failed = scan(find_inputs(root), workers=workers, every=every)
+    manifest = _relative(manifest, root)
+    _report_failed(failed)
+    return _write(manifest, csv_path), failed
+
+
+def refresh_inventory(root, csv_path, workers=None, every=1000):
+    """Bring ``csv_path`` up to date with the files under ``root``.
+
+    Only files (``.op`` or archives) that are new or whose size or mtime
+    differ from the manifest are counted again; files gone from ``root`` are dropped. Without a
+    manifest this is a full :func:`build_inventory`.
+    """
+    root = Path(root)
+    mpath = manifest_path(csv_path)
+    if not mpath.exists():
+        return build_inventory(root, csv_path, workers=workers, every=every)
+
+    old = read_manifest(mpath)
+    current = []
+    for path in find_inputs(root):
+        st = path.stat()
+        current.append((path.relative_to(root).as_posix(), st.st_size, st.st_mtime_ns))
+    current = pd.DataFrame(data=current, columns=MANIFEST_COLUMNS[:3])
+
+    merged = current.merge(old, on='path', how='left', suffixes=('', '_old'))
+    stale = ((merged['size'] != merged['size_old'])
+             | (merged['mtime'] != merged['mtime_old']))
+    kept = merged.loc[~stale, MANIFEST_COLUMNS]
+    # an archive has a row per station file, count the files themselves
+    changed = merged.loc[stale, 'path'].unique()
+    print("{:,} files unchanged, {:,} to scan, {:,} removed".format(
+        kept['path'].nunique(), len(changed),
+        old.loc[~old['path'].isin(current['path']), 'path'].nunique()))
+
+    fresh, failed = scan([root.joinpath(p) for p in changed], workers=workers, every=every)
+    fresh = _relative(fresh, root)
+    _report_failed(failed)
+    manifest = pd.concat([kept, fresh], ignore_index=True)
+    manifest['year'] = manifest['year'].astype(int)
+    manifest['obs'] = manifest['obs'].astype(int)
+    return _write(manifest, csv_path), failed
@@ -0,0 +1,112 @@
+"""Köppen-Geiger classification of stations and observations."""
+import sys
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .features import station_key
+
+KOPPEN_CSV = Path(__file__).resolve().parent.parent.joinpath('data', 'koppen.csv')
+
+
+def read_koppen(path=KOPPEN_CSV):
+    """The ``gridcode -> koppen`` table (``data/koppen.csv``)."""
+    return pd.read_csv(str(path), index_col=['gridcode'])
+
+
+def id_to_key(ids):
+    """Packed int64 keys from ``"usaf-wban"`` id strings."""
+    parts = pd.Series(np.asarray(ids, dtype=object)).str.split('-', expand=True)
+    return station_key(parts[0].astype(np.int64), parts[1].astype(np.int64))
+
+
+class KoppenIndex(object):
+    """Station key -> Köppen class lookup.
+
+    Keys are kept sorted next to the category code of their class, so a
+    whole batch of observations is tagged with one ``searchsorted``.
+    Observations of stations that are not in the index get ``None`` and
+    are counted per station in ``unmatched``.
+    """
+
+    def __init__(self, keys, classes):
+        keys = np.asarray(keys, dtype=np.int64)
+        cat = pd.Categorical(classes)
+        order = np.argsort(keys, kind='mergesort')
+        self.keys = keys[order]
+        self.codes = cat.codes[order]
+        self.categories = np.asarray(cat.categories, dtype=object)
+        self.unmatched = Counter()
+
+    @classmethod
+    def from_frame(cls, df, column='koppen'):
+        """Index a station frame indexed by ``"usaf-wban"`` ids, like ``scdfc``."""
+        return cls(id_to_key(df.index), df[column].values)
+
+    def codes_for(self, stn, wban):
+        """Category codes for every observation, -1 where unmatched."""
+        keys = station_key(stn, wban)
+        if not len(self.keys):
+            codes = np.full(len(keys), -1, dtype=np.int64)
+        else:
+            pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+            codes = np.where(self.keys[pos] == keys, self.codes[pos], -1)
+        missing = codes == -1
+        if missing.any():
+            found, counts = np.unique(keys[missing], return_counts=True)
+            self.unmatched.update(dict(zip(found.tolist(), counts.tolist())))
+        return codes
+
+    def lookup(self, stn, wban):
+        """Köppen class of every observation as an object array."""
+        codes = self.codes_for(stn, wban)
+        # code -1 picks the trailing None
+        values = np.append(self.categories, None)
+        return values[codes]
+
+    def report(self, out=sys.stdout):
+        if self.unmatched:
+            print("{:,} observations of {:,} stations without Köppen class".format(
+                sum(self.unmatched.values()), len(self.unmatched)), file=out)
+
+
+def intersect(stations, regions, koppen_table=None):
+    """Stations joined to the regions (see :mod:`gsod.spatial`) containing them.
+
+    One row per station and region, indexed by the station id, with the
+    region ``gridcode`` and its ``koppen`` class; the local equivalent of
+    the ``ST_Intersects`` join on CartoDB.
+    """
+    if koppen_table is None:
+        koppen_table = read_koppen()
+    points, codes = regions.locate(stations['lon'].values, stations['lat'].values)
+    pairs = pd.DataFrame({'gridcode': codes}, index=stations.index[points])
+    pairs['koppen'] = koppen_table['koppen'].reindex(codes).values
+    return pairs
+
+
+def classify(stations, regions, koppen_table=None):
+    """``stations`` with ``gridcode`` and ``koppen`` columns.
+
+    A station inside overlapping regions keeps the first class in
+    alphabetical order, like the week03 query; stations outside every
+    region get NaN.
+    """
+    pairs = intersect(stations, regions, koppen_table)
+    pairs = pairs.sort_values('koppen', kind='mergesort')
+    first = pairs[~pairs.index.duplicated()]
+    return stations.join(first, how='left')
+
+
+def filter_stations(df, min_count=None, max_elev=None, gridcodes=None):
+    """Rows of a station statistics table passing the notebook filters."""
+    mask = np.ones(len(df), dtype=bool)
+    if min_count is not None:
+        mask &= (df['count'] >= min_count).values
+    if max_elev is not None:
+        mask &= (df['elev'] < max_elev).values
+    if gridcodes is not None:
+        mask &= df['gridcode'].isin(list(gridcodes)).values
+    return df[mask]
@@ -0,0 +1,119 @@
+"""Nearest stations of a point or of other stations.
+
+The stations (the registry table or ``scdf``, with ``lat``/``lon``) are
+placed on the unit sphere and indexed with a :class:`gsod.spatial.KDTree`,
+where the straight line (chord) distance grows with the great circle one;
+results are given in great circle kilometres. Queries take arrays of
+points, so a whole batch runs in one vectorized pass::
+
+    search = neighbours.StationSearch(scdf)
+    search.nearest(39.49, -0.47, k=5, min_count=20)
+    search.within(lats, lons, radius=50)
+    search.neighbours(scdfc.index, k=3, max_elev=500)
+
+The filters of :func:`gsod.koppen.filter_stations` (``min_count``,
+``max_elev``...) restrict the stations searched; the tree of every set of
+filters is built once.
+"""
+import numpy as np
+import pandas as pd
+
+from . import trace
+from .koppen import filter_stations
+from .spatial import KDTree
+
+EARTH_RADIUS = 6371.0088  # km, mean radius
+
+
+def to_unit(lat, lon):
+    """``(n, 3)`` unit vectors of latitudes and longitudes in degrees."""
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def chord_to_km(chord):
+    return 2 * EARTH_RADIUS * np.arcsin(np.clip(np.asarray(chord) / 2, 0, 1))
+
+
+def km_to_chord(km):
+    return 2 * np.sin(np.minimum(np.asarray(km, dtype=np.float64), np.pi * EARTH_RADIUS)
+                      / (2 * EARTH_RADIUS))
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great circle distance in km."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64))
+                              for v in (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def _points(lat, lon):
+    # unit vectors of the located points and their query numbers
+    x = to_unit(lat, lon).reshape(-1, 3)
+    valid = np.isfinite(x).all(axis=1)
+    return x[valid], np.flatnonzero(valid)
+
+
+class StationSearch(object):
+    """k-nearest and radius queries over a station table indexed by id."""
+
+    def __init__(self, stations, leaf_size=16):
+        self.stations = stations.dropna(subset=['lat', 'lon'])
+        with trace.stage('neighbours.build', rows=len(self.stations)):
+            self.tree = KDTree(to_unit(self.stations['lat'].values, self.stations['lon'].values),
+                               leaf_size)
+        self.leaf_size = leaf_size
+        self._filtered = {}
+
+    def _search(self, filters):
+        filters = {name: value for name, value in filters.items() if value is not None}
+        if not filters:
+            return self
+        key = tuple(sorted((name, repr(value)) for name, value in filters.items()))
+        if key not in self._filtered:
+            self._filtered[key] = StationSearch(filter_stations(self.stations, **filters),
+                                                self.leaf_size)
+        return self._filtered[key]
+
+    def nearest(self, lat, lon, k=1, **filters):
+        """The ``k`` nearest stations of every point.
+
+        Returns ``query`` (position of the point), ``rank``, station ``id``
+        and ``distance`` (km), sorted by query and distance. Points without
+        coordinates get no rows.
+        """
+        search = self._search(filters)
+        x, queries = _points(lat, lon)
+        items, chords = search.tree.query(x, k)
+        n, k = items.shape
+        return pd.DataFrame({
+            'query': np.repeat(queries, k), 'rank': np.tile(np.arange(k), n),
+            'id': search.stations.index.values[items.ravel()],
+            'distance': chord_to_km(chords.ravel())})
+
+    def within(self, lat, lon, radius, **filters):
+        """The stations within ``radius`` km of every point (``query``, ``id``, ``distance``)."""
+        search = self._search(filters)
+        x, queries = _points(lat, lon)
+        radius = np.broadcast_to(np.asarray(radius, dtype=np.float64), (np.size(lat),))[queries]
+        q, items, chords = search.tree.query_radius(x, km_to_chord(radius))
+        return pd.DataFrame({'query': queries[q], 'id': search.stations.index.values[items],
+                             'distance': chord_to_km(chords)})
+
+    def neighbours(self, ids, k=1, **filters):
+        """The ``k`` nearest other stations of the stations ``ids``.
+
+        Returns ``station``, ``rank``, neighbour ``id`` and ``distance`` (km).
+        """
+        ids = np.asarray(ids, dtype=object)
+        located = self.stations.reindex(ids)
+        df = self.nearest(located['lat'].values, located['lon'].values, k + 1, **filters)
+        df.insert(0, 'station', ids[df['query'].values])
+        # a station is its own nearest one unless filtered out
+        df = df[df['station'] != df['id']]
+        df = df[df.groupby('query').cumcount() < k]
+        df['rank'] = df.groupby('query').cumcount()
+        return df.drop(columns='query').reset_index(drop=True)
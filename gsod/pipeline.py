@@ -0,0 +1,190 @@
+"""Bounded-memory ingest of station-year files.
+
+Files are parsed and tagged in fixed-size batches on a process pool while
+the main process consumes the results as they come (writing them to the
+observation store and folding them into small aggregates). Only a window
+of batches is in flight at any time; with a ``memory_limit`` the window
+shrinks so that the estimated footprint stays under it, counting the
+resident memory of the workers as well as this process', and the peak
+resident memory of the run is reported at the end.
+"""
+import copy
+import gc
+import os
+import resource
+import sys
+import time
+from collections import Counter, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import pandas as pd
+
+from . import archive, features, reader, store, trace
+from .trace import children_rss, peak_rss, rss
+
+Report = namedtuple('Report', ['batches', 'rows', 'seconds', 'peak_rss', 'peak_rss_workers'])
+
+# parsing a batch needs the raw bytes plus the 2D field blocks on top of
+# the resulting frame
+WORK_FACTOR = 3
+
+
+def batches(items, size):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def parse_and_tag(paths, index=None, columns=None):
+    """Worker: parse a batch of ``.op`` files and add their ``koppen`` class.
+
+    Station files still in their year tar come as
+    :class:`gsod.archive.TarMember` and are read at their offset. Returns
+    the frame and the observations per station left unmatched.
+    """
+    members = [p for p in paths if isinstance(p, archive.TarMember)]
+    paths = [p for p in paths if not isinstance(p, archive.TarMember)]
+    frames = []
+    if paths or not members:
+        frames.append(reader.read_op_files(paths, columns=columns))
+    if members:
+        frames.append(archive.read_members(members, columns=columns))
+    df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+    unmatched = {}
+    if index is not None:
+        # count on a fresh copy, the caller merges the counts
+        index = copy.copy(index)
+        index.unmatched = Counter()
+        df['koppen'] = index.lookup(df['stn'], df['wban'])
+        unmatched = index.unmatched
+    return df, unmatched
+
+
+class Window(object):
+    """How many batches may be in flight, given an optional memory limit.
+
+    The limit covers this process and its workers together: what they hold
+    now is taken off it and the rest is split into batches of the largest
+    size seen so far.
+    """
+
+    def __init__(self, size, memory_limit=None):
+        self.max_size = size
+        self.size = size
+        self.memory_limit = memory_limit
+        self.batch_bytes = 0
+
+    def observe(self, df):
+        self.batch_bytes = max(self.batch_bytes, int(df.memory_usage(deep=True).sum()))
+        if self.memory_limit is None:
+            return
+        free = self.memory_limit - rss() - children_rss()
+        fits = int(free // max(self.batch_bytes * WORK_FACTOR, 1))
+        self.size = max(1, min(self.max_size, fits))
+
+
+def run(items, work, consume, workers=None, batch_size=200, memory_limit=None,
+        every=10, out=sys.stdout):
+    """Run ``work`` over ``items`` in batches and ``consume`` every result.
+
+    ``work`` runs on a pool of ``workers`` processes (in this process when
+    ``workers`` is 1) and must be picklable; ``consume`` runs here, in
+    submission order. ``memory_limit`` is in bytes.
+    """
+    workers = workers or os.cpu_count() or 1
+    window = Window(2 * workers, memory_limit)
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    pending = deque()
+    start = time.time()
+    done = rows = 0
+    peak = rss()
+
+    def drain_one():
+        nonlocal done, rows, peak
+        future = pending.popleft()
+        result = future.result() if executor is not None else future
+        df = result[0] if isinstance(result, tuple) else result
+        window.observe(df)
+        consume(result)
+        done += 1
+        rows += len(df)
+        del result, df
+        peak = max(peak, rss())
+        if every and done % every == 0:
+            print("{:>6} batches {:>12,} obs {:>8.1f} MiB rss (workers {:.1f} MiB), "
+                  "window {}".format(done, rows, rss() / 2**20, children_rss() / 2**20,
+                                     window.size), file=out)
+
+    try:
+        for batch in batches(items, batch_size):
+            while len(pending) >= window.size:
+                drain_one()
+                gc.collect()
+            if executor is not None:
+                pending.append(executor.submit(work, batch))
+            else:
+                pending.append(work(batch))
+        while pending:
+            drain_one()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    peak = max(peak, peak_rss())
+    # with one worker the work runs here, its peak is this process' one
+    workers_peak = peak_rss(resource.RUSAGE_CHILDREN) if executor is not None else peak
+    report = Report(done, rows, time.time() - start, peak, workers_peak)
+    print("{:,} obs in {:.1f}s, peak rss {:.1f} MiB (workers {:.1f} MiB)".format(
+        report.rows, report.seconds, report.peak_rss / 2**20,
+        report.peak_rss_workers / 2**20), file=out)
+    return report
+
+
+def ingest(paths, index, root, workers=None, batch_size=200, memory_limit=None,
+           aggregate=None, combine=None, raw=None, sketches=None, **kwargs):
+    """Parse, tag and append ``paths`` to the observation store at ``root``.
+
+    With ``raw`` missing files are read from the year tars under it: every
+    tar is walked once up front for the offsets of the files wanted (see
+    :func:`gsod.archive.locate_station_years`) and the batches read just
+    those bytes. ``aggregate`` maps every batch to a
+    small frame indexed by group keys; the partial frames are merged with
+    ``combine`` (a sum per group by default) as they arrive and returned with
+    the run report. ``sketches`` (a :class:`gsod.quantiles.SketchSet`) gets
+    the °C mean temperatures by ``(key, year, koppen)``. Unmatched
+    stations are folded into ``index.unmatched``.
+    """
+    partials = []
+
+    def consume(result):
+        df, unmatched = result
+        index.unmatched.update(unmatched)
+        with trace.stage('store.append', rows=len(df)):
+            store.append(df, root)
+        if sketches is not None:
+            keys = pd.DataFrame({'key': features.station_key(df['stn'], df['wban']),
+                                 'year': df['year'].values, 'koppen': df['koppen'].values})
+            sketches.update(keys, features.to_celsius(df['temp']))
+        if aggregate is not None:
+            partials.append(aggregate(df))
+            if len(partials) > 1:
+                merged = pd.concat(partials)
+                if combine is None:
+                    merged = merged.groupby(level=list(range(merged.index.nlevels))).sum()
+                else:
+                    merged = combine(merged)
+                partials[:] = [merged]
+
+    if raw is not None:
+        with trace.stage('ingest.locate', files=len(paths)) as span:
+            extracted, members = archive.locate_station_years(raw, paths)
+            span.set(extracted=len(extracted), packed=len(members))
+        paths = extracted + members
+    work = partial(parse_and_tag, index=index)
+    with trace.stage('ingest', files=len(paths)) as span:
+        report = run(paths, work, consume, workers=workers, batch_size=batch_size,
+                     memory_limit=memory_limit, **kwargs)
+        span.set(rows=report.rows, batches=report.batches,
+                 peak_rss_workers=report.peak_rss_workers)
+    index.report()
+    return report, (partials[0] if partials else None)
@@ -0,0 +1,363 @@
+"""Distribution plots that scale to the whole observation table.
+
+Values are counted once on a fine regular grid (:class:`Binned`, one
+``np.bincount`` pass per chunk, so it can be filled from a stream of
+batches or the store). Histograms are drawn by merging grid cells, and the
+Gaussian KDE is the grid convolved with the kernel through an FFT, so the
+cost depends on the grid size and not on the number of points.
+
+Scatter plots work the same way: :class:`Binned2D` rasterizes the pairs
+into a density grid and keeps the sums needed for the least squares line
+and its confidence band, so neither the drawing nor the fit touch the
+individual points again.
+
+Drawing needs ``matplotlib``; the binning and density estimates do not.
+"""
+import numpy as np
+
+from . import store, trace
+from .features import TEMPERATURES, to_celsius
+
+# °C range of the temperature grids, wider than any GSOD reading
+TEMPERATURE_RANGE = (-90.0, 60.0)
+
+TEMPERATURE_LABELS = {'tempC': 'Mean', 'maxC': 'Max', 'minC': 'Min'}
+
+
+class Binned(object):
+    """Counts of values on ``bins`` equal cells between ``lo`` and ``hi``.
+
+    Values out of the range and NaN are left out (see :attr:`dropped`).
+    Grids with the same range and bins add up with :meth:`merge`.
+    """
+
+    def __init__(self, lo, hi, bins=4096):
+        self.lo = float(lo)
+        self.hi = float(hi)
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.dropped = 0
+
+    @classmethod
+    def from_values(cls, values, lo=None, hi=None, bins=4096):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if lo is None or hi is None:
+            finite = values[np.isfinite(values)]
+            lo = finite.min() if lo is None and len(finite) else (0.0 if lo is None else lo)
+            hi = finite.max() if hi is None and len(finite) else (lo + 1.0 if hi is None else hi)
+            if hi <= lo:
+                hi = lo + 1.0
+        return cls(lo, hi, bins).add(values)
+
+    @property
+    def width(self):
+        return (self.hi - self.lo) / len(self.counts)
+
+    @property
+    def centers(self):
+        return self.lo + (np.arange(len(self.counts)) + 0.5) * self.width
+
+    @property
+    def n(self):
+        return int(self.counts.sum())
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        with np.errstate(invalid='ignore'):
+            cell = np.floor((values - self.lo) / self.width)
+        # the upper edge belongs to the last cell
+        cell[values == self.hi] = len(self.counts) - 1
+        inside = (cell >= 0) & (cell < len(self.counts))
+        self.counts += np.bincount(cell[inside].astype(np.int64), minlength=len(self.counts))
+        self.dropped += len(values) - int(inside.sum())
+        return self
+
+    def merge(self, other):
+        if (other.lo, other.hi, len(other.counts)) != (self.lo, self.hi, len(self.counts)):
+            raise ValueError("can only merge grids with the same range and bins")
+        self.counts += other.counts
+        self.dropped += other.dropped
+        return self
+
+    def mean(self):
+        return np.average(self.centers, weights=self.counts)
+
+    def std(self):
+        centers = self.centers
+        mean = np.average(centers, weights=self.counts)
+        var = np.average((centers - mean) ** 2, weights=self.counts) * self.n / max(self.n - 1, 1)
+        return np.sqrt(var)
+
+    def histogram(self, bins=50):
+        """``(edges, counts)`` over the occupied range, merging grid cells."""
+        used = np.flatnonzero(self.counts)
+        if not len(used):
+            return np.array([self.lo, self.hi]), np.zeros(1, dtype=np.int64)
+        first, last = used[0], used[-1] + 1
+        step = max(1, -(-(last - first) // bins))
+        counts = np.add.reduceat(self.counts[first:last], np.arange(0, last - first, step))
+        edges = self.lo + (first + np.arange(len(counts) + 1) * step) * self.width
+        return edges, counts
+
+    def kde(self, bw='scott', cut=3, gridsize=None):
+        """``(x, density)`` of a Gaussian KDE, by FFT convolution of the grid.
+
+        ``bw`` is the kernel standard deviation or ``'scott'``/``'silverman'``;
+        the curve extends ``cut`` bandwidths past the data, like seaborn.
+        """
+        n = self.n
+        if n < 2:
+            return np.zeros(0), np.zeros(0)
+        sigma = self.std()
+        if bw == 'scott':
+            bw = sigma * n ** (-1 / 5.)
+        elif bw == 'silverman':
+            bw = sigma * (n * 3 / 4.) ** (-1 / 5.)
+        bw = max(float(bw), self.width)
+        used = np.flatnonzero(self.counts)
+        pad = int(np.ceil(cut * bw / self.width))
+        counts = np.r_[np.zeros(pad), self.counts[used[0]:used[-1] + 1], np.zeros(pad)]
+        half = int(np.ceil(4 * bw / self.width))
+        offsets = np.arange(-half, half + 1) * self.width
+        kernel = np.exp(-0.5 * (offsets / bw) ** 2)
+        kernel /= kernel.sum()
+        size = len(counts) + len(kernel) - 1
+        nfft = 1 << int(np.ceil(np.log2(size)))
+        smooth = np.fft.irfft(np.fft.rfft(counts, nfft) * np.fft.rfft(kernel, nfft), nfft)
+        density = np.clip(smooth[half:half + len(counts)], 0, None) / (n * self.width)
+        x = self.lo + (used[0] - pad + np.arange(len(counts)) + 0.5) * self.width
+        if gridsize is not None and gridsize < len(x):
+            grid = np.linspace(x[0], x[-1], gridsize)
+            density, x = np.interp(grid, x, density), grid
+        return x, density
+
+
+class Binned2D(object):
+    """Counts of ``(x, y)`` pairs on a regular grid plus their regression sums.
+
+    Pairs with a NaN or out of the range are left out. The sums are taken
+    around the mean of the first batch so they stay accurate for values far
+    from zero (sea level pressure...).
+    """
+
+    def __init__(self, xlim, ylim, bins=(200, 200)):
+        self.xlim = tuple(float(v) for v in xlim)
+        self.ylim = tuple(float(v) for v in ylim)
+        bins = (bins, bins) if np.isscalar(bins) else tuple(bins)
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.shift = None
+        # n, x, y, xx, xy, yy
+        self.sums = np.zeros(6)
+
+    @classmethod
+    def from_values(cls, x, y, xlim=None, ylim=None, bins=(200, 200)):
+        x = np.asarray(x, dtype=np.float64).ravel()
+        y = np.asarray(y, dtype=np.float64).ravel()
+        ok = np.isfinite(x) & np.isfinite(y)
+        xlim = xlim or _limits(x[ok])
+        ylim = ylim or _limits(y[ok])
+        return cls(xlim, ylim, bins).add(x, y)
+
+    @property
+    def edges(self):
+        return (np.linspace(self.xlim[0], self.xlim[1], self.counts.shape[0] + 1),
+                np.linspace(self.ylim[0], self.ylim[1], self.counts.shape[1] + 1))
+
+    @property
+    def n(self):
+        return int(self.sums[0])
+
+    def _cells(self, values, lim, size):
+        with np.errstate(invalid='ignore'):
+            cell = np.floor((values - lim[0]) / (lim[1] - lim[0]) * size)
+        cell[values == lim[1]] = size - 1
+        return cell
+
+    def add(self, x, y):
+        x = np.asarray(x, dtype=np.float64).ravel()
+        y = np.asarray(y, dtype=np.float64).ravel()
+        nx, ny = self.counts.shape
+        cx = self._cells(x, self.xlim, nx)
+        cy = self._cells(y, self.ylim, ny)
+        inside = (cx >= 0) & (cx < nx) & (cy >= 0) & (cy < ny)
+        flat = cx[inside].astype(np.int64) * ny + cy[inside].astype(np.int64)
+        self.counts += np.bincount(flat, minlength=nx * ny).reshape(nx, ny)
+        x, y = x[inside], y[inside]
+        if not len(x):
+            return self
+        if self.shift is None:
+            self.shift = (x.mean(), y.mean())
+        dx, dy = x - self.shift[0], y - self.shift[1]
+        self.sums += [len(x), dx.sum(), dy.sum(), dx.dot(dx), dx.dot(dy), dy.dot(dy)]
+        return self
+
+    def merge(self, other):
+        if (other.xlim, other.ylim, other.counts.shape) != (self.xlim, self.ylim, self.counts.shape):
+            raise ValueError("can only merge grids with the same ranges and bins")
+        self.counts += other.counts
+        if other.shift is not None:
+            if self.shift is None:
+                self.shift = other.shift
+            # move the other sums to this shift
+            n, sx, sy, sxx, sxy, syy = other.sums
+            a, b = other.shift[0] - self.shift[0], other.shift[1] - self.shift[1]
+            self.sums += [n, sx + n * a, sy + n * b,
+                          sxx + 2 * a * sx + n * a * a,
+                          sxy + a * sy + b * sx + n * a * b,
+                          syy + 2 * b * sy + n * b * b]
+        return self
+
+    def fit(self):
+        """``(slope, intercept, r, stderr)`` of the least squares line of y on x."""
+        n, sx, sy, sxx, sxy, syy = self.sums
+        mx, my = sx / n, sy / n
+        Sxx, Sxy, Syy = sxx - n * mx * mx, sxy - n * mx * my, syy - n * my * my
+        slope = Sxy / Sxx
+        intercept = my + self.shift[1] - slope * (mx + self.shift[0])
+        r = Sxy / np.sqrt(Sxx * Syy)
+        # residual standard error
+        stderr = np.sqrt(max(Syy - slope * Sxy, 0) / (n - 2))
+        return slope, intercept, r, stderr
+
+    def band(self, x, ci=95):
+        """Line and ``ci`` % confidence band of the mean of y at ``x``.
+
+        Uses the normal quantile, close to Student's t at the sizes this is
+        meant for.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        n, sx, _, sxx, _, _ = self.sums
+        slope, intercept, _, stderr = self.fit()
+        mx = sx / n + self.shift[0]
+        Sxx = sxx - sx * sx / n
+        z = _normal_quantile(0.5 + ci / 200.)
+        fit = intercept + slope * x
+        half = z * stderr * np.sqrt(1 / n + (x - mx) ** 2 / Sxx)
+        return fit, fit - half, fit + half
+
+
+def _limits(values):
+    if not len(values):
+        return (0.0, 1.0)
+    lo, hi = values.min(), values.max()
+    return (lo, hi if hi > lo else lo + 1.0)
+
+
+def _normal_quantile(p):
+    # Acklam's rational approximation, |error| < 1.2e-9 on the central region
+    a = [-3.969683028665376e+01, 2.209460984245205e+02, -2.759285104469687e+02,
+         1.383577518672690e+02, -3.066479806614716e+01, 2.506628277459239e+00]
+    b = [-5.447609879822406e+01, 1.615858368580409e+02, -1.556989798598866e+02,
+         6.680131188771972e+01, -1.328068155288572e+01]
+    q = p - 0.5
+    r = q * q
+    return (((((a[0] * r + a[1]) * r + a[2]) * r + a[3]) * r + a[4]) * r + a[5]) * q / \
+        (((((b[0] * r + b[1]) * r + b[2]) * r + b[3]) * r + b[4]) * r + 1)
+
+
+def _binned(values, bins=4096):
+    return values if isinstance(values, Binned) else Binned.from_values(values, bins=bins)
+
+
+def _axes(ax):
+    if ax is None:
+        import matplotlib.pyplot as plt
+        ax = plt.gca()
+    return ax
+
+
+@trace.traced('plots.distplot')
+def distplot(values, bins=50, ax=None, label=None, **kwargs):
+    """Histogram of ``values`` (an array or a :class:`Binned`) as bars."""
+    ax = _axes(ax)
+    edges, counts = _binned(values).histogram(bins)
+    ax.bar(edges[:-1], counts, width=np.diff(edges), align='edge', label=label,
+           **dict({'alpha': 0.4, 'edgecolor': 'none'}, **kwargs))
+    return ax
+
+
+@trace.traced('plots.kdeplot')
+def kdeplot(values, ax=None, label=None, bw='scott', cut=3, **kwargs):
+    """Gaussian KDE curve of ``values`` (an array or a :class:`Binned`)."""
+    ax = _axes(ax)
+    x, density = _binned(values).kde(bw=bw, cut=cut)
+    ax.plot(x, density, label=label, **kwargs)
+    return ax
+
+
+@trace.traced('plots.regplot')
+def regplot(x, y=None, ax=None, bins=(200, 200), ci=95, cmap='Blues', log=True,
+            color='C1', **kwargs):
+    """Density grid of ``(x, y)`` with the regression line and its band.
+
+    ``x`` and ``y`` are arrays, or ``x`` is a :class:`Binned2D`. Cells are
+    shaded by count (log scale with ``log``); drawing time depends on
+    ``bins`` only.
+    """
+    ax = _axes(ax)
+    grid = x if isinstance(x, Binned2D) else Binned2D.from_values(x, y, bins=bins)
+    xedges, yedges = grid.edges
+    counts = np.ma.masked_equal(grid.counts.T, 0)
+    if log:
+        from matplotlib.colors import LogNorm
+        kwargs.setdefault('norm', LogNorm())
+    ax.pcolormesh(xedges, yedges, counts, cmap=cmap, **kwargs)
+    if grid.n > 2:
+        xs = np.linspace(xedges[0], xedges[-1], 100)
+        fit, lo, hi = grid.band(xs, ci)
+        ax.plot(xs, fit, color=color)
+        if ci:
+            ax.fill_between(xs, lo, hi, color=color, alpha=0.2)
+    ax.set_xlim(xedges[0], xedges[-1])
+    ax.set_ylim(yedges[0], yedges[-1])
+    return ax
+
+
+def bin_pairs(frames, x, y, xlim, ylim, bins=(200, 200), where=None):
+    """:class:`Binned2D` of columns ``x`` and ``y`` over a stream of frames.
+
+    ``where`` optionally maps a frame to a boolean row mask.
+    """
+    grid = Binned2D(xlim, ylim, bins)
+    for df in frames:
+        if where is not None:
+            df = df[where(df)]
+        grid.add(df[x].values, df[y].values)
+    return grid
+
+
+def bin_temperatures(frames, bins=4096, lo=TEMPERATURE_RANGE[0], hi=TEMPERATURE_RANGE[1]):
+    """:class:`Binned` of ``tempC``/``maxC``/``minC`` over a stream of frames.
+
+    Frames hold either the Celsius columns or the raw ``temp``/``max``/``min``.
+    """
+    grids = {dst: Binned(lo, hi, bins) for dst in TEMPERATURES.values()}
+    for df in frames:
+        for src, dst in TEMPERATURES.items():
+            grids[dst].add(df[dst].values if dst in df else to_celsius(df[src]))
+    return grids
+
+
+def store_temperatures(root, bins=4096, **kwargs):
+    """Temperature grids straight from the observation store, batch by batch.
+
+    ``kwargs`` (``years``, ``koppen``, ``filters``...) select what is read.
+    """
+    with trace.stage('plots.store_temperatures') as span:
+        grids = bin_temperatures(store.scan(root, columns=list(TEMPERATURES), **kwargs), bins)
+        span.set(rows=grids['tempC'].n + grids['tempC'].dropped)
+    return grids
+
+
+@trace.traced('plots.temperatures')
+def temperatures(grids, ax=None, labels=TEMPERATURE_LABELS, **kwargs):
+    """The Mean/Max/Min temperature KDE curves on one figure.
+
+    ``grids`` maps the columns to arrays or :class:`Binned`, e.g. a frame
+    with ``tempC``/``maxC``/``minC`` or the result of :func:`bin_temperatures`.
+    """
+    ax = _axes(ax)
+    for column, label in labels.items():
+        kdeplot(grids[column], ax=ax, label=label, **kwargs)
+    ax.legend()
+    ax.set_xlabel('Temperature (ºC)')
+    return ax
@@ -0,0 +1,255 @@
+"""Mergeable quantile sketches (t-digest) for the temperature binning.
+
+A :class:`TDigest` summarises a distribution with at most ~``compression``
+weighted centroids, small near the tails and larger around the median, so
+quantiles come back with a bounded rank error whatever the data size.
+Digests of different workers, loads or groups merge by pooling their
+centroids.
+
+:class:`SketchSet` keeps one digest per group (station, year, Köppen...)
+filled batch by batch during ingest, all the groups of a batch compressed
+in one vectorized pass. The digests rolled up by some of the key levels
+(e.g. per Köppen class) are merged once and kept, so the quartiles of a
+slice are a lookup and one small merge instead of a sort of the raw
+column::
+
+    sketches.merged(koppen='Cfb').quantile([0.25, 0.5, 0.75])
+"""
+import pickle
+
+import numpy as np
+import pandas as pd
+
+
+def _clusters(groups, means, weights, compression):
+    """Compress the centroids of many digests at once.
+
+    ``groups`` numbers the digest of every centroid. Returns the group,
+    mean and weight of the merged centroids, sorted by group and mean.
+    """
+    order = np.lexsort((means, groups))
+    groups, means, weights = groups[order], means[order], weights[order]
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    sizes = np.diff(np.r_[starts, len(groups)])
+    cum = np.cumsum(weights)
+    before = np.repeat(cum[starts] - weights[starts], sizes)
+    total = np.repeat(np.add.reduceat(weights, starts), sizes)
+    # centroids whose cumulative weight falls in the same unit of the k scale
+    # of their digest are merged; units are narrow at the tails
+    q = (cum - before - weights / 2) / total
+    k = compression / (2 * np.pi) * np.arcsin(np.clip(2 * q - 1, -1, 1))
+    cluster = np.floor(k - np.repeat(k[starts], sizes)).astype(np.int64)
+    cuts = np.flatnonzero(np.r_[True, (groups[1:] != groups[:-1]) | (np.diff(cluster) != 0)])
+    w = np.add.reduceat(weights, cuts)
+    return groups[cuts], np.add.reduceat(means * weights, cuts) / w, w
+
+
+class TDigest(object):
+    """Merging t-digest with the ``k1`` (arcsine) scale function."""
+
+    def __init__(self, compression=200):
+        self.compression = compression
+        self.means = np.zeros(0)
+        self.weights = np.zeros(0)
+        self.min = np.inf
+        self.max = -np.inf
+
+    @property
+    def count(self):
+        return self.weights.sum()
+
+    def _compress(self, means, weights):
+        _, self.means, self.weights = _clusters(np.zeros(len(means), dtype=np.int64),
+                                                means, weights, self.compression)
+
+    def update(self, values, weights=None):
+        """Add a batch of values (NaN are ignored)."""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if weights is None:
+            weights = np.ones(len(values))
+        keep = ~np.isnan(values)
+        values, weights = values[keep], np.asarray(weights, dtype=np.float64)[keep]
+        if not len(values):
+            return self
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self._compress(np.r_[self.means, values], np.r_[self.weights, weights])
+        return self
+
+    def merge(self, *others):
+        """A new digest with the data of this one and ``others``."""
+        out = TDigest(self.compression)
+        digests = [d for d in (self,) + others if len(d.weights)]
+        if digests:
+            out.min = min(d.min for d in digests)
+            out.max = max(d.max for d in digests)
+            out._compress(np.concatenate([d.means for d in digests]),
+                          np.concatenate([d.weights for d in digests]))
+        return out
+
+    def quantile(self, q):
+        """Estimated quantiles for ``q`` in [0, 1] (scalar or array)."""
+        q = np.asarray(q, dtype=np.float64)
+        if not len(self.weights):
+            return np.full(q.shape, np.nan)
+        # every centroid sits at the middle of its cumulative weight
+        total = self.weights.sum()
+        mids = (np.cumsum(self.weights) - self.weights / 2) / total
+        xs = np.r_[0.0, mids, 1.0]
+        ys = np.r_[self.min, self.means, self.max]
+        return np.interp(q, xs, ys)
+
+    def cdf(self, x):
+        """Estimated share of the values below ``x``."""
+        if not len(self.weights):
+            return np.full(np.shape(x), np.nan)
+        total = self.weights.sum()
+        mids = (np.cumsum(self.weights) - self.weights / 2) / total
+        return np.interp(x, np.r_[self.min, self.means, self.max], np.r_[0.0, mids, 1.0])
+
+
+class SketchSet(object):
+    """One :class:`TDigest` per group key.
+
+    Keys are tuples of the key levels ``names`` (the columns of the first
+    :meth:`update`).
+    """
+
+    def __init__(self, compression=200):
+        self.compression = compression
+        self.digests = {}
+        self.names = None
+        self._rollups = {}
+
+    def __setstate__(self, state):
+        # sets saved before the rollups
+        self.__dict__.update({'names': None, '_rollups': {}}, **state)
+
+    def update(self, keys, values):
+        """Add ``values`` to the digest of their row in ``keys`` (a DataFrame)."""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if self.names is None:
+            self.names = list(keys.columns)
+        code = keys.groupby(list(keys.columns), sort=False, dropna=False,
+                            observed=True).ngroup().values
+        keep = ~np.isnan(values) & (code >= 0)
+        if not keep.any():
+            return self
+        rows = np.flatnonzero(keep)
+        codes, first = np.unique(code[keep], return_index=True)
+        group = np.searchsorted(codes, code[keep])
+        digests = []
+        for key in keys.iloc[rows[first]].itertuples(index=False, name=None):
+            digest = self.digests.get(key)
+            if digest is None:
+                digest = self.digests[key] = TDigest(self.compression)
+            digests.append(digest)
+        # the new values and the centroids already there, every group at once
+        sizes = [len(d.weights) for d in digests]
+        g, m, w = _clusters(np.r_[group, np.repeat(np.arange(len(digests)), sizes)],
+                            np.concatenate([values[keep]] + [d.means for d in digests]),
+                            np.concatenate([np.ones(keep.sum())] + [d.weights for d in digests]),
+                            self.compression)
+        bounds = np.searchsorted(g, np.arange(len(digests) + 1))
+        order = np.argsort(group, kind='mergesort')
+        starts = np.searchsorted(group[order], np.arange(len(digests)))
+        mins = np.minimum.reduceat(values[keep][order], starts)
+        maxs = np.maximum.reduceat(values[keep][order], starts)
+        for i, digest in enumerate(digests):
+            rows = slice(bounds[i], bounds[i + 1])
+            digest.means, digest.weights = m[rows], w[rows]
+            digest.min, digest.max = min(digest.min, mins[i]), max(digest.max, maxs[i])
+        self._rollups.clear()
+        return self
+
+    def merge(self, other):
+        if self.names is None:
+            self.names = other.names
+        for key, digest in other.digests.items():
+            mine = self.digests.get(key)
+            self.digests[key] = digest if mine is None else mine.merge(digest)
+        self._rollups.clear()
+        return self
+
+    def rollup(self, *names):
+        """The digests merged by the key levels ``names``, by their values.
+
+        Computed in one pass over all the centroids and kept until the set
+        changes; ``rollup()`` is the single digest of everything.
+        """
+        unknown = set(names) - set(self.names or ())
+        if unknown:
+            raise ValueError("unknown key levels: {}".format(', '.join(sorted(unknown))))
+        names = tuple(n for n in (self.names or ()) if n in names)
+        if names not in self._rollups:
+            positions = [self.names.index(n) for n in names]
+            ids = {}
+            group = np.array([ids.setdefault(tuple(key[i] for i in positions), len(ids))
+                              for key in self.digests], dtype=np.int64)
+            digests = list(self.digests.values())
+            rolled = {}
+            if digests:
+                g, m, w = _clusters(np.repeat(group, [len(d.weights) for d in digests]),
+                                    np.concatenate([d.means for d in digests]),
+                                    np.concatenate([d.weights for d in digests]),
+                                    self.compression)
+                bounds = np.searchsorted(g, np.arange(len(ids) + 1))
+                mins = np.full(len(ids), np.inf)
+                maxs = np.full(len(ids), -np.inf)
+                np.minimum.at(mins, group, [d.min for d in digests])
+                np.maximum.at(maxs, group, [d.max for d in digests])
+                for key, i in ids.items():
+                    rows = slice(bounds[i], bounds[i + 1])
+                    digest = rolled[key] = TDigest(self.compression)
+                    digest.means, digest.weights = m[rows], w[rows]
+                    digest.min, digest.max = mins[i], maxs[i]
+            self._rollups[names] = rolled
+        return self._rollups[names]
+
+    def merged(self, where=None, **levels):
+        """A digest of every group, or of a slice of them.
+
+        ``levels`` picks the groups by the values of some key levels
+        (``koppen='Cfb'``) out of the kept rollups; ``where`` is any
+        predicate on the full keys, merged on each call.
+        """
+        if where is not None:
+            positions = {self.names.index(n): v for n, v in levels.items()}
+            digests = [d for k, d in self.digests.items()
+                       if where(k) and all(k[i] == v for i, v in positions.items())]
+            return TDigest(self.compression).merge(*digests)
+        rolled = self.rollup(*levels)
+        digest = rolled.get(tuple(levels[n] for n in self.names or () if n in levels))
+        # a copy: the kept rollup must not change with the caller's digest
+        return TDigest(self.compression).merge(*([digest] if digest is not None else []))
+
+    def save(self, path):
+        with open(str(path), 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path):
+        with open(str(path), 'rb') as f:
+            return pickle.load(f)
+
+
+def cut_points(digest, q=4):
+    """Edges of ``q`` equal-frequency bins (``pd.qcut`` style) from a digest."""
+    return digest.quantile(np.linspace(0, 1, q + 1))
+
+
+def qcut(values, digest, q=4, labels=None):
+    """``pd.qcut`` with the bin edges taken from ``digest``.
+
+    Bins that collapse (a skewed measure like ``prcp``, mostly 0) are
+    dropped with their labels, like ``duplicates='drop'``.
+    """
+    edges = cut_points(digest, q)
+    keep = np.diff(edges) > 0
+    if not keep.any():
+        # a single value: one bin holding it
+        keep[-1] = True
+        edges = np.r_[edges[:-1], np.nextafter(edges[-1], np.inf)]
+    if labels is not None and labels is not False:
+        labels = [label for label, kept in zip(labels, keep) if kept]
+    return pd.cut(values, np.r_[edges[0], edges[1:][keep]], labels=labels, include_lowest=True)
@@ -0,0 +1,52 @@
+"""Station registry parsed from ``ish-history.csv``.
+
+The CSV is parsed once into a compact typed table (int32 USAF/WBAN, packed
+int64 ``key``, float32 coordinates, categorical country/state) indexed by
+the ``"usaf-wban"`` id, and cached as a pickle next to the CSV so every
+script loads it in milliseconds instead of parsing it again.
+"""
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .features import station_id, station_key
+
+COLUMNS = ['usaf', 'wban', 'stname', 'ctry', 'fips', 'state', 'call', 'lat', 'lon', 'elev']
+
+DTYPES = {'usaf': np.int32, 'wban': np.int32, 'stname': object,
+          'ctry': 'category', 'fips': 'category', 'state': 'category', 'call': object,
+          'lat': np.float32, 'lon': np.float32, 'elev': np.float32}
+
+ISH_HISTORY = Path(__file__).resolve().parent.parent.joinpath('data', 'ncdc', 'ish-history.csv')
+
+
+def parse(csv_path=ISH_HISTORY):
+    """Parse ``ish-history.csv`` into the typed station table.
+
+    Coordinates come in thousandths of a degree and the elevation in tenths
+    of a meter; stations without a location are dropped.
+    """
+    df = pd.read_csv(str(csv_path), skiprows=1, names=COLUMNS, dtype=DTYPES)
+    df['lat'] /= np.float32(1000)
+    df['lon'] /= np.float32(1000)
+    df['elev'] /= np.float32(10)
+    df.insert(2, 'key', station_key(df['usaf'], df['wban']))
+    df.index = pd.Index(station_id(df['usaf'], df['wban']), name='id')
+    return df.dropna(how='any', subset=['lat', 'lon'])
+
+
+def cache_path(csv_path):
+    return Path(csv_path).with_suffix('.pkl')
+
+
+def load(csv_path=ISH_HISTORY, cache=True):
+    """The station table, from the binary cache when it is newer than the CSV."""
+    csv_path = Path(csv_path)
+    pkl = cache_path(csv_path)
+    if cache and pkl.exists() and pkl.stat().st_mtime >= csv_path.stat().st_mtime:
+        return pd.read_pickle(str(pkl))
+    df = parse(csv_path)
+    if cache:
+        df.to_pickle(str(pkl))
+    return df
@@ -0,0 +1,109 @@
+"""Local ranked station selection.
+
+Reproduces ``rank() over (partition by gridcode order by count desc, elev
+asc)`` from the week03 CartoDB query on the station statistics table.
+Each group only partially sorts its rows: ``np.partition`` finds the k-th
+value of the first sort key and only the rows that can still make the top
+k are ordered.
+"""
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from . import trace
+from .koppen import filter_stations
+
+# the selections last computed, by inputs and parameters, least recent first
+CACHE_SIZE = 32
+_cache = OrderedDict()
+
+
+def _sort_keys(df, by, ascending):
+    # flip descending keys so that smaller is always better
+    keys = []
+    for column, asc in zip(by, ascending):
+        values = df[column].values.astype(np.float64)
+        keys.append(values if asc else -values)
+    return keys
+
+
+def _group_top_k(keys, rows, k):
+    first = keys[0][rows]
+    if len(rows) > k:
+        kth = np.partition(first, k - 1)[k - 1]
+        rows = rows[first <= kth]
+    order = np.lexsort([key[rows] for key in reversed(keys)])
+    rows = rows[order]
+    # SQL rank(): ties share a rank and the next rank skips ahead
+    tuples = np.stack([key[rows] for key in keys], axis=1)
+    new = np.ones(len(rows), dtype=bool)
+    new[1:] = (tuples[1:] != tuples[:-1]).any(axis=1)
+    positions = np.arange(1, len(rows) + 1)
+    rank = np.maximum.accumulate(np.where(new, positions, 0))
+    return rows[rank <= k], rank[rank <= k]
+
+
+def top_k(df, group, by, ascending=True, k=2):
+    """Rows ranking ``k`` or better within their ``group``, with a ``pos`` column.
+
+    ``by`` lists the sort keys and ``ascending`` their direction (one bool
+    or one per key). Ties share a rank, so a group can return more than
+    ``k`` rows, like SQL ``rank()``.
+    """
+    by = list(by) if not isinstance(by, str) else [by]
+    if isinstance(ascending, bool):
+        ascending = [ascending] * len(by)
+    keys = _sort_keys(df, by, ascending)
+    picked, ranks = [], []
+    for rows in df.groupby(group, sort=True).indices.values():
+        rows, rank = _group_top_k(keys, np.asarray(rows), k)
+        picked.append(rows)
+        ranks.append(rank)
+    if not picked:
+        return df.iloc[:0].assign(pos=pd.Series(dtype=np.int64))
+    out = df.iloc[np.concatenate(picked)].copy()
+    out['pos'] = np.concatenate(ranks)
+    return out
+
+
+def _digest(*frames):
+    h = hashlib.sha1()
+    for frame in frames:
+        h.update(pd.util.hash_pandas_object(frame).values.tobytes())
+        h.update(repr(list(frame.columns)).encode())
+    return h.hexdigest()
+
+
+def top_stations(scdf, pairs, k=2, by=('count', 'elev'), ascending=(False, True),
+                 cache=True, **filters):
+    """Top ``k`` stations per Köppen region, one class per station.
+
+    ``scdf`` is the station statistics table and ``pairs`` the station to
+    region join from :func:`gsod.koppen.intersect`. ``filters`` are passed
+    to :func:`gsod.koppen.filter_stations` (``min_count``, ``max_elev``,
+    ``gridcodes``). Returns a frame indexed by id with the ``koppen``
+    class; the last :data:`CACHE_SIZE` results are cached per inputs and
+    parameters.
+    """
+    columns = list(by) + [c for c in ('count', 'elev') if c in scdf and c not in by]
+    key = None
+    if cache:
+        key = (_digest(scdf[columns], pairs), k, tuple(by), tuple(ascending),
+               tuple(sorted((name, repr(value)) for name, value in filters.items())))
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key].copy()
+    with trace.stage('select', rows=len(scdf)) as span:
+        df = filter_stations(scdf[columns].join(pairs, how='inner'), **filters)
+        ranked = top_k(df, 'gridcode', by, ascending, k).dropna(subset=['koppen'])
+        # a station on overlapping regions keeps the first class alphabetically
+        ranked = ranked.sort_values('koppen', kind='mergesort')
+        selections = ranked[~ranked.index.duplicated()][['koppen']].sort_index()
+        span.set(selected=len(selections))
+    if key is not None:
+        _cache[key] = selections.copy()
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return selections
@@ -0,0 +1,323 @@
+"""Offline point-in-region lookups for the station coordinates.
+
+Two kinds of region layers can be loaded from disk:
+
+* :class:`Regions`, polygons from a GeoJSON file (e.g. the ``climate_regions``
+  table exported with ``ogr2ogr -f GeoJSON``), indexed with a packed
+  R-tree over the bounding boxes of their parts.
+* :class:`Raster`, an ESRI ASCII grid of codes, where a lookup is a plain
+  array access.
+
+Both answer :meth:`locate` with ``(point, code)`` pairs, so a point that
+falls in two overlapping regions appears twice, like the SQL
+``ST_Intersects`` join did.
+"""
+import json
+
+import numpy as np
+
+
+class RTree(object):
+    """Static R-tree over boxes, bulk loaded with Sort-Tile-Recursive.
+
+    Queries are vectorized: all the points walk down the tree together as
+    ``(point, node)`` pairs that are expanded and pruned level by level.
+    """
+
+    def __init__(self, boxes, node_size=16):
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        self.node_size = node_size
+        order = self._str_order(boxes)
+        self.items = order
+        # levels[0] are the leaves (one per item), the last one is the root
+        self.levels = [boxes[order]]
+        self.children = []
+        while len(self.levels[-1]) > 1:
+            level = self.levels[-1]
+            starts = np.arange(0, len(level), node_size)
+            mins = np.minimum.reduceat(level[:, :2], starts)
+            maxs = np.maximum.reduceat(level[:, 2:], starts)
+            self.children.append(starts)
+            self.levels.append(np.hstack([mins, maxs]))
+
+    def _str_order(self, boxes):
+        n = len(boxes)
+        if n == 0:
+            return np.zeros(0, dtype=np.int64)
+        cx = (boxes[:, 0] + boxes[:, 2]) / 2
+        cy = (boxes[:, 1] + boxes[:, 3]) / 2
+        leaves = -(-n // self.node_size)
+        slabs = int(np.ceil(np.sqrt(leaves)))
+        by_x = np.argsort(cx, kind='mergesort')
+        slab = np.empty(n, dtype=np.int64)
+        slab[by_x] = np.arange(n) * slabs // n
+        return np.lexsort((cy, slab))
+
+    def query_points(self, x, y):
+        """Candidate ``(point, item)`` pairs whose box contains the point."""
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if not len(self.items):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        points = np.arange(len(x))
+        nodes = np.zeros(len(x), dtype=np.int64)
+        for depth in range(len(self.levels) - 1, -1, -1):
+            box = self.levels[depth][nodes]
+            hit = ((box[:, 0] <= x[points]) & (x[points] <= box[:, 2])
+                   & (box[:, 1] <= y[points]) & (y[points] <= box[:, 3]))
+            points, nodes = points[hit], nodes[hit]
+            if depth == 0:
+                break
+            starts = self.children[depth - 1]
+            size = len(self.levels[depth - 1])
+            first = starts[nodes]
+            count = np.minimum(first + self.node_size, size) - first
+            points = np.repeat(points, count)
+            offsets = np.arange(len(points)) - np.repeat(np.cumsum(count) - count, count)
+            nodes = np.repeat(first, count) + offsets
+        return points, self.items[nodes]
+
+
+def _ranges(lo, hi):
+    # the rows of every range lo:hi in one array, and the range of each row
+    count = hi - lo
+    which = np.repeat(np.arange(len(lo)), count)
+    return np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count) + lo[which], which
+
+
+class KDTree(object):
+    """Static k-d tree over points, split at the median of the widest dimension.
+
+    The tree is implicit: every level halves the nodes of the one above,
+    so node ``j`` has children ``2j`` and ``2j + 1`` and covers the rows
+    ``bounds[j]:bounds[j + 1]`` of the sorted points. Queries are vectorized
+    like :meth:`RTree.query_points`, all the ``(query, node)`` pairs going
+    down the levels together.
+    """
+
+    def __init__(self, points, leaf_size=16):
+        points = np.asarray(points, dtype=np.float64)
+        # (n, dims) even without points: the queries take their dims from it
+        points = points.reshape(-1, points.shape[-1] if points.ndim > 1 else 1)
+        if leaf_size < 2:
+            raise ValueError("leaf_size must be at least 2")
+        n = len(points)
+        order = np.arange(n)
+        bounds = np.array([0, n], dtype=np.int64)
+        self.levels = []
+        while n:
+            starts, sizes = bounds[:-1], np.diff(bounds)
+            sorted_points = points[order]
+            level = {'bounds': bounds,
+                     'mins': np.minimum.reduceat(sorted_points, starts),
+                     'maxs': np.maximum.reduceat(sorted_points, starts)}
+            self.levels.append(level)
+            if sizes.max() <= leaf_size:
+                break
+            dim = np.argmax(level['maxs'] - level['mins'], axis=1)
+            node = np.repeat(np.arange(len(starts)), sizes)
+            order = order[np.lexsort((sorted_points[np.arange(n), dim[node]], node))]
+            middle = starts + sizes // 2
+            level['dim'] = dim
+            level['split'] = points[order[middle], dim]
+            bounds = np.empty(2 * len(starts) + 1, dtype=np.int64)
+            bounds[0::2], bounds[1::2] = level['bounds'], middle
+        self.order = order
+        self.points = points[order]
+
+    def __len__(self):
+        return len(self.points)
+
+    def _descend(self, x, depth):
+        # the node holding every query point at ``depth``
+        nodes = np.zeros(len(x), dtype=np.int64)
+        for level in self.levels[:depth]:
+            dim = level['dim'][nodes]
+            right = x[np.arange(len(x)), dim] >= level['split'][nodes]
+            nodes = 2 * nodes + right
+        return nodes
+
+    def _within(self, x, r2, block=1 << 20):
+        queries, rows, d2 = [], [], []
+        step = max(1, block // 64)
+        for s in range(0, len(x), step):
+            q = np.arange(s, min(s + step, len(x)))
+            nodes = np.zeros(len(q), dtype=np.int64)
+            for depth, level in enumerate(self.levels):
+                gap = (np.maximum(level['mins'][nodes] - x[q], 0)
+                       + np.maximum(x[q] - level['maxs'][nodes], 0))
+                keep = (gap * gap).sum(axis=1) <= r2[q]
+                q, nodes = q[keep], nodes[keep]
+                if depth < len(self.levels) - 1:
+                    q = np.repeat(q, 2)
+                    nodes = (2 * nodes[:, None] + np.array([0, 1])).ravel()
+            bounds = self.levels[-1]['bounds']
+            r, which = _ranges(bounds[nodes], bounds[nodes + 1])
+            q = q[which]
+            diff = self.points[r] - x[q]
+            dist = (diff * diff).sum(axis=1)
+            keep = dist <= r2[q]
+            queries.append(q[keep])
+            rows.append(r[keep])
+            d2.append(dist[keep])
+        if not queries:
+            return (np.zeros(0, dtype=np.int64),) * 2 + (np.zeros(0),)
+        return np.concatenate(queries), np.concatenate(rows), np.concatenate(d2)
+
+    def query_radius(self, x, r):
+        """``(query, item, distance)`` of the points within ``r`` of every query point.
+
+        ``r`` is one radius or one per query; pairs are sorted by query and
+        distance.
+        """
+        x = np.asarray(x, dtype=np.float64).reshape(-1, self.points.shape[1])
+        r2 = np.broadcast_to(np.asarray(r, dtype=np.float64) ** 2, (len(x),))
+        if not len(self):
+            return (np.zeros(0, dtype=np.int64),) * 2 + (np.zeros(0),)
+        q, rows, d2 = self._within(x, r2)
+        order = np.lexsort((d2, q))
+        return q[order], self.order[rows[order]], np.sqrt(d2[order])
+
+    def query(self, x, k=1):
+        """``(items, distances)``, ``(queries, k)`` arrays of the ``k`` nearest points."""
+        x = np.asarray(x, dtype=np.float64).reshape(-1, self.points.shape[1])
+        k = min(k, len(self))
+        if not k:
+            return np.zeros((len(x), 0), dtype=np.int64), np.zeros((len(x), 0))
+        # the deepest level whose nodes all hold k points: the k-th nearest of
+        # the node of every query bounds the radius holding its k nearest
+        sizes = [np.diff(level['bounds']).min() for level in self.levels]
+        depth = max(d for d, size in enumerate(sizes) if size >= k)
+        nodes = self._descend(x, depth)
+        rows = self.levels[depth]['bounds'][nodes][:, None] + np.arange(sizes[depth])
+        diff = self.points[rows] - x[:, None, :]
+        r2 = np.partition((diff * diff).sum(axis=2), k - 1, axis=1)[:, k - 1]
+        q, rows, d2 = self._within(x, r2)
+        order = np.lexsort((d2, q))
+        q, rows, d2 = q[order], rows[order], d2[order]
+        # the first k of every query (each one has at least k)
+        first = np.searchsorted(q, np.arange(len(x)))
+        take = (first[:, None] + np.arange(k)).ravel()
+        return self.order[rows[take]].reshape(-1, k), np.sqrt(d2[take]).reshape(-1, k)
+
+
+def points_in_rings(x, y, rings, block=1 << 22):
+    """Even-odd ray casting of many points against one polygon (holes included).
+
+    Points are tested against all the edges at once, ``block`` point-edge
+    pairs at a time.
+    """
+    edges = np.vstack([np.hstack([r[:-1], r[1:]]) for r in rings])
+    x0, y0, x1, y1 = (c[:, None] for c in edges.T)
+    inside = np.zeros(len(x), dtype=bool)
+    step = max(1, block // max(len(edges), 1))
+    for s in range(0, len(x), step):
+        px, py = x[s:s + step], y[s:s + step]
+        crosses = (y0 > py) != (y1 > py)
+        # horizontal edges divide by zero but never cross
+        with np.errstate(divide='ignore', invalid='ignore'):
+            xint = x0 + (py - y0) * (x1 - x0) / (y1 - y0)
+        inside[s:s + step] = np.count_nonzero(crosses & (px < xint), axis=0) % 2 == 1
+    return inside
+
+
+def _closed(ring):
+    ring = np.asarray(ring, dtype=np.float64)[:, :2]
+    if len(ring) and not np.array_equal(ring[0], ring[-1]):
+        ring = np.vstack([ring, ring[:1]])
+    return ring
+
+
+class Regions(object):
+    """Coded polygons with an R-tree over their parts."""
+
+    def __init__(self, parts, codes, node_size=16):
+        self.parts = parts
+        self.codes = np.asarray(codes)
+        boxes = np.array([[r[0][:, 0].min(), r[0][:, 1].min(), r[0][:, 0].max(), r[0][:, 1].max()]
+                          for r in parts]).reshape(-1, 4)
+        self.tree = RTree(boxes, node_size=node_size)
+
+    @classmethod
+    def from_geojson(cls, path, field='gridcode', **kwargs):
+        """Load the Polygon/MultiPolygon features of a GeoJSON file."""
+        with open(str(path)) as f:
+            features = json.load(f)['features']
+        parts, codes = [], []
+        for feature in features:
+            geometry = feature.get('geometry') or {}
+            polygons = geometry.get('coordinates', [])
+            if geometry.get('type') == 'Polygon':
+                polygons = [polygons]
+            elif geometry.get('type') != 'MultiPolygon':
+                continue
+            for polygon in polygons:
+                parts.append([_closed(ring) for ring in polygon])
+                codes.append(feature['properties'][field])
+        return cls(parts, codes, **kwargs)
+
+    def locate(self, lon, lat):
+        """``(point, code)`` pairs for every region containing each point."""
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        points, parts = self.tree.query_points(lon, lat)
+        keep = np.zeros(len(points), dtype=bool)
+        order = np.argsort(parts, kind='mergesort')
+        bounds = np.flatnonzero(np.diff(parts[order])) + 1
+        for group in np.split(order, bounds):
+            if not len(group):
+                continue
+            part = parts[group[0]]
+            p = points[group]
+            keep[group] = points_in_rings(lon[p], lat[p], self.parts[part])
+        points, parts = points[keep], parts[keep]
+        # a multipolygon can hold a point in one part only, but dedupe anyway
+        pairs = np.unique(np.stack([points, self.codes[parts]]), axis=1) \
+            if len(points) else np.zeros((2, 0), dtype=np.int64)
+        return pairs[0], pairs[1]
+
+
+class Raster(object):
+    """Codes on a regular lon/lat grid (ESRI ASCII grid)."""
+
+    def __init__(self, grid, xll, yll, cellsize, nodata=None):
+        self.grid = grid
+        self.xll = xll
+        self.yll = yll
+        self.cellsize = cellsize
+        self.nodata = nodata
+
+    @classmethod
+    def from_ascii_grid(cls, path):
+        header = {}
+        with open(str(path)) as f:
+            for _ in range(6):
+                key, value = f.readline().split()
+                header[key.lower()] = float(value)
+            grid = np.loadtxt(f, dtype=np.int32, ndmin=2)
+        xll = header.get('xllcorner', header.get('xllcenter', 0) - header['cellsize'] / 2)
+        yll = header.get('yllcorner', header.get('yllcenter', 0) - header['cellsize'] / 2)
+        return cls(grid, xll, yll, header['cellsize'], header.get('nodata_value'))
+
+    def locate(self, lon, lat):
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        nrows, ncols = self.grid.shape
+        with np.errstate(invalid='ignore'):
+            col = np.floor((lon - self.xll) / self.cellsize).astype(np.int64)
+            row = nrows - 1 - np.floor((lat - self.yll) / self.cellsize).astype(np.int64)
+        inside = (np.isfinite(lon) & np.isfinite(lat)
+                  & (col >= 0) & (col < ncols) & (row >= 0) & (row < nrows))
+        points = np.flatnonzero(inside)
+        codes = self.grid[row[inside], col[inside]]
+        if self.nodata is not None:
+            valid = codes != self.nodata
+            points, codes = points[valid], codes[valid]
+        return points, codes
+
+
+def load_regions(path, **kwargs):
+    """:class:`Raster` for ``.asc`` files, :class:`Regions` for GeoJSON."""
+    if str(path).endswith('.asc'):
+        return Raster.from_ascii_grid(path)
+    return Regions.from_geojson(path, **kwargs)
@@ -0,0 +1,74 @@
+"""Per-station statistics over the ``gsod.csv`` inventory.
+
+All the station figures (years recorded, first and last year, total
+observations, coverage) come out of a single grouped pass. Large
+inventories can be aggregated chunk by chunk: partial results are per
+station, so memory is bounded by the number of stations, not of files.
+"""
+import pandas as pd
+
+from . import trace
+
+STAT_COLUMNS = ['count', 'max', 'min', 'obs', 'coverage']
+
+
+def _partial(df):
+    return df.groupby(level=0).agg(
+        count=('year', 'size'), max=('year', 'max'), min=('year', 'min'), obs=('obs', 'sum'))
+
+
+def _merge(a, b):
+    df = pd.concat([a, b])
+    return df.groupby(level=0).agg({'count': 'sum', 'max': 'max', 'min': 'min', 'obs': 'sum'})
+
+
+def _finish(df):
+    # share of the years between the first and the last one that have data
+    df['coverage'] = df['count'] / (df['max'] - df['min'] + 1)
+    return df[STAT_COLUMNS]
+
+
+def station_stats(dfGsod):
+    """``count, max, min, obs, coverage`` per station of an ``id`` indexed inventory."""
+    with trace.stage('station_stats', rows=len(dfGsod)):
+        return _finish(_partial(dfGsod))
+
+
+def year_histogram(dfGsod):
+    """Station files and observations per year."""
+    return dfGsod.groupby('year').agg(stations=('obs', 'size'), obs=('obs', 'sum'))
+
+
+def station_stats_csv(csv_path, chunksize=1000000):
+    """Station statistics and year histogram of an inventory CSV read in chunks."""
+    acc, histogram = None, None
+    for chunk in pd.read_csv(str(csv_path), index_col=['id'], chunksize=chunksize):
+        partial, hist = _partial(chunk), year_histogram(chunk)
+        if acc is None:
+            acc, histogram = partial, hist
+        else:
+            acc = _merge(acc, partial)
+            histogram = histogram.add(hist, fill_value=0).astype(int)
+    if acc is None:
+        return (pd.DataFrame(columns=STAT_COLUMNS),
+                pd.DataFrame(columns=['stations', 'obs']))
+    return _finish(acc), histogram
+
+
+def join_stations(stations, stats):
+    """The stations with observations, next to their statistics (``stations.csv``)."""
+    return stations.join(stats, how='inner')
+
+
+def write_stations(scdf, path):
+    """Write the joined table of :func:`join_stations` as ``stations.csv``.
+
+    The columns added for the pipeline (``key``, ``coverage``) are left out
+    and the USAF/WBAN numbers zero padded, so the file keeps the schema of
+    the published one.
+    """
+    df = scdf.drop(columns=[c for c in ('key', 'coverage') if c in scdf])
+    for column, width in (('usaf', 6), ('wban', 5)):
+        if column in df and pd.api.types.is_integer_dtype(df[column]):
+            df[column] = df[column].map(('{:0%dd}' % width).format)
+    df.to_csv(str(path))
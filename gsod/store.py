@@ -0,0 +1,87 @@
+"""Columnar on-disk store for the observations.
+
+Observations are kept as a Parquet dataset partitioned by ``year`` and
+``koppen`` (hive layout, ``observations/year=1990/koppen=Csa/*.parquet``)
+so readers only touch the partitions and columns they ask for. Requires
+``pyarrow``.
+"""
+import uuid
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from . import trace
+
+PARTITIONS = ['year', 'koppen']
+MISSING_KOPPEN = 'NA'
+
+
+def append(df, root):
+    """Add the rows of ``df`` to the dataset at ``root``.
+
+    ``df`` must hold the partition columns; every call writes new files so
+    batches can be appended one after the other. Rows without a Köppen
+    class are stored under ``koppen=NA``.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    df = df.assign(koppen=df['koppen'].fillna(MISSING_KOPPEN))
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    ds.write_dataset(
+        table, str(root), format='parquet',
+        partitioning=PARTITIONS, partitioning_flavor='hive',
+        basename_template='part-' + uuid.uuid4().hex + '-{i}.parquet',
+        existing_data_behavior='overwrite_or_ignore')
+
+
+def _filters(years, koppen, filters):
+    out = list(filters or [])
+    if years is not None:
+        out.append(('year', 'in', [int(y) for y in years]))
+    if koppen is not None:
+        out.append(('koppen', 'in', list(koppen)))
+    return out or None
+
+
+def read(root, columns=None, years=None, koppen=None, filters=None):
+    """Load observations from the dataset at ``root``.
+
+    ``columns`` projects the columns read; ``years`` and ``koppen`` prune
+    partitions, and ``filters`` takes extra pyarrow filter tuples such as
+    ``[('stn', '==', 82840)]``. Files are memory-mapped.
+    """
+    with trace.stage('store.read') as span:
+        df = pd.read_parquet(str(root), columns=columns, memory_map=True,
+                             filters=_filters(years, koppen, filters))
+        # partition keys come back as categoricals
+        if 'year' in df:
+            df['year'] = df['year'].astype(np.int16)
+        span.set(rows=len(df), bytes=int(df.memory_usage(deep=False).sum()))
+    return df
+
+
+def scan(root, columns=None, years=None, koppen=None, filters=None, batch_size=1 << 20):
+    """Observations of the dataset at ``root`` as a stream of frames.
+
+    Same arguments as :func:`read`, but at most ``batch_size`` rows are in
+    memory at a time.
+    """
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    filters = _filters(years, koppen, filters)
+    dataset = ds.dataset(str(root), format='parquet', partitioning='hive')
+    expression = pq.filters_to_expression(filters) if filters else None
+    for batch in dataset.to_batches(columns=columns, filter=expression, batch_size=batch_size):
+        if not batch.num_rows:
+            continue
+        df = batch.to_pandas()
+        if 'year' in df:
+            df['year'] = df['year'].astype(np.int16)
+        yield df
+
+
+def exists(root):
+    return any(Path(root).glob('**/*.parquet'))
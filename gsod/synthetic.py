@@ -0,0 +1,174 @@
+"""Synthetic GSOD archive for tests and benchmarks.
+
+Writes an ``ish-history.csv`` station list and the ``gsod/YEAR/*.op``
+station-year files (or NOAA's ``gsod_YYYY.tar`` of gzipped members) with
+the real fixed-width layout, header line and missing value codes. The
+weather is plausible rather than real: a seasonal temperature cycle that
+depends on latitude and elevation plus autocorrelated noise, pressure,
+visibility, wind, precipitation and the ``frshtt`` flags that go with it.
+Everything is drawn from a seeded generator, so the same arguments write
+the same bytes.
+"""
+import csv
+import gzip
+import io
+import tarfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+HEADER = ("STN--- WBAN   YEARMODA    TEMP       DEWP      SLP        STP       VISIB      "
+          "WDSP     MXSPD   GUST    MAX     MIN   PRCP   SNDP   FRSHTT\n")
+
+LINE = ("%06d %05d  %08d  %6.1f %2d  %6.1f %2d  %6.1f %2d  %6.1f %2d  %5.1f %2d  "
+        "%5.1f %2d  %5.1f  %5.1f  %6.1f%s %6.1f%s %5.2f%s %5.1f  %06d")
+
+COUNTRIES = ['US', 'CA', 'MX', 'BR', 'AR', 'SP', 'FR', 'UK', 'GM', 'IT',
+             'RS', 'CH', 'IN', 'JA', 'AS', 'SF', 'EG', 'NI', 'ID', 'NO']
+
+
+def stations(n, seed=0, missing_location=0.01):
+    """``n`` stations spread evenly over the globe, ``ish-history`` columns."""
+    rng = np.random.default_rng(seed)
+    usaf = 100000 + np.arange(n) * 10
+    lat = np.degrees(np.arcsin(rng.uniform(-0.97, 0.97, n)))
+    lon = rng.uniform(-180, 180, n)
+    elev = np.round(rng.exponential(300, n), 1)
+    df = pd.DataFrame({
+        'usaf': usaf, 'wban': 99999,
+        'stname': ["SYNTHETIC {:05d}".format(i) for i in range(n)],
+        'ctry': rng.choice(COUNTRIES, n), 'lat': lat, 'lon': lon, 'elev': elev})
+    df.loc[rng.random(n) < missing_location, ['lat', 'lon']] = np.nan
+    return df
+
+
+def write_ish_history(df, path):
+    """Station list in the quoted ``ish-history.csv`` layout."""
+    with open(str(path), 'w', newline='') as f:
+        out = csv.writer(f, quoting=csv.QUOTE_ALL)
+        out.writerow(["USAF", "WBAN", "STATION NAME", "CTRY", "FIPS", "STATE",
+                      "CALL", "LAT", "LON", "ELEV(.1M)"])
+        for row in df.itertuples():
+            located = not np.isnan(row.lat)
+            out.writerow([
+                "{:06d}".format(row.usaf), "{:05d}".format(row.wban), row.stname,
+                row.ctry, row.ctry, "", "",
+                "{:+06d}".format(int(round(row.lat * 1000))) if located else "",
+                "{:+07d}".format(int(round(row.lon * 1000))) if located else "",
+                "{:+06d}".format(int(round(row.elev * 10)))])
+
+
+def _smooth_noise(rng, n, sd, memory=5):
+    # white noise through an exponential filter: day to day persistence
+    kernel = np.exp(-np.arange(4 * memory) / memory)
+    noise = np.convolve(rng.normal(0, 1, n + len(kernel)), kernel, 'valid')[:n]
+    return noise * sd / np.sqrt((kernel ** 2).sum())
+
+
+def _missing(rng, values, rate, code):
+    return np.where(rng.random(len(values)) < rate, code, values)
+
+
+def observations(station, years, rng, coverage=1.0, missing=0.02):
+    """``(year, lines)`` of one station: the observed days as ``.op`` lines."""
+    start = np.datetime64('{}-01-01'.format(years[0]))
+    days = np.arange(start, np.datetime64('{}-01-01'.format(years[-1] + 1)))
+    days = days[rng.random(len(days)) < coverage]
+    n = len(days)
+    if not n:
+        return []
+    lat = 0.0 if np.isnan(station.lat) else station.lat
+    doy = (days - days.astype('datetime64[Y]')).astype(np.int64)
+    mean = 27 - 0.4 * abs(lat) - 0.0065 * station.elev
+    amplitude = 2 + 0.3 * abs(lat)
+    season = np.cos(2 * np.pi * (doy - 200) / 365.25) * np.sign(lat or 1)
+    tempC = mean + amplitude * season + _smooth_noise(rng, n, 3)
+    spread = rng.uniform(3, 8, n)
+
+    def F(c):
+        return np.round(c * 9 / 5 + 32, 1)
+
+    prcp = np.where(rng.random(n) < 0.3, np.round(rng.exponential(0.2, n), 2), 0.0)
+    rain = prcp > 0
+    fog = rng.random(n) < 0.05
+    hail = rng.random(n) < 0.002
+    thunder = rain & (rng.random(n) < 0.1)
+    tornado = rng.random(n) < 0.0005
+    frshtt = (fog * 100000 + (rain & (tempC > 0)) * 10000 + (rain & (tempC <= 0)) * 1000
+              + hail * 100 + thunder * 10 + tornado)
+    slp = np.round(1013 + _smooth_noise(rng, n, 8), 1)
+    wdsp = np.round(rng.gamma(2, 3, n), 1)
+    ymd = (days.astype('datetime64[Y]').astype(np.int64) + 1970) * 10000 \
+        + (days.astype('datetime64[M]').astype(np.int64) % 12 + 1) * 100 \
+        + (days - days.astype('datetime64[M]')).astype(np.int64) + 1
+
+    columns = [
+        np.full(n, station.usaf), np.full(n, station.wban), ymd,
+        _missing(rng, F(tempC), missing, 9999.9), rng.integers(4, 25, n),
+        _missing(rng, F(tempC - rng.uniform(1, 10, n)), missing * 2, 9999.9), rng.integers(4, 25, n),
+        _missing(rng, slp, 0.2, 9999.9), rng.integers(4, 25, n),
+        _missing(rng, np.round(slp - station.elev / 8.3, 1), 0.5, 9999.9), rng.integers(4, 25, n),
+        _missing(rng, np.round(rng.uniform(2, 20, n), 1), 0.1, 999.9), rng.integers(4, 25, n),
+        _missing(rng, wdsp, missing, 999.9), rng.integers(4, 25, n),
+        _missing(rng, np.round(wdsp + rng.uniform(2, 10, n), 1), 0.05, 999.9),
+        _missing(rng, np.round(wdsp + rng.uniform(10, 20, n), 1), 0.7, 999.9),
+        _missing(rng, F(tempC + spread), missing, 9999.9), rng.choice([' ', '*'], n, p=[0.9, 0.1]),
+        _missing(rng, F(tempC - spread), missing, 9999.9), rng.choice([' ', '*'], n, p=[0.9, 0.1]),
+        _missing(rng, prcp, 0.05, 99.99), rng.choice(list('ABCDEFGHI'), n),
+        np.full(n, 999.9), frshtt,
+    ]
+    rows = zip(*[c.tolist() for c in columns])
+    year = ymd // 10000
+    bounds = np.flatnonzero(np.diff(year)) + 1
+    lines = [LINE % row for row in rows]
+    out = []
+    for a, b in zip(np.r_[0, bounds], np.r_[bounds, n]):
+        out.append((int(year[a]), '\n'.join(lines[a:b]) + '\n'))
+    return out
+
+
+def op_name(station, year):
+    return "{:06d}-{:05d}-{}.op".format(station.usaf, station.wban, year)
+
+
+def generate(root, n_stations=100, years=(1990, 1991), coverage=0.9, missing=0.02,
+             seed=0, tars=False):
+    """Write a synthetic archive under ``root`` and return its stations.
+
+    ``root/ish-history.csv`` lists the stations and ``root/gsod/YEAR/`` holds
+    one ``.op`` file per station and year, ``coverage`` of the days present
+    (about ``n_stations * len(years) * 365 * coverage`` rows). With ``tars``
+    every year goes to ``root/gsod/gsod_YYYY.tar`` instead, one gzipped
+    member per station.
+    """
+    root = Path(root)
+    raw = root.joinpath('gsod')
+    raw.mkdir(parents=True, exist_ok=True)
+    years = list(range(years[0], years[-1] + 1))
+    rng = np.random.default_rng(seed)
+    df = stations(n_stations, seed=seed)
+    write_ish_history(df, root.joinpath('ish-history.csv'))
+
+    archives = {}
+    try:
+        if tars:
+            for year in years:
+                archives[year] = tarfile.open(str(raw.joinpath('gsod_{}.tar'.format(year))), 'w')
+        for station in df.itertuples():
+            for year, text in observations(station, years, rng, coverage, missing):
+                data = (HEADER + text).encode('ascii')
+                name = op_name(station, year)
+                if tars:
+                    blob = gzip.compress(data, compresslevel=6)
+                    info = tarfile.TarInfo('./{}.gz'.format(name))
+                    info.size = len(blob)
+                    archives[year].addfile(info, io.BytesIO(blob))
+                else:
+                    folder = raw.joinpath(str(year))
+                    folder.mkdir(exist_ok=True)
+                    folder.joinpath(name).write_bytes(data)
+    finally:
+        for tar in archives.values():
+            tar.close()
+    return df
@@ -0,0 +1,213 @@
+"""Per-station time series over the observation store.
+
+:class:`StationIndex` keeps the compact observations (:func:`gsod.features.compact`)
+sorted by station ``key`` and ``date``, one array per column, next to the
+sorted station keys and the offset of each station's first row. A query is
+two binary searches: the station among the keys, then the date range among
+that station's days; the columns come back as views of the arrays, so the
+cost does not depend on the size of the store::
+
+    stationIndex = timeseries.load('data/ncdc/observations', measures=['slp'])
+    summer = stationIndex.get('082840-99999', '1990-06-01', '1990-08-31')
+
+The index is saved as one ``.npy`` file per array next to the store
+(``observations.index/``) and memory-mapped when loaded; it is built again
+when the store files (or the code of the package) changed since.
+"""
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from . import trace
+from .features import compact, from_days
+
+READ_COLUMNS = ['stn', 'wban', 'year', 'monthday', 'temp', 'max', 'min', 'frshtt', 'koppen']
+
+
+def _column(df, name):
+    return df[name].values if name in df.columns else df.index.get_level_values(name).values
+
+
+def to_key(station):
+    """Packed key of a station given as a key or a ``"usaf-wban"`` id."""
+    if isinstance(station, str):
+        usaf, wban = station.split('-')
+        return int(usaf) * 100000 + int(wban)
+    return int(station)
+
+
+def _day(date):
+    return int(np.datetime64(date, 'D').astype(np.int64))
+
+
+class StationIndex(object):
+    """Observations sorted by ``(key, date)`` with the offsets of every station.
+
+    ``keys`` are the sorted station keys and the rows of ``keys[i]`` are
+    ``offsets[i]:offsets[i + 1]`` of every array in ``columns`` (``date``
+    as int32 days and the measures). ``koppen`` is the class of every
+    station.
+    """
+
+    def __init__(self, keys, offsets, columns, koppen=None):
+        self.keys = keys
+        self.offsets = offsets
+        self.columns = columns
+        self.koppen = koppen
+
+    @classmethod
+    def from_frame(cls, df):
+        """Index a compact frame (``key`` and ``date`` as columns or index levels)."""
+        with trace.stage('timeseries.build', rows=len(df)):
+            key = np.asarray(_column(df, 'key'), dtype=np.int64)
+            date = np.asarray(_column(df, 'date'), dtype=np.int32)
+            order = np.lexsort((date, key))
+            key = key[order]
+            starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]]) if len(key) else \
+                np.empty(0, dtype=np.int64)
+            offsets = np.append(starts, len(key)).astype(np.int64)
+            columns = {'date': date[order]}
+            for name in df.columns:
+                if name in ('key', 'date', 'koppen'):
+                    continue
+                columns[name] = np.asarray(df[name].values)[order]
+            koppen = None
+            if 'koppen' in df.columns:
+                koppen = np.asarray(df['koppen'].astype(object).values[order[starts]], dtype=str)
+        return cls(key[starts], offsets, columns, koppen)
+
+    @classmethod
+    def from_store(cls, root, measures=(), **kwargs):
+        """Index the observations of the store at ``root``.
+
+        ``measures`` are raw columns to keep next to the temperatures and
+        flags (``slp``, ``prcp``...); ``kwargs`` go to :func:`gsod.store.read`.
+        """
+        from . import store
+        df = store.read(root, columns=READ_COLUMNS + list(measures), **kwargs)
+        return cls.from_frame(compact(df, measures=measures))
+
+    def __len__(self):
+        return len(self.columns['date'])
+
+    @property
+    def names(self):
+        """The columns besides ``date``."""
+        return [name for name in self.columns if name != 'date']
+
+    def station(self, station):
+        """Position of a station in :attr:`keys`; ``KeyError`` when not indexed."""
+        key = to_key(station)
+        i = int(np.searchsorted(self.keys, key))
+        if i == len(self.keys) or self.keys[i] != key:
+            raise KeyError(station)
+        return i
+
+    def locate(self, station, start=None, end=None):
+        """``(lo, hi)`` rows of a station between ``start`` and ``end`` (both included)."""
+        i = self.station(station)
+        lo, hi = int(self.offsets[i]), int(self.offsets[i + 1])
+        dates = self.columns['date'][lo:hi]
+        first = lo
+        if start is not None:
+            lo = first + int(np.searchsorted(dates, _day(start), 'left'))
+        if end is not None:
+            hi = first + int(np.searchsorted(dates, _day(end), 'right'))
+        return lo, max(lo, hi)
+
+    def _frame(self, rows, columns, index):
+        columns = self.names if columns is None else columns
+        data = {name: self.columns[name][rows] for name in columns}
+        return pd.DataFrame(data, index=index, copy=False)
+
+    def arrays(self, station, start=None, end=None, columns=None):
+        """The ``date`` and ``columns`` arrays of a station between two dates, as views."""
+        lo, hi = self.locate(station, start, end)
+        columns = self.columns if columns is None else ['date'] + list(columns)
+        return {name: self.columns[name][lo:hi] for name in columns}
+
+    def get(self, station, start=None, end=None, columns=None):
+        """Observations of a station between two dates, indexed by ``date``.
+
+        The columns are views of the index arrays, not copies: read-only when
+        the index is memory-mapped, ``copy()`` the frame to modify them.
+        """
+        lo, hi = self.locate(station, start, end)
+        rows = slice(lo, hi)
+        index = pd.DatetimeIndex(from_days(self.columns['date'][rows]), name='date')
+        return self._frame(rows, columns, index)
+
+    def get_many(self, stations, start=None, end=None, columns=None):
+        """Observations of several stations, indexed by ``(key, date)``.
+
+        Stations that are not indexed are skipped.
+        """
+        bounds = []
+        for station in stations:
+            try:
+                bounds.append((to_key(station),) + self.locate(station, start, end))
+            except KeyError:
+                continue
+        bounds = np.array(bounds, dtype=np.int64).reshape(-1, 3)
+        lengths = bounds[:, 2] - bounds[:, 1]
+        # every range lo:hi in one array of row numbers
+        rows = np.arange(lengths.sum()) + np.repeat(bounds[:, 1] - np.cumsum(lengths) + lengths,
+                                                    lengths)
+        keys = np.repeat(bounds[:, 0], lengths)
+        index = pd.MultiIndex.from_arrays(
+            [keys, pd.DatetimeIndex(from_days(self.columns['date'][rows]))], names=['key', 'date'])
+        return self._frame(rows, columns, index)
+
+    def save(self, path, source=None):
+        """Write the arrays to the folder ``path``; ``source`` tags what was indexed."""
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        np.save(str(path.joinpath('keys.npy')), self.keys)
+        np.save(str(path.joinpath('offsets.npy')), self.offsets)
+        for name, values in self.columns.items():
+            np.save(str(path.joinpath(name + '.npy')), values)
+        if self.koppen is not None:
+            np.save(str(path.joinpath('koppen.npy')), self.koppen)
+        with open(str(path.joinpath('index.json')), 'w') as f:
+            json.dump({'columns': list(self.columns), 'source': source}, f)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Index saved by :meth:`save`, memory-mapped unless ``mmap`` is false."""
+        path = Path(path)
+        mode = 'r' if mmap else None
+        with open(str(path.joinpath('index.json'))) as f:
+            meta = json.load(f)
+        columns = {name: np.load(str(path.joinpath(name + '.npy')), mmap_mode=mode)
+                   for name in meta['columns']}
+        koppen = path.joinpath('koppen.npy')
+        return cls(np.load(str(path.joinpath('keys.npy'))),
+                   np.load(str(path.joinpath('offsets.npy'))), columns,
+                   np.load(str(koppen)) if koppen.exists() else None)
+
+
+def index_path(root):
+    """The index kept next to a store: ``observations`` -> ``observations.index``."""
+    root = Path(root)
+    return root.with_name(root.name + '.index')
+
+
+def source(path):
+    with open(str(Path(path).joinpath('index.json'))) as f:
+        return json.load(f)['source']
+
+
+def load(root, measures=(), path=None):
+    """The index of the store at ``root``, built and saved when missing or stale."""
+    from .cache import code_version, folder_digest
+
+    path = index_path(root) if path is None else Path(path)
+    # the code too: a change of the compact layout changes the arrays
+    digest = {'store': folder_digest(root), 'measures': sorted(measures), 'code': code_version()}
+    if path.joinpath('index.json').exists() and source(path) == digest:
+        return StationIndex.load(path)
+    index = StationIndex.from_store(root, measures)
+    index.save(path, source=digest)
+    return StationIndex.load(path)
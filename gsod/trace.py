@@ -0,0 +1,229 @@
+"""Per-stage instrumentation: time, rows, bytes and memory.
+
+Stages are marked with :func:`stage` (or whole functions with
+:func:`traced`)::
+
+    with trace.stage('parse', files=len(paths)) as span:
+        df = reader.read_op_files(paths)
+        span.set(rows=len(df))
+
+Nothing is recorded until :func:`enable` is called (or ``GSOD_TRACE`` is
+set to an output file when :mod:`gsod.trace` is imported); until then
+:func:`stage` hands out a shared no-op span, so the marks can stay in
+production code. Every finished stage records its wall and CPU time, the
+fields given (``rows``, ``bytes``...), the resident memory at its end and
+its peak, and optionally the peak of ``tracemalloc`` allocations. The
+records are exported as JSON lines, to a logger, or as a Chrome trace
+(``chrome://tracing``, Perfetto).
+"""
+import atexit
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc as _tracemalloc
+from functools import wraps
+
+_recorder = None
+
+
+def rss(pid=None):
+    """Current resident memory of this process (or of ``pid``), in bytes."""
+    try:
+        with open('/proc/{}/statm'.format(pid or 'self')) as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # gone, or no /proc: only this process' peak is known
+        return peak_rss() if pid is None else 0
+
+
+def children_rss():
+    """Current resident memory of the live worker processes, summed."""
+    return sum(rss(p.pid) for p in multiprocessing.active_children())
+
+
+def peak_rss(who=resource.RUSAGE_SELF):
+    """Peak resident memory in bytes (``ru_maxrss`` is in KiB on Linux)."""
+    peak = resource.getrusage(who).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class _NullSpan(object):
+    """What :func:`stage` returns while tracing is off."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **fields):
+        pass
+
+
+_NULL = _NullSpan()
+
+
+class Span(object):
+    """A stage being measured; :meth:`set` adds fields to its record."""
+
+    def __init__(self, recorder, name, fields):
+        self.recorder = recorder
+        self.name = name
+        self.fields = fields
+        self.alloc_peak = 0
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def __enter__(self):
+        self.recorder._push(self)
+        self.peak_before = peak_rss()
+        self.rss_before = rss()
+        self.start = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        cpu = time.process_time() - self.cpu
+        now, peak = rss(), peak_rss()
+        self.recorder._pop(self)
+        event = {
+            'stage': self.name, 'start': self.start - self.recorder.origin,
+            'seconds': end - self.start, 'cpu_seconds': cpu,
+            'rss': now,
+            # the process peak is only this stage's when it rose meanwhile
+            'peak_rss': max(peak if peak > self.peak_before else self.rss_before, now),
+            'depth': self.depth, 'thread': threading.get_ident(),
+        }
+        if self.recorder.tracemalloc:
+            event['peak_alloc'] = self.alloc_peak
+        if exc[0] is not None:
+            event['error'] = exc[0].__name__
+        event.update(self.fields)
+        self.recorder._record(event)
+        return False
+
+
+class Recorder(object):
+    """Collects the records of the finished stages."""
+
+    def __init__(self, tracemalloc=False, logger=None):
+        self.tracemalloc = tracemalloc
+        self.logger = logger
+        self.events = []
+        self.stack = []
+        self.origin = time.perf_counter()
+        self.lock = threading.Lock()
+        if tracemalloc and not _tracemalloc.is_tracing():
+            _tracemalloc.start()
+
+    def _push(self, span):
+        span.depth = len(self.stack)
+        if self.tracemalloc:
+            # fold the peak so far into the parent before resetting it
+            if self.stack:
+                parent = self.stack[-1]
+                parent.alloc_peak = max(parent.alloc_peak, _tracemalloc.get_traced_memory()[1])
+            _tracemalloc.reset_peak()
+        self.stack.append(span)
+
+    def _pop(self, span):
+        if self.tracemalloc:
+            span.alloc_peak = max(span.alloc_peak, _tracemalloc.get_traced_memory()[1])
+        if self.stack and self.stack[-1] is span:
+            self.stack.pop()
+        if self.tracemalloc and self.stack:
+            parent = self.stack[-1]
+            parent.alloc_peak = max(parent.alloc_peak, span.alloc_peak)
+
+    def _record(self, event):
+        with self.lock:
+            self.events.append(event)
+        if self.logger is not None:
+            self.logger.info(json.dumps(event))
+
+    def to_frame(self):
+        import pandas as pd
+        return pd.DataFrame(self.events)
+
+    def write_log(self, path):
+        """The records as JSON lines."""
+        with open(str(path), 'w') as f:
+            for event in self.events:
+                f.write(json.dumps(event) + '\n')
+
+    def write_chrome_trace(self, path):
+        """The records as complete (``X``) events of the Chrome trace format."""
+        pid = os.getpid()
+        events = []
+        for e in self.events:
+            args = {k: v for k, v in e.items() if k not in ('stage', 'start', 'seconds', 'thread')}
+            events.append({'name': e['stage'], 'ph': 'X', 'pid': pid, 'tid': e['thread'],
+                           'ts': e['start'] * 1e6, 'dur': e['seconds'] * 1e6, 'args': args})
+        with open(str(path), 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def write(self, path):
+        """Chrome trace for ``.json`` paths, JSON lines otherwise."""
+        if str(path).endswith('.json'):
+            self.write_chrome_trace(path)
+        else:
+            self.write_log(path)
+
+
+def stage(name, **fields):
+    """Span measuring the stage ``name`` (a no-op while tracing is off)."""
+    if _recorder is None:
+        return _NULL
+    return Span(_recorder, name, fields)
+
+
+def traced(name):
+    """Decorator running every call of a function as the stage ``name``."""
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if _recorder is None:
+                return func(*args, **kwargs)
+            with Span(_recorder, name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def enable(tracemalloc=False, logger=None):
+    """Start recording; returns the :class:`Recorder`.
+
+    ``tracemalloc`` adds the peak of Python/NumPy allocations of every stage
+    (slower); ``logger`` gets every record as a JSON message.
+    """
+    global _recorder
+    _recorder = Recorder(tracemalloc=tracemalloc, logger=logger)
+    return _recorder
+
+
+def disable():
+    """Stop recording; returns the :class:`Recorder` with what was recorded."""
+    global _recorder
+    recorder, _recorder = _recorder, None
+    if recorder is not None and recorder.tracemalloc:
+        _tracemalloc.stop()
+    return recorder
+
+
+def enabled():
+    return _recorder is not None
+
+
+def recorder():
+    return _recorder
+
+
+if os.environ.get('GSOD_TRACE'):
+    enable(tracemalloc=bool(os.environ.get('GSOD_TRACE_MALLOC')))
+    atexit.register(lambda path=os.environ['GSOD_TRACE']: _recorder and _recorder.write(path))
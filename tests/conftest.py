@@ -0,0 +1,26 @@
+import shutil
+
+import pytest
+
+from gsod import synthetic
+
+
+@pytest.fixture(scope='session')
+def archive(tmp_path_factory):
+    """A synthetic ``raw`` folder: ``ish-history.csv`` and ``gsod/YEAR/*.op``."""
+    root = tmp_path_factory.mktemp('archive')
+    synthetic.generate(root, n_stations=30, years=(1990, 1991), seed=1)
+    return root
+
+
+@pytest.fixture
+def data(tmp_path):
+    """A data folder laid out like ``data/ncdc``, the year files packed in tars."""
+    synthetic.generate(tmp_path.joinpath('raw'), n_stations=40, years=(1990, 1991), seed=2,
+                       tars=True)
+    shutil.copy(str(tmp_path.joinpath('raw', 'ish-history.csv')), str(tmp_path))
+    # one Köppen class per 60 degrees band of latitude
+    tmp_path.joinpath('regions.asc').write_text(
+        'ncols 6\nnrows 3\nxllcorner -180\nyllcorner -90\ncellsize 60\nnodata_value -9999\n'
+        + '11 11 11 11 11 11\n12 12 12 12 12 12\n13 13 13 13 13 13\n')
+    return tmp_path
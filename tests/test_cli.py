@@ -0,0 +1,37 @@
+import shutil
+
+import pandas as pd
+import pytest
+
+from gsod import cli, cube, store
+
+
+def ingest(data):
+    assert cli.main(['ingest', str(data), '--workers', '1', '--batch-size', '5']) == 0
+    df = store.read(data.joinpath('observations'))
+    df = df.sort_values(['stn', 'wban', 'year', 'monthday']).reset_index(drop=True)
+    return df, cube.load(data.joinpath('observations.cube.parquet'))
+
+
+def test_ingest_again_from_scratch(data):
+    assert cli.main(['inventory', str(data), '--workers', '1']) == 0
+    assert cli.main(['select', str(data), '--regions', str(data.joinpath('regions.asc'))]) == 0
+    first, first_cube = ingest(data)
+    inventory = pd.read_csv(str(data.joinpath('gsod.csv')), index_col=['id'])
+    selected = pd.read_csv(str(data.joinpath('selected.csv')), index_col=['id'])
+    assert len(first) == inventory.join(selected[[]], how='inner')['obs'].sum()
+    assert first_cube['days'].sum() == len(first)
+
+    # a store already there is left alone
+    with pytest.raises(SystemExit):
+        cli.main(['ingest', str(data)])
+    shutil.rmtree(str(data.joinpath('observations')))
+    second, second_cube = ingest(data)
+    pd.testing.assert_frame_equal(second, first)
+    pd.testing.assert_frame_equal(second_cube, first_cube)
+
+
+def test_inventory_without_inputs(tmp_path):
+    tmp_path.joinpath('raw', 'gsod').mkdir(parents=True)
+    with pytest.raises(SystemExit):
+        cli.main(['inventory', str(tmp_path)])
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+
+from gsod import cube, features, reader
+
+
+def observations(archive):
+    df = reader.read_op_files(sorted(archive.glob('gsod/*/*.op')))
+    df['koppen'] = np.where(df['stn'] % 2 == 0, 'Cfb', 'Csa')
+    return df
+
+
+def test_rollup_matches_groupby(archive):
+    df = observations(archive)
+    rolled = cube.rollup(cube.build(df), ['koppen', 'year'], ['tempC', 'maxC'])
+    managed = df.assign(tempC=features.to_celsius(df['temp']), maxC=features.to_celsius(df['max']))
+    expected = managed.groupby(['koppen', 'year'])[['tempC', 'maxC']].agg(
+        ['count', 'mean', 'std', 'min', 'max'])
+    rolled.index = rolled.index.set_levels(rolled.index.levels[1].astype(np.int64), level=1)
+    expected.index = expected.index.set_levels(expected.index.levels[1].astype(np.int64), level=1)
+    pd.testing.assert_frame_equal(rolled, expected, check_dtype=False, check_names=False)
+
+
+def test_flag_days(archive):
+    df = observations(archive)
+    rolled = cube.rollup(cube.build(df), 'koppen', features.FLAGS, stats=('sum',))
+    flags = pd.DataFrame(features.frshtt_digits(df['frshtt']), columns=features.FLAGS)
+    expected = flags.groupby(df['koppen'].values).sum()
+    for flag in features.FLAGS:
+        assert (rolled[(flag, 'sum')].values == expected[flag].values).all(), flag
+
+
+def test_combine_batches(archive):
+    df = observations(archive)
+    half = len(df) // 2
+    merged = cube.combine(pd.concat([cube.build(df.iloc[:half]), cube.build(df.iloc[half:])]))
+    pd.testing.assert_frame_equal(merged, cube.build(df), check_dtype=False)
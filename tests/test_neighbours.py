@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+
+from gsod import neighbours
+
+
+def stations(n=200, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'lat': rng.uniform(-80, 80, n), 'lon': rng.uniform(-180, 180, n),
+                         'count': rng.integers(0, 40, n), 'elev': rng.uniform(0, 2000, n)},
+                        index=['{:06d}-99999'.format(i) for i in range(n)])
+
+
+def test_nearest_matches_haversine():
+    df = stations()
+    search = neighbours.StationSearch(df, leaf_size=4)
+    found = search.nearest([39.49, -33.9], [-0.47, 151.2], k=5)
+    for query, (lat, lon) in enumerate([(39.49, -0.47), (-33.9, 151.2)]):
+        d = neighbours.haversine(lat, lon, df['lat'].values, df['lon'].values)
+        expected = np.sort(d)[:5]
+        got = found.loc[found['query'] == query, 'distance'].values
+        np.testing.assert_allclose(got, expected, rtol=1e-9)
+
+
+def test_empty_filter():
+    search = neighbours.StationSearch(stations())
+    # no station has that many observations
+    nearest = search.nearest(39.49, -0.47, k=3, min_count=1000)
+    assert list(nearest.columns) == ['query', 'rank', 'id', 'distance']
+    assert nearest.empty
+    within = search.within([39.49], [-0.47], radius=5000, min_count=1000)
+    assert list(within.columns) == ['query', 'id', 'distance']
+    assert within.empty
+    near = search.neighbours(search.stations.index[:2], k=2, min_count=1000)
+    assert list(near.columns) == ['station', 'rank', 'id', 'distance']
+    assert near.empty
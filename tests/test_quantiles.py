@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+from gsod import quantiles
+
+
+def sketches(n=50000, seed=0):
+    rng = np.random.default_rng(seed)
+    keys = pd.DataFrame({'key': rng.integers(0, 50, n), 'year': rng.integers(1990, 1995, n),
+                         'koppen': rng.choice(['Cfb', 'BWh', 'Csa'], n)})
+    values = rng.normal(15, 8, n)
+    values[rng.random(n) < 0.01] = np.nan
+    sketchSet = quantiles.SketchSet()
+    for i in range(0, n, 7000):
+        sketchSet.update(keys.iloc[i:i + 7000], values[i:i + 7000])
+    return sketchSet, keys, values
+
+
+def test_update_matches_one_digest_per_group():
+    sketchSet, keys, values = sketches()
+    rows = (keys[['key', 'year', 'koppen']].apply(tuple, axis=1) == (3, 1991, 'Csa')).values
+    digest = sketchSet.digests[(3, 1991, 'Csa')]
+    assert digest.count == (~np.isnan(values[rows])).sum()
+    assert digest.min == np.nanmin(values[rows])
+    assert digest.max == np.nanmax(values[rows])
+
+
+def test_merged_quartiles():
+    sketchSet, keys, values = sketches()
+    q = [0.25, 0.5, 0.75]
+    np.testing.assert_allclose(sketchSet.merged().quantile(q), np.nanquantile(values, q), atol=0.1)
+    cfb = (keys['koppen'] == 'Cfb').values
+    rolled = sketchSet.merged(koppen='Cfb')
+    assert rolled.count == (~np.isnan(values[cfb])).sum()
+    np.testing.assert_allclose(rolled.quantile(q), np.nanquantile(values[cfb], q), atol=0.15)
+    where = sketchSet.merged(lambda key: key[2] == 'Cfb')
+    np.testing.assert_allclose(rolled.quantile(q), where.quantile(q), atol=0.1)
+
+
+def test_rollups_follow_updates():
+    sketchSet, keys, values = sketches()
+    before = sketchSet.merged(koppen='BWh').count
+    sketchSet.update(pd.DataFrame({'key': [1], 'year': [1990], 'koppen': ['BWh']}), [20.0])
+    assert sketchSet.merged(koppen='BWh').count == before + 1
+
+
+def test_qcut_skewed():
+    rng = np.random.default_rng(1)
+    # mostly dry days: the lower quartiles collapse on 0
+    prcp = np.where(rng.random(10000) < 0.6, 0.0, rng.exponential(0.3, 10000))
+    digest = quantiles.TDigest().update(prcp)
+    labels = ['1=0%tile', '2=25%tile', '3=50%tile', '4=75%tile']
+    binned = quantiles.qcut(prcp, digest, 4, labels=labels)
+    assert list(binned.categories) == labels[-2:]
+    assert binned.isna().sum() == 0
+    assert (binned[prcp == 0] == labels[-2]).all()
+    zeros = np.zeros(5)
+    constant = quantiles.qcut(zeros, quantiles.TDigest().update(zeros), 4, labels=labels)
+    assert list(constant.categories) == labels[-1:] and constant.notna().all()
@@ -0,0 +1,29 @@
+import numpy as np
+import pandas as pd
+
+from gsod import reader
+
+
+def test_parity_with_read_fwf(archive):
+    paths = sorted(archive.glob('gsod/*/*.op'))
+    df = reader.read_op_files(paths)
+    expected = pd.concat([pd.read_fwf(str(p), colspecs=reader.COLSPECS, names=reader.NAMES,
+                                      skiprows=1, dtype={c: str for c in reader.FLAG_COLUMNS})
+                          for p in paths], ignore_index=True)
+    assert list(df.columns) == reader.NAMES
+    assert len(df) == len(expected)
+    for column in reader.NAMES:
+        if column in reader.FLAG_COLUMNS:
+            assert (df[column].fillna('').astype(str).values
+                    == expected[column].fillna('').astype(str).values).all(), column
+        else:
+            np.testing.assert_allclose(df[column].values.astype(np.float64),
+                                       expected[column].values.astype(np.float64),
+                                       err_msg=column)
+
+
+def test_columns_subset(archive):
+    paths = sorted(archive.glob('gsod/1990/*.op'))[:3]
+    df = reader.read_op_files(paths, columns=['stn', 'temp', 'frshtt'])
+    assert list(df.columns) == ['stn', 'temp', 'frshtt']
+    assert df.equals(reader.read_op_files(paths)[['stn', 'temp', 'frshtt']])
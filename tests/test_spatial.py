@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+
+from gsod import spatial
+
+
+def brute_force(points, x):
+    return np.sqrt(((x[:, None, :] - points[None, :, :]) ** 2).sum(axis=2))
+
+
+@pytest.mark.parametrize('n', [1, 17, 500])
+def test_kdtree_query(n):
+    rng = np.random.default_rng(n)
+    points, x = rng.normal(size=(n, 3)), rng.normal(size=(40, 3))
+    tree = spatial.KDTree(points, leaf_size=4)
+    items, distances = tree.query(x, k=5)
+    d = brute_force(points, x)
+    k = min(5, n)
+    np.testing.assert_allclose(distances, np.sort(d, axis=1)[:, :k])
+    np.testing.assert_allclose(np.take_along_axis(d, items, axis=1), distances)
+
+
+def test_kdtree_query_radius():
+    rng = np.random.default_rng(0)
+    points, x = rng.normal(size=(500, 3)), rng.normal(size=(40, 3))
+    r = rng.uniform(0.2, 1, 40)
+    q, items, distances = spatial.KDTree(points, leaf_size=8).query_radius(x, r)
+    d = brute_force(points, x)
+    expected_q, expected_items = np.nonzero(d <= r[:, None])
+    assert sorted(zip(q, items)) == sorted(zip(expected_q, expected_items))
+    np.testing.assert_allclose(distances, d[q, items])
+
+
+def test_kdtree_empty():
+    tree = spatial.KDTree(np.zeros((0, 3)))
+    assert len(tree) == 0
+    items, distances = tree.query(np.ones((2, 3)), k=3)
+    assert items.shape == distances.shape == (2, 0)
+    q, items, distances = tree.query_radius(np.ones((2, 3)), 1.0)
+    assert len(q) == len(items) == len(distances) == 0
+
+
+def test_rtree_query_points():
+    rng = np.random.default_rng(1)
+    lo = rng.uniform(0, 90, size=(300, 2))
+    boxes = np.hstack([lo, lo + rng.uniform(0, 10, size=(300, 2))])
+    x, y = rng.uniform(0, 100, 200), rng.uniform(0, 100, 200)
+    points, items = spatial.RTree(boxes, node_size=8).query_points(x, y)
+    inside = ((boxes[None, :, 0] <= x[:, None]) & (x[:, None] <= boxes[None, :, 2])
+              & (boxes[None, :, 1] <= y[:, None]) & (y[:, None] <= boxes[None, :, 3]))
+    assert sorted(zip(points, items)) == sorted(zip(*np.nonzero(inside)))
+
+
+def test_rtree_empty():
+    points, items = spatial.RTree(np.zeros((0, 4))).query_points([1.0], [2.0])
+    assert len(points) == len(items) == 0